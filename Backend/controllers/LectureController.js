@@ -3,7 +3,13 @@ import Joi from "joi";
 import path from "path";
 import { AWS_CONFIG } from "../config.js";
 import { Lecture, Student } from "../models/index.js";
-import { verifyAttendance } from "../services/index.js";
+import {
+  getAnnotatedImage,
+  getGallery,
+  getGalleryVersion,
+  uploadGallery,
+  verifyAttendance,
+} from "../services/index.js";
 import ResponseHandler from "../utils/ResponseHandler.js";
 import fs from "fs";
 
@@ -114,21 +120,53 @@ const create = async (req, res) => {
     }
     lecture.images = uploadedImages;
 
-    // Get student embeddings
-    const studentEmbeddings = await Student.find(
+    // Make sure the recognizer has this division's gallery cached
+    const students = await Student.find(
       {
         division: value.division,
       },
-      { embeddings: 1, rollNumber: 1 }
+      { rollNumber: 1, updatedAt: 1 }
     );
+    const galleryId = value.division;
+    const galleryVersion = getGalleryVersion(students);
+    const loadEmbeddings = () =>
+      Student.find(
+        {
+          division: value.division,
+        },
+        { embeddings: 1, rollNumber: 1 }
+      );
+
+    const cachedGallery = await getGallery(galleryId);
+    if (!cachedGallery || cachedGallery.version !== galleryVersion) {
+      await uploadGallery({
+        galleryId,
+        version: galleryVersion,
+        studentEmbeddings: await loadEmbeddings(),
+      });
+    }
 
     // Call external API for attendance verification
-    const apiResponse = await verifyAttendance({
+    const attendanceRequest = {
       images: files,
-      studentEmbeddings: studentEmbeddings,
+      galleryId,
+      galleryVersion,
       subjectId: value.subjectId,
       lectureId: lecture.id,
-    });
+    };
+    let apiResponse;
+    try {
+      apiResponse = await verifyAttendance(attendanceRequest);
+    } catch (err) {
+      // Gallery was evicted in the meantime: send it inline with this request
+      if (!err.response || err.response.status !== 409) {
+        throw err;
+      }
+      apiResponse = await verifyAttendance({
+        ...attendanceRequest,
+        studentEmbeddings: await loadEmbeddings(),
+      });
+    }
 
     // Update attendance from AI results
     if (apiResponse.data && apiResponse.data.results) {
@@ -138,18 +176,21 @@ const create = async (req, res) => {
       );
 
       // Save attendance
-      lecture.attendance = studentEmbeddings.map((student) => ({
+      lecture.attendance = students.map((student) => ({
         rollNumber: student.rollNumber,
         present: presentRollNumbers.includes(student.rollNumber),
       }));
 
-      // Save annotated images
-      lecture.annotatedImages = apiResponse.data.results.map((result) => ({
-        fileName: result.fileName,
-        fileSize: result.fileSize,
-        key: result.key,
-        url: result.url,
-      }));
+      // Save annotated images (no key when the recognizer skips annotation, no size until
+      // a deferred or lazy one is rendered)
+      lecture.annotatedImages = apiResponse.data.results
+        .filter((result) => result.key)
+        .map((result) => ({
+          fileName: result.fileName,
+          fileSize: result.fileSize || 0,
+          key: result.key,
+          url: result.url,
+        }));
     }
 
     // Save lecture
@@ -292,6 +333,28 @@ const remove = async (req, res) => {
   }
 };
 
+// ANNOTATED IMAGE
+const getAnnotated = async (req, res) => {
+  try {
+    const lecture = await Lecture.findById(req.params.id);
+    if (!lecture) {
+      return ResponseHandler.notFound(res, "Lecture not found");
+    }
+    const image = await getAnnotatedImage(
+      lecture.subjectId.toString(),
+      lecture.id,
+      req.params.fileName
+    );
+    res.set("Content-Type", "image/jpeg");
+    return res.send(image);
+  } catch (err) {
+    if (err.response && err.response.status === 404) {
+      return ResponseHandler.notFound(res, "Annotated image not found");
+    }
+    return ResponseHandler.error(res, err);
+  }
+};
+
 // GENERATE ATTENDANCE
 const generateAttendance = async (req, res) => {
   try {
@@ -357,6 +420,7 @@ export default {
   getById,
   update,
   remove,
+  getAnnotated,
   generateAttendance,
   removeAll,
 };
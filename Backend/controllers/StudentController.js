@@ -3,7 +3,12 @@ import Joi from "joi";
 import path from "path";
 import { AWS_CONFIG } from "../config.js";
 import { Student } from "../models/index.js";
-import { generateEmbeddings } from "../services/index.js";
+import {
+  generateEmbeddings,
+  getGalleryVersion,
+  removeFromIdentityIndex,
+  updateGallery,
+} from "../services/index.js";
 import ResponseHandler from "../utils/ResponseHandler.js";
 
 // Configure AWS S3
@@ -13,6 +18,29 @@ const s3 = new AWS.S3({
   region: AWS_CONFIG.region,
 });
 
+const getDivisionVersion = async (division) =>
+  getGalleryVersion(
+    await Student.find({ division }, { rollNumber: 1, updatedAt: 1 })
+  );
+
+// Push a student change to the recognizer's cached gallery. A stale or
+// missing gallery is fine: the next lecture detects it and re-uploads.
+const syncGallery = async ({ division, baseVersion, upserts, removals }) => {
+  try {
+    await updateGallery({
+      galleryId: division,
+      baseVersion,
+      version: await getDivisionVersion(division),
+      upserts,
+      removals,
+    });
+  } catch (err) {
+    if (!err.response || err.response.status !== 409) {
+      console.error("Error updating recognizer gallery:", err.message);
+    }
+  }
+};
+
 // CREATE
 const create = async (req, res) => {
   // Validate request body
@@ -115,17 +143,23 @@ const create = async (req, res) => {
       images: uploadedImages,
     };
 
+    const baseVersion = await getDivisionVersion(value.division);
     const student = await Student.create(studentData);
     // const student = { ...studentData };
 
     // Call external API to generate embeddings
-    const apiResponse = await generateEmbeddings(files);
+    const apiResponse = await generateEmbeddings(files, { rollNumber: student.rollNumber });
     // console.log("API Response:", apiResponse.data);
     // console.log("API Response:", apiResponse.data.embeddings);
 
     if (apiResponse.data.embeddings) {
       student.embeddings = apiResponse.data.embeddings;
       await student.save();
+      await syncGallery({
+        division: student.division,
+        baseVersion,
+        upserts: [{ rollNumber: student.rollNumber, embeddings: student.embeddings }],
+      });
     }
 
     return ResponseHandler.success(
@@ -238,7 +272,18 @@ const remove = async (req, res) => {
       }
     }
 
+    const baseVersion = await getDivisionVersion(student.division);
     await Student.findByIdAndDelete(req.params.id);
+    await syncGallery({
+      division: student.division,
+      baseVersion,
+      removals: [student.rollNumber],
+    });
+    try {
+      await removeFromIdentityIndex(student.rollNumber);
+    } catch (err) {
+      console.error("Error removing student from recognizer index:", err.message);
+    }
     return ResponseHandler.success(res, null, "Student deleted successfully");
   } catch (err) {
     return ResponseHandler.error(res, err);
@@ -276,6 +321,11 @@ const removeAll = async (req, res) => {
     }
 
     await Student.deleteMany({});
+    try {
+      await Promise.all(students.map((student) => removeFromIdentityIndex(student.rollNumber)));
+    } catch (err) {
+      console.error("Error removing students from recognizer index:", err.message);
+    }
     return ResponseHandler.success(res, null, "All students deleted");
   } catch (err) {
     return ResponseHandler.error(res, err);
@@ -9,6 +9,7 @@ router.get('/', lectureController.getAll);
 router.get('/:id', idValidator, lectureController.getById);
 router.put('/:id', idValidator, lectureController.update);
 router.delete('/:id', idValidator, lectureController.remove);
+router.get('/:id/annotated/:fileName', idValidator, lectureController.getAnnotated);
 router.post('/:id/generate', idValidator, lectureController.generateAttendance);
 router.delete('/', lectureController.removeAll);
 
@@ -1,27 +1,125 @@
 import axios from "axios";
+import crypto from "crypto";
 import FormData from "form-data";
 
-export async function generateEmbeddings(files) {
+// Binary embedding blob shared with the recognizer (see FaceRecognizer/utils/wire.py):
+// "FEMB", u8 version, u8 dtype (1 = float32), 2 reserved bytes, u32 rows, u32 dim,
+// u32 id table length, "\n"-joined ids padded to 4 bytes, then little-endian floats.
+const EMBEDDINGS_MEDIA_TYPE = "application/x-face-embeddings";
+const EMBEDDINGS_HEADER_SIZE = 20;
+
+export function encodeEmbeddings(rows) {
+    const dim = rows.length > 0 ? rows[0].embedding.length : 0;
+    const idTable = Buffer.from(rows.map((row) => row.id).join("\n"), "utf8");
+    const padding = (4 - (idTable.length % 4)) % 4;
+
+    const header = Buffer.alloc(EMBEDDINGS_HEADER_SIZE);
+    header.write("FEMB", 0, "ascii");
+    header.writeUInt8(1, 4);
+    header.writeUInt8(1, 5);
+    header.writeUInt32LE(rows.length, 8);
+    header.writeUInt32LE(dim, 12);
+    header.writeUInt32LE(idTable.length, 16);
+
+    const data = Buffer.alloc(rows.length * dim * 4);
+    rows.forEach((row, i) => {
+        row.embedding.forEach((value, j) => data.writeFloatLE(value, (i * dim + j) * 4));
+    });
+
+    return Buffer.concat([header, idTable, Buffer.alloc(padding), data]);
+}
+
+export function decodeEmbeddings(blob) {
+    if (blob.toString("ascii", 0, 4) !== "FEMB" || blob.readUInt8(5) !== 1) {
+        throw new Error("Unsupported embedding blob");
+    }
+    const rows = blob.readUInt32LE(8);
+    const dim = blob.readUInt32LE(12);
+    const idsLength = blob.readUInt32LE(16);
+
+    const ids = rows > 0
+        ? blob.toString("utf8", EMBEDDINGS_HEADER_SIZE, EMBEDDINGS_HEADER_SIZE + idsLength).split("\n")
+        : [];
+    const offset = EMBEDDINGS_HEADER_SIZE + idsLength + ((4 - (idsLength % 4)) % 4);
+
+    return ids.map((id, i) => {
+        const embedding = new Array(dim);
+        for (let j = 0; j < dim; j++) {
+            embedding[j] = blob.readFloatLE(offset + (i * dim + j) * 4);
+        }
+        return { id, embedding };
+    });
+}
+
+// Flattens [{ rollNumber, embeddings: [{ image, embedding }] }] into one blob row per embedding
+function encodeStudentEmbeddings(studentEmbeddings) {
+    return encodeEmbeddings(
+        studentEmbeddings.flatMap((student) =>
+            (student.embeddings || []).map((item) => ({
+                id: student.rollNumber,
+                embedding: item.embedding,
+            }))
+        )
+    );
+}
+
+// With a rollNumber the recognizer also enrolls the student in its /identify index
+export async function generateEmbeddings(files, { rollNumber } = {}) {
     const formData = new FormData();
     files.forEach((file) => {
         formData.append("files", file.buffer, file.originalname);
     });
+    if (rollNumber) {
+        formData.append("rollNumber", rollNumber);
+    }
 
     const apiResponse = await axios.post(
         `${process.env.FACE_RECOGNIZER_SERVICE_URL}/generate-embeddings`,
         formData,
-        { headers: formData.getHeaders() }
+        {
+            headers: { ...formData.getHeaders(), Accept: `${EMBEDDINGS_MEDIA_TYPE}, application/json;q=0.5` },
+            responseType: "arraybuffer",
+        }
     );
+
+    // Keep the JSON shape ({ embeddings: [{ image, embedding }] }) for callers
+    const body = Buffer.from(apiResponse.data);
+    if ((apiResponse.headers["content-type"] || "").startsWith(EMBEDDINGS_MEDIA_TYPE)) {
+        apiResponse.data = {
+            embeddings: decodeEmbeddings(body).map(({ id, embedding }) => ({ image: id, embedding })),
+        };
+    } else {
+        apiResponse.data = JSON.parse(body.toString("utf8"));
+    }
     return apiResponse;
 }
 
-export async function verifyAttendance({ images, studentEmbeddings, subjectId, lectureId }) {
+export async function removeFromIdentityIndex(rollNumber) {
+    try {
+        await axios.delete(
+            `${process.env.FACE_RECOGNIZER_SERVICE_URL}/identify/students/${encodeURIComponent(rollNumber)}`
+        );
+    } catch (err) {
+        if (!err.response || err.response.status !== 404) {
+            throw err;
+        }
+    }
+}
+
+export async function verifyAttendance({ images, studentEmbeddings, galleryId, galleryVersion, subjectId, lectureId }) {
     const formData = new FormData();
     images.forEach((file) => {
         formData.append("images", file.buffer, file.originalname);
     });
 
-    formData.append("studentEmbeddings", JSON.stringify(studentEmbeddings));
+    // Prefer the recognizer's cached gallery; inline embeddings are only sent as a fallback
+    if (studentEmbeddings) {
+        formData.append("embeddingsBlob", encodeStudentEmbeddings(studentEmbeddings), "embeddings.bin");
+    }
+    if (galleryId) {
+        formData.append("galleryId", galleryId);
+        formData.append("galleryVersion", galleryVersion);
+    }
     formData.append("subjectId", subjectId);
     formData.append("lectureId", lectureId);
 
@@ -34,6 +132,67 @@ export async function verifyAttendance({ images, studentEmbeddings, subjectId, l
     return apiResponse;
 }
 
+// Annotated JPEG of one lecture photo; the recognizer renders it on first request when annotation is lazy
+export async function getAnnotatedImage(subjectId, lectureId, fileName) {
+    const apiResponse = await axios.get(
+        `${process.env.FACE_RECOGNIZER_SERVICE_URL}/annotated/${encodeURIComponent(subjectId)}/${encodeURIComponent(lectureId)}/${encodeURIComponent(fileName)}`,
+        { responseType: "arraybuffer" }
+    );
+    return Buffer.from(apiResponse.data);
+}
+
+// Version of a division's gallery, derived from each student's last update
+export function getGalleryVersion(students) {
+    const hash = crypto.createHash("sha1");
+    students
+        .map((student) => `${student.rollNumber}:${new Date(student.updatedAt).getTime()}`)
+        .sort()
+        .forEach((entry) => hash.update(`${entry}\n`));
+    return hash.digest("hex");
+}
+
+export async function getGallery(galleryId) {
+    try {
+        const apiResponse = await axios.get(
+            `${process.env.FACE_RECOGNIZER_SERVICE_URL}/galleries/${encodeURIComponent(galleryId)}`
+        );
+        return apiResponse.data;
+    } catch (err) {
+        if (err.response && err.response.status === 404) {
+            return null;
+        }
+        throw err;
+    }
+}
+
+export async function uploadGallery({ galleryId, version, studentEmbeddings }) {
+    const formData = new FormData();
+    formData.append("version", version);
+    formData.append("embeddingsBlob", encodeStudentEmbeddings(studentEmbeddings), "embeddings.bin");
+
+    const apiResponse = await axios.put(
+        `${process.env.FACE_RECOGNIZER_SERVICE_URL}/galleries/${encodeURIComponent(galleryId)}`,
+        formData,
+        { headers: formData.getHeaders() }
+    );
+    return apiResponse;
+}
+
+export async function updateGallery({ galleryId, baseVersion, version, upserts = [], removals = [] }) {
+    const formData = new FormData();
+    formData.append("baseVersion", baseVersion);
+    formData.append("version", version);
+    formData.append("upsertsBlob", encodeStudentEmbeddings(upserts), "embeddings.bin");
+    formData.append("removals", JSON.stringify(removals));
+
+    const apiResponse = await axios.patch(
+        `${process.env.FACE_RECOGNIZER_SERVICE_URL}/galleries/${encodeURIComponent(galleryId)}`,
+        formData,
+        { headers: formData.getHeaders() }
+    );
+    return apiResponse;
+}
+
 
 
 // studentEmbeddings = [
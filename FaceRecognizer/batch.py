@@ -0,0 +1,242 @@
+"""
+Offline enrollment and attendance runs over folders of photos, spread over a
+process pool with one FaceAnalysis per worker.
+
+    enroll  <photos>  every <rollNumber>.jpg is embedded into an embedding
+                      store (utils/store.py), e.g. INDEX_DIR for /identify
+    attend  <photos>  every lecture photo is matched against a store's
+                      gallery, optionally writing annotated copies
+
+Photos are found recursively, so a term's archive (<subject>/<lecture>/*.jpg)
+can be processed in one run. Every result is appended to an NDJSON file as
+soon as its photo is done; that file is also the checkpoint: re-running the
+same command skips every photo already in it (use --restart to start over).
+Photos in flight when a worker process dies are recorded as "failed" and
+are picked up again by the next run.
+
+Run from FaceRecognizer/:
+python batch.py enroll testing/student_images --store testing/db --output enroll.ndjson
+python batch.py attend archive/2025-odd --store testing/db --output attendance.ndjson --annotate annotated/
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png"}
+
+_gallery = None  # per worker process, see init_attend_worker
+
+
+def find_photos(root: Path) -> list[str]:
+    return sorted(
+        str(path.relative_to(root)) for path in root.rglob("*")
+        if path.is_file() and path.suffix.lower() in IMAGE_SUFFIXES
+    )
+
+
+def read_checkpoint(output: Path) -> set[str]:
+    """
+    Photos already recorded in `output`, except those recorded as "failed".
+    A line cut short by a crash is dropped from the file so appending
+    continues on a clean line.
+    """
+    if not output.exists():
+        return set()
+    done, valid = set(), 0
+    with output.open("rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+                if record.get("status") == "failed":
+                    done.discard(record["photo"])
+                else:
+                    done.add(record["photo"])
+            except (ValueError, KeyError):
+                break
+            valid += len(line)
+    if valid < output.stat().st_size:
+        with output.open("r+b") as f:
+            f.truncate(valid)
+    return done
+
+
+def init_enroll_worker():
+    from utils.pipeline import init_worker
+    init_worker()
+
+
+def init_attend_worker(store_dir: str):
+    global _gallery
+    from utils.gallery import CachedGallery, students_from_rows
+    from utils.pipeline import init_worker
+    from utils.store import EmbeddingStore
+
+    init_worker()
+    # Read-only, so no worker can take the store's writer lock. The gallery
+    # copies the rows, so each worker holds its own copy of the matrix.
+    store = EmbeddingStore(store_dir, read_only=True)
+    _gallery = CachedGallery.from_students(store_dir, store.generation.name, students_from_rows(*store.rows())).gallery
+    store.close()
+
+
+def enroll_one(root: str, photo: str, strict: bool) -> dict:
+    from utils.pipeline import enroll_photo
+
+    result = enroll_photo((Path(root) / photo).read_bytes(), strict)
+    embedding = result["embedding"]
+    return {
+        "photo": photo,
+        "rollNumber": Path(photo).stem,
+        "status": result["status"],
+        "faces": result["faces"],
+        "embedding": embedding.tolist() if embedding is not None else None,
+    }
+
+
+def attend_one(root: str, photo: str, annotate: str | None) -> dict:
+    from utils.config import QUALITY_GATE
+    from utils.matcher import match_faces
+    from utils.pipeline import detect_and_align, embed_crops, render_annotated
+
+    contents = (Path(root) / photo).read_bytes()
+    detection = detect_and_align(contents, keep_image=annotate is not None, quality_gate=QUALITY_GATE)
+    matched_ids, scores = match_faces(embed_crops(detection["crops"]), _gallery)
+
+    if annotate:
+        image_bytes, _ = render_annotated(detection.get("image", contents), detection["bboxes"], matched_ids)
+        target = Path(annotate) / photo
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(image_bytes)
+
+    return {
+        "photo": photo,
+        "status": "processed",
+        "matchedIds": matched_ids,
+        "scores": scores,
+        "bboxes": detection["bboxes"].round(1).tolist(),
+        "rejected": [
+            {"bbox": bbox.round(1).tolist(), "reason": str(reason)}
+            for bbox, reason in zip(detection["rejected_bboxes"], detection["rejected_reasons"])
+        ],
+    }
+
+
+def run(args) -> int:
+    root = Path(args.photos)
+    output = Path(args.output)
+    if args.restart and output.exists():
+        output.unlink()
+
+    photos = find_photos(root)
+    done = read_checkpoint(output)
+    todo = [photo for photo in photos if photo not in done]
+    print(f"[INFO] {len(photos)} photos, {len(done)} already in {output}, {len(todo)} to process "
+          f"on {args.workers} workers")
+    if not todo:
+        return 0
+
+    # On CPU (INFERENCE_DEVICE=cpu) split the cores between the workers' ONNX sessions
+    os.environ.setdefault("ORT_INTRA_OP_THREADS", str(max(1, (os.cpu_count() or 1) // args.workers)))
+
+    store = None
+    if args.command == "enroll":
+        from utils.store import EmbeddingStore
+        store = EmbeddingStore(args.store)
+        executor = ProcessPoolExecutor(max_workers=args.workers, initializer=init_enroll_worker)
+        task, extra = enroll_one, (not args.allow_multiple,)
+    else:
+        executor = ProcessPoolExecutor(max_workers=args.workers, initializer=init_attend_worker,
+                                       initargs=(args.store,))
+        task, extra = attend_one, (args.annotate,)
+
+    started = time.perf_counter()
+    counts = {}
+    pending = {}  # future -> photo
+    broken = False
+    queue = iter(todo)
+    with executor, output.open("a", encoding="utf-8") as out:
+        while True:
+            # Keep a bounded number of photos in flight
+            while not broken and len(pending) < 4 * args.workers:
+                photo = next(queue, None)
+                if photo is None:
+                    break
+                pending[executor.submit(task, str(root), photo, *extra)] = photo
+            if not pending:
+                break
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                photo = pending.pop(future)
+                try:
+                    record = future.result()
+                except BrokenProcessPool as e:
+                    # A worker died (e.g. out of memory) and took the pool with it: every photo
+                    # still in flight ends up here and is checkpointed as failed, for the next run
+                    if not broken:
+                        print(f"[ERROR] Worker pool broke, stopping: {e}")
+                    broken = True
+                    record = {"photo": photo, "status": "failed", "error": str(e)}
+                except Exception as e:
+                    # Not checkpointed, so the photo is retried on the next run
+                    print(f"[ERROR] {e}")
+                    counts["error"] = counts.get("error", 0) + 1
+                    continue
+
+                if store is not None and record.get("embedding") is not None:
+                    store.put(record["rollNumber"], record["embedding"])
+                if not args.keep_embeddings:
+                    record.pop("embedding", None)
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                counts[record["status"]] = counts.get(record["status"], 0) + 1
+
+            processed = sum(counts.values())
+            if processed % 50 == 0 or not pending:
+                elapsed = time.perf_counter() - started
+                print(f"[RUN] {processed}/{len(todo)} photos, {processed / elapsed:.1f} photos/s")
+
+    if store is not None:
+        store.compact()
+        store.close()
+    print(f"✅ {json.dumps(counts)} in {time.perf_counter() - started:.1f}s, results in {output}")
+    if broken:
+        print("[INFO] Run the same command again to retry the failed photos")
+    return 1 if counts.get("error") or counts.get("failed") else 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Parallel, resumable enrollment and attendance runs")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enroll = commands.add_parser("enroll", help="Embed <rollNumber>.jpg photos into an embedding store")
+    enroll.add_argument("--allow-multiple", action="store_true",
+                        help="Use the highest scoring face of photos with several faces instead of skipping them")
+    enroll.add_argument("--keep-embeddings", action="store_true", help="Also write the embeddings to the NDJSON output")
+
+    attend = commands.add_parser("attend", help="Match lecture photos against an embedding store")
+    attend.add_argument("--annotate", default=None, help="Folder for annotated copies of the photos")
+    attend.set_defaults(keep_embeddings=False)
+
+    for command in (enroll, attend):
+        command.add_argument("photos", help="Folder of photos (searched recursively)")
+        command.add_argument("--store", required=True, help="Embedding store folder")
+        command.add_argument("--output", required=True, help="NDJSON results file, also the resume checkpoint")
+        command.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes")
+        command.add_argument("--restart", action="store_true", help="Ignore results from earlier runs")
+
+    return run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
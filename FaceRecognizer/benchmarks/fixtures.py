@@ -0,0 +1,82 @@
+"""
+Synthetic classroom photos and galleries built from the fixture images in
+testing/lecture_images.
+"""
+
+import io
+import math
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from utils.matcher import normalize
+from utils.pipeline import detect_and_align, embed_crops
+
+FIXTURE_DIR = Path(__file__).resolve().parent.parent / "testing" / "lecture_images"
+
+
+def harvest_faces(fixture_dir: Path = FIXTURE_DIR, limit: int = 200) -> tuple[list[Image.Image], np.ndarray]:
+    """
+    Detects the faces in the fixture photos and returns loose head crops
+    (box grown by 60%) together with their embeddings, used as the enrolled
+    identities of the synthetic gallery.
+    """
+    patches, crops = [], []
+    for path in sorted(fixture_dir.glob("*.jpg")):
+        contents = path.read_bytes()
+        detection = detect_and_align(contents, decode_mode="full")
+        image = Image.open(io.BytesIO(contents)).convert("RGB")
+
+        for bbox, crop in zip(detection["bboxes"], detection["crops"]):
+            cx, cy = (bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2
+            half = max(bbox[2] - bbox[0], bbox[3] - bbox[1]) * 0.8
+            patches.append(image.crop((int(cx - half), int(cy - half), int(cx + half), int(cy + half))))
+            crops.append(crop)
+            if len(patches) >= limit:
+                return patches, embed_crops(np.stack(crops))
+
+    if not patches:
+        raise RuntimeError(f"No faces found in {fixture_dir}")
+    return patches, embed_crops(np.stack(crops))
+
+
+def background(fixture_dir: Path = FIXTURE_DIR) -> Image.Image:
+    path = sorted(fixture_dir.glob("*.jpg"))[0]
+    return Image.open(path).convert("RGB").filter(ImageFilter.GaussianBlur(25))
+
+
+def classroom_photo(patches: list[Image.Image], faces: int, size: tuple[int, int], rng: np.random.Generator,
+                    backdrop: Image.Image | None = None) -> tuple[bytes, list[int]]:
+    """
+    Lays `faces` randomly chosen face patches out on a grid over a blurred
+    backdrop at `size`, and returns the JPEG bytes plus the patch index used
+    for every cell.
+    """
+    canvas = (backdrop or Image.new("RGB", size, (90, 90, 90))).resize(size)
+    columns = math.ceil(math.sqrt(faces * size[0] / size[1]))
+    rows = math.ceil(faces / columns)
+    cell = min(size[0] // columns, size[1] // rows)
+    side = int(cell * 0.85)
+
+    chosen = rng.choice(len(patches), size=faces, replace=faces > len(patches)).tolist()
+    for i, index in enumerate(chosen):
+        row, column = divmod(i, columns)
+        canvas.paste(patches[index].resize((side, side)), (column * cell, row * cell))
+
+    buf = io.BytesIO()
+    canvas.save(buf, format="JPEG", quality=90)
+    return buf.getvalue(), chosen
+
+
+def synthetic_gallery(identities: np.ndarray, size: int, rng: np.random.Generator) -> tuple[list[str], np.ndarray]:
+    """
+    Gallery of `size` students: the harvested identities first, then random
+    unit vectors as distractors. Returns one roll number per row.
+    """
+    distractors = max(size - len(identities), 0)
+    matrix = np.concatenate([
+        identities[:size],
+        normalize(rng.normal(size=(distractors, identities.shape[1]))),
+    ]).astype(np.float32)
+    return [f"S{i:06d}" for i in range(len(matrix))], matrix
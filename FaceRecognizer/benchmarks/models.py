@@ -0,0 +1,106 @@
+"""
+Cold-start and per-face latency of InsightFace model configurations.
+
+Every configuration is measured in a fresh process, so cold start covers
+importing insightface, creating the ONNX sessions and preparing them. The
+per-face numbers come from FaceAnalysis.get on the fixture photos in
+testing/lecture_images: detection per image, and everything after detection
+(recognition plus any gender/age and landmark models loaded) per face.
+
+Run from FaceRecognizer/:
+python -m benchmarks.models --packs buffalo_l,buffalo_s --output models.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import sys
+import time
+from pathlib import Path
+
+FIXTURE_DIR = Path(__file__).resolve().parent.parent / "testing" / "lecture_images"
+ALL_MODULES = "all"
+
+
+def measure(pack: str, modules: str, repeats: int) -> dict:
+    started = time.perf_counter()
+    import cv2
+    import numpy as np
+    from utils.models import load_face_analyzer
+    imported = time.perf_counter()
+
+    face_analyzer = load_face_analyzer(pack, None if modules == ALL_MODULES else modules.split(","))
+    loaded = time.perf_counter()
+
+    images = [cv2.imread(str(path)) for path in sorted(FIXTURE_DIR.glob("*.jpg"))]
+    face_analyzer.get(images[0])  # first run allocates ONNX Runtime buffers
+
+    detection_ms, per_face_ms, faces_seen = [], [], 0
+    for _ in range(repeats):
+        for image in images:
+            t0 = time.perf_counter()
+            bboxes, _ = face_analyzer.det_model.detect(image, max_num=0, metric='default')
+            t1 = time.perf_counter()
+            faces = face_analyzer.get(image)
+            t2 = time.perf_counter()
+
+            detection_ms.append((t1 - t0) * 1000)
+            if faces:
+                # get() detects again before running the per-face models
+                per_face_ms.append(((t2 - t1) - (t1 - t0)) * 1000 / len(faces))
+                faces_seen += len(faces)
+
+    with open("/proc/self/status") as f:
+        rss_kb = next((int(line.split()[1]) for line in f if line.startswith("VmRSS:")), 0)
+
+    return {
+        "pack": pack,
+        "modules": modules,
+        "loadedModels": sorted(face_analyzer.models),
+        "coldStart": {
+            "importSeconds": round(imported - started, 3),
+            "loadSeconds": round(loaded - imported, 3),
+        },
+        "detectionMsPerImage": round(float(np.median(detection_ms)), 2),
+        "perFaceMs": round(float(np.median(per_face_ms)), 2) if per_face_ms else None,
+        "facesMeasured": faces_seen,
+        "rssMb": round(rss_kb / 1024, 1),
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare cold start and per-face latency of model configurations")
+    parser.add_argument("--packs", default="buffalo_l,buffalo_s", help="Comma separated model packs")
+    parser.add_argument("--modules", default=f"{ALL_MODULES};detection,recognition",
+                        help="Semicolon separated module sets ('all' = whole pack)")
+    parser.add_argument("--repeats", type=int, default=3, help="Passes over the fixture photos")
+    parser.add_argument("--output", default=None, help="JSON file to write")
+    args = parser.parse_args(argv)
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for pack in args.packs.split(","):
+        for modules in args.modules.split(";"):
+            with context.Pool(1) as pool:
+                result = pool.apply(measure, (pack, modules, args.repeats))
+            results.append(result)
+            print(f"[RUN] {pack:<10} {modules:<22} cold start {result['coldStart']['loadSeconds']:>6}s  "
+                  f"detection {result['detectionMsPerImage']:>7}ms/image  "
+                  f"per face {result['perFaceMs']}ms  RSS {result['rssMb']}MB")
+
+    print("\n| Pack | Modules | Load (s) | Detection (ms/image) | Per face (ms) | RSS (MB) |")
+    print("| --- | --- | --- | --- | --- | --- |")
+    for r in results:
+        print(f"| {r['pack']} | {r['modules']} | {r['coldStart']['loadSeconds']} | "
+              f"{r['detectionMsPerImage']} | {r['perFaceMs']} | {r['rssMb']} |")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+        print(f"\n✅ Results saved to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""
+Accuracy check of the INT8 pack (MODEL_PRECISION=int8) against FP32.
+
+Runs both packs on the CPU over the fixture photos in testing/lecture_images
+and compares:
+- detection: share of FP32 faces the INT8 detector also finds (IoU >= 0.5)
+- recognition: cosine similarity of FP32 and INT8 embeddings of the same
+  aligned crops, so detector differences do not leak into this number
+- match decisions: every FP32 face is enrolled from its mirrored crop
+  (FP32) among random distractors, then matched with FP32 and with INT8
+  embeddings; the labels must agree
+plus the median per-image latency of each pipeline.
+
+Build the INT8 pack first (python -m utils.quantize), then from FaceRecognizer/:
+python -m benchmarks.quantization_check --min-cosine 0.98 --min-agreement 0.99
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from utils.config import MODEL_PACK
+from utils.matcher import Gallery, match_faces, normalize
+from utils.models import load_face_analyzer
+from utils.pipeline import detect_and_align, embed_crops, use_face_analyzer
+
+FIXTURE_DIR = Path(__file__).resolve().parent.parent / "testing" / "lecture_images"
+DISTRACTORS = 1000
+
+
+def iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU of two (N x 4) and (M x 4) box arrays."""
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter)
+
+
+def run_pipeline(face_analyzer, photos: list[bytes]) -> tuple[list[dict], list[float]]:
+    detections, latencies = [], []
+    with use_face_analyzer(face_analyzer):
+        detect_and_align(photos[0])  # first run allocates ONNX Runtime buffers
+        for contents in photos:
+            started = time.perf_counter()
+            detection = detect_and_align(contents, decode_mode="full")
+            detection["embeddings"] = embed_crops(detection["crops"])
+            latencies.append((time.perf_counter() - started) * 1000)
+            detections.append(detection)
+    return detections, latencies
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare the INT8 model pack against FP32")
+    parser.add_argument("--pack", default=MODEL_PACK)
+    parser.add_argument("--min-cosine", type=float, default=0.98, help="Minimum mean FP32/INT8 embedding cosine")
+    parser.add_argument("--min-agreement", type=float, default=0.99, help="Minimum share of identical match labels")
+    parser.add_argument("--min-detection-recall", type=float, default=0.97, help="Minimum share of FP32 faces found")
+    parser.add_argument("--output", default=None, help="JSON file to write")
+    args = parser.parse_args(argv)
+
+    photos = [path.read_bytes() for path in sorted(FIXTURE_DIR.glob("*.jpg"))]
+    fp32 = load_face_analyzer(args.pack, precision="fp32", device="cpu")
+    int8 = load_face_analyzer(args.pack, precision="int8")
+
+    fp32_detections, fp32_latency = run_pipeline(fp32, photos)
+    int8_detections, int8_latency = run_pipeline(int8, photos)
+
+    found = total = 0
+    for reference, candidate in zip(fp32_detections, int8_detections):
+        total += len(reference["bboxes"])
+        if len(reference["bboxes"]) and len(candidate["bboxes"]):
+            found += int(np.sum(iou(reference["bboxes"], candidate["bboxes"]).max(axis=1) >= 0.5))
+
+    crops = np.concatenate([d["crops"] for d in fp32_detections])
+    with use_face_analyzer(fp32):
+        reference = embed_crops(crops)
+        enrolled = embed_crops(crops[:, :, ::-1].copy())
+    with use_face_analyzer(int8):
+        quantized = embed_crops(crops)
+    cosine = np.sum(reference * quantized, axis=1)
+
+    rng = np.random.default_rng(0)
+    distractors = normalize(rng.normal(size=(DISTRACTORS, enrolled.shape[1]))).astype(np.float32)
+    gallery = Gallery(
+        np.concatenate([enrolled, distractors]),
+        [f"face-{i}" for i in range(len(enrolled))] + [f"distractor-{i}" for i in range(DISTRACTORS)]
+    )
+    fp32_labels, _ = match_faces(reference, gallery)
+    int8_labels, _ = match_faces(quantized, gallery)
+    agreement = float(np.mean([a == b for a, b in zip(fp32_labels, int8_labels)]))
+
+    report = {
+        "pack": args.pack,
+        "photos": len(photos),
+        "faces": int(len(crops)),
+        "detectionRecall": round(found / total, 4) if total else None,
+        "cosine": {
+            "mean": round(float(cosine.mean()), 4),
+            "p1": round(float(np.percentile(cosine, 1)), 4),
+            "min": round(float(cosine.min()), 4),
+        },
+        "matchAgreement": round(agreement, 4),
+        "fp32Recall": round(float(np.mean([l == f"face-{i}" for i, l in enumerate(fp32_labels)])), 4),
+        "int8Recall": round(float(np.mean([l == f"face-{i}" for i, l in enumerate(int8_labels)])), 4),
+        "msPerImage": {
+            "fp32": round(float(np.median(fp32_latency)), 2),
+            "int8": round(float(np.median(int8_latency)), 2),
+        },
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+    failures = []
+    if report["cosine"]["mean"] < args.min_cosine:
+        failures.append(f"mean cosine {report['cosine']['mean']} < {args.min_cosine}")
+    if agreement < args.min_agreement:
+        failures.append(f"match agreement {agreement:.4f} < {args.min_agreement}")
+    if total and found / total < args.min_detection_recall:
+        failures.append(f"detection recall {found / total:.4f} < {args.min_detection_recall}")
+    for failure in failures:
+        print(f"[FAIL] {failure}")
+    if failures:
+        return 1
+    print("✅ INT8 pack within tolerance of FP32")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+"""
+Offline benchmark of the recognition pipeline.
+
+Drives the real main.py app in-process (FastAPI TestClient, models loaded as
+configured through the usual environment variables) with synthetic classroom
+photos built from testing/lecture_images. S3 is replaced by an in-memory
+stub. For every combination of resolution, faces per image and gallery size
+it reports throughput, p50/p95/p99 latency per request and per stage (taken
+from the Server-Timing header) and the peak RSS of the whole scenario, and
+writes everything to JSON.
+
+Run from FaceRecognizer/:
+python -m benchmarks.run --faces 5,40,100 --gallery 50,5000,50000 --output results.json
+python -m benchmarks.run --baseline results.json  # fails when a stage's p95 regressed
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+os.environ.setdefault("AWS_BUCKET_NAME", "benchmark")
+os.environ.setdefault("AWS_REGION", "local")
+
+
+def parse_list(value: str, cast=int) -> list:
+    return [cast(v) for v in value.split(",") if v]
+
+
+def parse_resolution(value: str) -> tuple[int, int]:
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": round(float(p50), 2), "p95": round(float(p95), 2), "p99": round(float(p99), 2)}
+
+
+def parse_server_timing(header: str | None) -> dict:
+    stages = {}
+    for entry in (header or "").split(","):
+        name, _, duration = entry.strip().partition(";dur=")
+        if name and duration:
+            stages[name] = float(duration)
+    return stages
+
+
+def rss_bytes(pid: int) -> int:
+    """RSS of a process and all its children (worker pools), from /proc."""
+    total = 0
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1]) * 1024
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                total += sum(rss_bytes(int(child)) for child in f.read().split())
+    except (FileNotFoundError, ProcessLookupError):
+        pass
+    return total
+
+
+class PeakRSS:
+    """Samples RSS on a background thread while a scenario runs."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, rss_bytes(os.getpid()))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Returns one line per stage whose p95 grew by more than `tolerance`."""
+    previous = {s["name"]: s for s in baseline.get("scenarios", [])}
+    regressions = []
+    for scenario in results["scenarios"]:
+        old = previous.get(scenario["name"])
+        if old is None:
+            continue
+        for stage, stats in {"request": scenario["latency_ms"], **scenario["stages_ms"]}.items():
+            old_stats = old["latency_ms"] if stage == "request" else old["stages_ms"].get(stage)
+            if not old_stats or not stats or old_stats["p95"] <= 0:
+                continue
+            ratio = stats["p95"] / old_stats["p95"]
+            if ratio > 1 + tolerance:
+                regressions.append(
+                    f"{scenario['name']} {stage}: p95 {old_stats['p95']}ms -> {stats['p95']}ms ({ratio:.2f}x)"
+                )
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the recognition pipeline on synthetic classroom photos")
+    parser.add_argument("--resolutions", default="1280x960,4032x3024", help="Comma separated WxH photo sizes")
+    parser.add_argument("--faces", default="5,20,60,100", help="Comma separated faces per photo")
+    parser.add_argument("--gallery", default="50,1000,50000", help="Comma separated gallery sizes (students)")
+    parser.add_argument("--images-per-request", type=int, default=1, help="Photos sent per /verify-attendance call")
+    parser.add_argument("--requests", type=int, default=10, help="Timed requests per scenario")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed requests per scenario")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON file to write (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--baseline", default=None, help="Earlier results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed p95 growth before a stage counts as regressed")
+    args = parser.parse_args(argv)
+
+    from fastapi.testclient import TestClient
+
+    import main as app_module
+    from benchmarks.fixtures import background, classroom_photo, harvest_faces, synthetic_gallery
+    from benchmarks.stubs import install_stub_s3
+    from utils import config
+    from utils.wire import encode_embeddings
+
+    install_stub_s3()
+    rng = np.random.default_rng(args.seed)
+
+    results = {
+        "createdAt": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "config": {
+            name: getattr(config, name) for name in dir(config)
+            if name.isupper() and isinstance(getattr(config, name), (int, float, str))
+        },
+        "scenarios": [],
+    }
+
+    with TestClient(app_module.app) as client:
+        patches, identities = harvest_faces()
+        backdrop = background()
+        print(f"[INFO] {len(patches)} fixture faces harvested")
+
+        for gallery_size in parse_list(args.gallery):
+            row_ids, matrix = synthetic_gallery(identities, gallery_size, rng)
+            gallery_id = f"benchmark-{gallery_size}"
+            client.put(
+                f"/galleries/{gallery_id}",
+                data={"version": "1"},
+                files={"embeddingsBlob": ("gallery.bin", encode_embeddings(row_ids, matrix))}
+            ).raise_for_status()
+
+            for resolution in parse_list(args.resolutions, parse_resolution):
+                for faces in parse_list(args.faces):
+                    name = f"{resolution[0]}x{resolution[1]}/{faces}faces/{gallery_size}students"
+                    photos = [
+                        classroom_photo(patches, faces, resolution, rng, backdrop)
+                        for _ in range(args.images_per_request * (args.requests + args.warmup))
+                    ]
+
+                    latencies, stages, correct, total_faces = [], {}, 0, 0
+                    with PeakRSS() as rss:
+                        started = None
+                        for i in range(args.requests + args.warmup):
+                            if i == args.warmup:
+                                started = time.perf_counter()
+                            batch = photos[i * args.images_per_request:(i + 1) * args.images_per_request]
+                            request_start = time.perf_counter()
+                            response = client.post(
+                                "/verify-attendance",
+                                data={"subjectId": "benchmark", "lectureId": str(i),
+                                      "galleryId": gallery_id, "galleryVersion": "1"},
+                                files=[("images", (f"{j}.jpg", jpeg)) for j, (jpeg, _) in enumerate(batch)]
+                            )
+                            response.raise_for_status()
+                            if i < args.warmup:
+                                continue
+
+                            latencies.append((time.perf_counter() - request_start) * 1000)
+                            for stage, ms in parse_server_timing(response.headers.get("server-timing")).items():
+                                stages.setdefault(stage, []).append(ms)
+                            for result, (_, truth) in zip(response.json()["results"], batch):
+                                expected = {row_ids[t] for t in truth if t < gallery_size}
+                                correct += len(expected.intersection(result["matchedIds"]))
+                                total_faces += len(expected)
+                        wall = time.perf_counter() - started
+
+                    scenario = {
+                        "name": name,
+                        "resolution": list(resolution),
+                        "faces": faces,
+                        "gallery": gallery_size,
+                        "requests": args.requests,
+                        "imagesPerSecond": round(args.requests * args.images_per_request / wall, 3),
+                        "latency_ms": percentiles(latencies),
+                        "stages_ms": {stage: percentiles(values) for stage, values in sorted(stages.items())},
+                        "peakRssMb": round(rss.peak / 2 ** 20, 1),
+                        "recall": round(correct / total_faces, 3) if total_faces else None,
+                    }
+                    results["scenarios"].append(scenario)
+                    print(f"[RUN] {name}: {scenario['imagesPerSecond']} img/s, "
+                          f"p95 {scenario['latency_ms'].get('p95')}ms, peak RSS {scenario['peakRssMb']}MB")
+
+    output = Path(args.output) if args.output else (
+        Path(__file__).resolve().parent / "results" / f"{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\n✅ Results saved to {output}")
+
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for line in regressions:
+            print(f"[REGRESSION] {line}")
+        if regressions:
+            return 1
+        print("✅ No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,41 @@
+"""
+In-memory stand-in for the boto3 S3 client, so benchmarks measure the
+pipeline and not the network.
+"""
+
+import io
+import threading
+
+
+class StubS3:
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        with self._lock:
+            self.objects[(Bucket, Key)] = bytes(Body)
+        return {}
+
+    def delete_object(self, Bucket, Key):
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def get_object(self, Bucket, Key):
+        with self._lock:
+            if (Bucket, Key) not in self.objects:
+                raise self.exceptions.NoSuchKey(Key)
+            return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+
+def install_stub_s3() -> StubS3:
+    import utils.storage as storage
+
+    stub = StubS3()
+    storage._s3 = stub
+    return stub
@@ -0,0 +1,196 @@
+"""
+Memory per worker of the two multi-worker layouts:
+- per-worker: `uvicorn main:app --workers N`, every worker loads the models
+  and caches its own copy of every gallery
+- shared: `python serve.py --workers N`, one inference process holds the
+  models and the workers memory-map galleries from GALLERY_SHARED_DIR
+
+Each layout is started as a subprocess with the models configured through
+the usual environment variables. The same synthetic gallery is uploaded
+over fresh connections until every worker should hold it, and a few /detect
+requests on testing/lecture_images let every ONNX session allocate its
+buffers. Then RSS and PSS (RSS with shared pages divided between the
+processes mapping them) of every process of the layout are read from
+/proc/<pid>/smaps_rollup. PSS adds up to what the node really spends.
+
+Run from FaceRecognizer/:
+python -m benchmarks.worker_memory --workers 4 --students 2000 --photos 5 --output memory.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+from utils.matcher import normalize
+from utils.wire import MEDIA_TYPE, encode_embeddings
+
+FIXTURE_DIR = Path(__file__).resolve().parent.parent / "testing" / "lecture_images"
+MB = 1024 * 1024
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def descendants(pid: int) -> list[int]:
+    found = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                for child in map(int, f.read().split()):
+                    found += [child] + descendants(child)
+    except FileNotFoundError:
+        pass
+    return found
+
+
+def memory(pid: int) -> dict:
+    """Rss and Pss of one process in bytes."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Pss"):
+                values[key.lower()] = int(rest.split()[0]) * 1024
+    return values
+
+
+def synthetic_gallery(students: int, photos: int, seed: int = 0) -> bytes:
+    rng = np.random.default_rng(seed)
+    ids = [f"S{i:05d}" for i in range(students) for _ in range(photos)]
+    return encode_embeddings(ids, normalize(rng.normal(size=(len(ids), 512))))
+
+
+def start(layout: str, workers: int, port: int, env: dict, log) -> subprocess.Popen:
+    if layout == "shared":
+        command = [sys.executable, "serve.py", "--workers", str(workers), "--host", "127.0.0.1", "--port", str(port)]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--workers", str(workers),
+                   "--host", "127.0.0.1", "--port", str(port)]
+    return subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+
+def wait_ready(process: subprocess.Popen, url: str, timeout: float, log) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            log.seek(0)
+            raise RuntimeError(f"Server exited with {process.returncode}:\n{log.read().decode(errors='replace')}")
+        try:
+            if httpx.get(url, timeout=2).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(1)
+    raise TimeoutError(f"{url} not ready after {timeout:.0f}s")
+
+
+def measure(layout: str, args: argparse.Namespace, blob: bytes) -> dict:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, INFERENCE_WORKERS=str(args.inference_workers))
+    if layout == "shared":
+        env["GALLERY_SHARED_DIR"] = tempfile.mkdtemp(prefix="galleries-", dir=args.shared_root)
+        env["INFERENCE_SOCKET"] = os.path.join(tempfile.mkdtemp(), "inference.sock")
+    else:
+        env.pop("GALLERY_SHARED_DIR", None)
+        env["INFERENCE_BACKEND"] = "thread"
+
+    log = tempfile.TemporaryFile()
+    process = start(layout, args.workers, port, env, log)
+    try:
+        wait_ready(process, url, args.timeout, log)
+        # Fresh connections land on different workers; without a shared directory every one caches its own copy
+        for _ in range(4 * args.workers):
+            with httpx.Client(base_url=url, timeout=120) as client:
+                client.put("/galleries/benchmark", data={"version": "1"},
+                           files={"embeddingsBlob": ("embeddings.bin", blob, MEDIA_TYPE)}).raise_for_status()
+        photos = sorted(FIXTURE_DIR.glob("*.jpg"))[:args.photos_detected]
+        for _ in range(args.workers):
+            for photo in photos:
+                with httpx.Client(base_url=url, timeout=120) as client:
+                    client.post("/detect", files=[("images", (photo.name, photo.read_bytes(), "image/jpeg"))])
+        time.sleep(1)
+
+        inference_pid = None
+        if layout == "shared":
+            # serve.py prints "Inference process <pid> ready" once the models are loaded
+            log.seek(0)
+            match = re.search(rb"Inference process (\d+) ready", log.read())
+            inference_pid = int(match.group(1)) if match else None
+
+        processes = []
+        for pid in [process.pid] + descendants(process.pid):
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                cmdline = f.read().replace(b"\0", b" ").decode(errors="replace")
+            if "resource_tracker" in cmdline:
+                role = "resource tracker"
+            elif pid == process.pid:
+                role = "supervisor"
+            elif pid == inference_pid:
+                role = "inference"
+            else:
+                role = "worker"
+            processes.append({"pid": pid, "role": role, **memory(pid)})
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=60)
+        log.close()
+
+    workers = [p for p in processes if p["role"] == "worker"]
+    return {
+        "layout": layout,
+        "processes": processes,
+        "workerRssMB": round(sum(p["rss"] for p in workers) / len(workers) / MB, 1),
+        "workerPssMB": round(sum(p["pss"] for p in workers) / len(workers) / MB, 1),
+        "totalPssMB": round(sum(p["pss"] for p in processes) / MB, 1),
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="RSS/PSS per worker of the per-worker and shared layouts")
+    parser.add_argument("--workers", type=int, default=4, help="uvicorn workers")
+    parser.add_argument("--inference-workers", type=int, default=2, help="INFERENCE_WORKERS of every inference pool")
+    parser.add_argument("--students", type=int, default=2000, help="students in the synthetic gallery")
+    parser.add_argument("--photos", type=int, default=5, help="enrollment embeddings per student")
+    parser.add_argument("--photos-detected", type=int, default=3, help="fixture photos sent to /detect per worker")
+    parser.add_argument("--layouts", default="per-worker,shared")
+    parser.add_argument("--shared-root", default="/dev/shm", help="where the shared layout's GALLERY_SHARED_DIR goes")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for a layout to start")
+    parser.add_argument("--output", default=None, help="JSON file to write")
+    args = parser.parse_args(argv)
+
+    blob = synthetic_gallery(args.students, args.photos)
+    results = []
+    for layout in args.layouts.split(","):
+        result = measure(layout, args, blob)
+        results.append(result)
+        print(f"\n{layout}: {args.workers} workers, gallery of {args.students} x {args.photos} embeddings")
+        print(f"{'role':<17} {'pid':>8} {'RSS MB':>8} {'PSS MB':>8}")
+        for p in result["processes"]:
+            print(f"{p['role']:<17} {p['pid']:>8} {p['rss'] / MB:>8.1f} {p['pss'] / MB:>8.1f}")
+        print(f"per worker: RSS {result['workerRssMB']} MB, PSS {result['workerPssMB']} MB; "
+              f"all processes: PSS {result['totalPssMB']} MB")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({"args": vars(args), "results": results}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,114 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse
-from typing import List
+from fastapi import FastAPI, Request, UploadFile, File, Form, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from PIL import UnidentifiedImageError
+from typing import List, Optional
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
-import io
+import asyncio
 import json
+import logging
+import os
 import time
-from utils.storage import upload_to_s3, delete_from_s3
-from utils.config import load_env
-import insightface
+from concurrent.futures import ThreadPoolExecutor
+from utils.config import (
+    load_env, ANNOTATION_MODE, ANNOTATION_WORKERS, BULK_ENROLL_BATCH, DECODE_MODE, DET_SIZE, IDENTIFY_TOP_K, INDEX_DIR,
+    INFERENCE_SLOT_WAIT_SECONDS, PIPELINE_ANNOTATE_CONCURRENCY, PIPELINE_DEPTH, PIPELINE_DETECT_CONCURRENCY,
+    PIPELINE_EMBED_CONCURRENCY, QUALITY_GATE, REMATCH_DOWNLOAD_CONCURRENCY, STORE_LECTURE_FACES, TRACK_MERGE_SIMILARITY, UPLOAD_MODE
+)
+load_env()  # Load env vars from .env before the modules below read them
+
+from utils.storage import S3Uploader, delete_from_s3, download_from_s3, s3_location
+from utils.lecture_faces import FILENAME as LECTURE_FACES_FILE, decode_lecture_faces, encode_lecture_faces, lecture_path
+from utils.matcher import MATCH_SIMILARITY, UNKNOWN, match_faces
+from utils.index import IdentityIndex
+from utils.store import ReadOnlyStoreError
+from utils.gallery import CachedGallery, GalleryCache, StaleGalleryError, students_from_payload, students_from_rows
+from utils.wire import MEDIA_TYPE, WireFormatError, encode_embeddings, decode_embeddings, negotiate
+from utils.pipeline import detect_and_align, detect_faces, render_annotated
+from utils.workers import EmbeddingBatcher, InferencePool, ServerBusyError
+from utils.jobs import Job, JobStore, JobStoreFullError
+from utils.archive import iter_archive, read_batch
+from utils.inference_cache import InferenceCache
+from utils.stages import Stage, run_stages
+from utils.tracking import merge_tracks, suffix_of, track_faces
+from utils.metrics import (
+    FACES_PER_IMAGE, FACES_REJECTED, GALLERY_EMBEDDINGS, record_request_stage, record_stages, render_metrics,
+    server_timing_header, start_request_timings, timed
+)
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
-load_env()  # Load env vars from .env
 
-# Load InsightFace model once at startup
-face_analyzer = insightface.app.FaceAnalysis(providers=['CUDAExecutionProvider', 'CPUExecutionProvider'])
-face_analyzer.prepare(ctx_id=0, det_size=(640, 640))
+# InsightFace runs on this pool, never on the event loop. Models are loaded once at startup
+inference_pool = InferencePool()
+# Recognition runs in batches gathered across all images of a request and across requests
+embedding_batcher = EmbeddingBatcher(inference_pool)
+# Annotated images go to S3 concurrently, optionally after the response (UPLOAD_MODE=deferred)
+s3_uploader = S3Uploader()
+# Deferred and lazy annotations are rendered here rather than in the inference pool
+annotation_executor = ThreadPoolExecutor(max_workers=ANNOTATION_WORKERS, thread_name_prefix="annotate")
+# Lectures still being annotated after their response (ANNOTATION_MODE=deferred)
+annotation_tasks: set[asyncio.Task] = set()
+# Lazy renders in flight by annotated image key, so concurrent viewers share one render
+annotation_renders: dict[str, asyncio.Task] = {}
+
+# Division galleries uploaded by the Backend, keyed by gallery ID
+gallery_cache = GalleryCache()
+# Lectures processed in the background through /jobs
+job_store = JobStore()
+# Detection + embedding results of photos seen before (retried lectures, re-sent enrollment photos)
+inference_cache = InferenceCache()
+# Every enrolled student, for /identify; opened from its store in INDEX_DIR at startup
+identity_index = IdentityIndex()
+
+
+@app.on_event("startup")
+def start_inference_pool():
+    global identity_index
+    inference_pool.start()
+    identity_index = IdentityIndex.open(INDEX_DIR)
+
+
+@app.on_event("shutdown")
+async def stop_inference_pool():
+    # Deferred annotations still render on annotation_executor and upload through s3_uploader
+    outcomes = await asyncio.gather(*annotation_tasks, return_exceptions=True)
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            logger.error("Deferred annotation failed during shutdown", exc_info=outcome)
+    inference_pool.shutdown()
+    annotation_executor.shutdown(wait=True)
+    s3_uploader.shutdown()
+    if identity_index.writable and identity_index.dirty:
+        identity_index.snapshot()
+    identity_index.close()
+
+
+@app.exception_handler(ReadOnlyStoreError)
+async def read_only_index_handler(request: Request, exc: ReadOnlyStoreError):
+    # Another worker holds INDEX_DIR; only that one enrolls into /identify
+    return JSONResponse(status_code=409, content={"detail": f"The /identify index is read-only on this worker: {exc}"})
+
+
+@app.exception_handler(ServerBusyError)
+async def server_busy_handler(request: Request, exc: ServerBusyError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"Server busy: {exc}"},
+        headers={"Retry-After": "5"}
+    )
+
+
+@app.middleware("http")
+async def add_server_timing(request: Request, call_next):
+    started = time.perf_counter()
+    timings = start_request_timings()
+    response = await call_next(request)
+    if timings:
+        timings["total"] = time.perf_counter() - started
+        response.headers["Server-Timing"] = server_timing_header(timings)
+    return response
 
 
 @app.get("/")
@@ -23,114 +116,811 @@ async def root():
     return {"message": "Welcome to Face Recognition API (InsightFace)"}
 
 
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+async def detect_photo(contents: bytes, keep_image: bool = False, quality_gate: bool = False,
+                       wait: Optional[float] = 0.0) -> tuple[Optional[str], dict]:
+    """
+    Inference cache key of a photo and either its cached result (with
+    embeddings) or a fresh detection whose aligned crops still need
+    embedding (see embed_detections). `wait` is passed to InferencePool.run.
+    """
+    key = None
+    if inference_cache.enabled:
+        with timed("cache"):
+            key, result = await run_in_threadpool(inference_cache.lookup, contents, quality_gate)
+        if result is not None:
+            return key, result
+
+    result = await inference_pool.run(detect_and_align, contents, keep_image, DECODE_MODE, quality_gate, wait=wait)
+    record_stages(result["timings"])
+    return key, result
+
+
+async def embed_detections(keys: list[Optional[str]], results: list[dict]):
+    """Embeds the faces of every fresh detection together in batched calls and caches the results."""
+    misses = [i for i, result in enumerate(results) if "embeddings" not in result]
+    if not misses:
+        return
+
+    with timed("embedding"):
+        embeddings = await embedding_batcher.embed(np.concatenate([results[i]["crops"] for i in misses]))
+    offset = 0
+    for i in misses:
+        face_count = len(results[i]["crops"])
+        results[i]["embeddings"] = embeddings[offset:offset + face_count]
+        offset += face_count
+        if inference_cache.enabled:
+            await run_in_threadpool(inference_cache.put, keys[i], results[i])
+
+
+async def analyze_photos(photos: list[bytes], keep_image: bool = False) -> list[dict]:
+    """
+    Boxes, detection scores, keypoints and embeddings for every photo. Photos
+    seen before come from the inference cache; the others are detected one by
+    one and their faces embedded together in batched calls. Fresh results also
+    carry the aligned crops and, with `keep_image`, the decoded image.
+    """
+    keys, results = [], []
+    for contents in photos:
+        key, result = await detect_photo(contents, keep_image)
+        keys.append(key)
+        results.append(result)
+    await embed_detections(keys, results)
+    return results
+
+
 @app.post("/generate-embeddings")
-async def generate_embeddings(files: List[UploadFile] = File(...)):
-    response = []
+async def generate_embeddings(
+    files: List[UploadFile] = File(...),
+    rollNumber: Optional[str] = Form(None),
+    accept: Optional[str] = Header(None)
+):
+    """
+    Embeds the first face of every enrollment photo. With `rollNumber` the
+    embeddings also (re-)enroll that student in the /identify index, unless
+    another worker holds the index for writing.
+    """
+    with timed("multipart_read"):
+        photos = [(file.filename, await file.read()) for file in files]
+    detections = await analyze_photos([contents for _, contents in photos])
 
-    for file in files:
-        contents = await file.read()
-        image = np.array(Image.open(io.BytesIO(contents)).convert("RGB"))
-        faces = face_analyzer.get(image)
+    # Only the first (highest scoring) face of an enrollment photo is used
+    response = [
+        {"image": fileName, "embedding": detection["embeddings"][0]}
+        for (fileName, _), detection in zip(photos, detections)
+        if len(detection["embeddings"])
+    ]
+    if rollNumber and response:
+        if identity_index.writable:
+            await run_in_threadpool(identity_index.add, rollNumber, np.stack([item["embedding"] for item in response]))
+        else:
+            # Another worker holds INDEX_DIR; the embeddings are still what the caller needs
+            logger.warning("Not enrolling %s for /identify: the index is read-only on this worker", rollNumber)
 
-        if not faces:
-            continue
+    # Binary blob when the client asks for it, JSON float lists otherwise
+    dtype = negotiate(accept)
+    if dtype is not None:
+        blob = encode_embeddings(
+            [item["image"] for item in response],
+            np.stack([item["embedding"] for item in response]) if response else [],
+            dtype
+        )
+        return Response(content=blob, media_type=MEDIA_TYPE)
+
+    for item in response:
+        item["embedding"] = item["embedding"].tolist()
+    return {"embeddings": response}
+
+
+@app.post("/detect")
+async def detect(
+    images: List[UploadFile] = File(...),
+    detSize: Optional[int] = Form(None)
+):
+    """
+    Headcount and usability check: runs only the detector (optionally at a
+    smaller `detSize`, a multiple of 32) and returns every face's box, score,
+    size and sharpness. No gallery, no recognition, no S3.
+    """
+    det_size = detSize or DET_SIZE
+    if det_size % 32 or not 96 <= det_size <= 1280:
+        raise HTTPException(status_code=400, detail="detSize must be a multiple of 32 between 96 and 1280")
 
-        embedding = faces[0].normed_embedding.tolist()
-        response.append({
-            "image": file.filename,
-            "embedding": embedding
+    with timed("multipart_read"):
+        photos = [(file.filename, await file.read()) for file in images]
+
+    results = []
+    for fileName, contents in photos:
+        try:
+            detection = await inference_pool.run(detect_faces, contents, det_size)
+        except OSError as e:
+            raise HTTPException(status_code=400, detail=f"Unreadable image '{fileName}': {e}")
+        record_stages(detection["timings"])
+        results.append({
+            "fileName": fileName,
+            "width": detection["width"],
+            "height": detection["height"],
+            "faceCount": len(detection["bboxes"]),
+            "sharpness": round(detection["image_sharpness"], 1),
+            "faces": [
+                {"bbox": bbox.round(1).tolist(), "detScore": round(float(score), 4),
+                 "size": round(float(size), 1), "sharpness": round(float(sharp), 1)}
+                for bbox, score, size, sharp in zip(
+                    detection["bboxes"], detection["det_scores"], detection["sizes"], detection["sharpness"]
+                )
+            ],
         })
+    return {"detSize": det_size, "results": results}
 
-    return {"embeddings": response}
+
+async def detect_enrollment_photo(contents: bytes) -> Optional[dict]:
+    """
+    Detection for bulk enrollment, None when the photo cannot be decoded. On a
+    busy pool it waits up to INFERENCE_SLOT_WAIT_SECONDS for a slot before
+    giving up with ServerBusyError.
+    """
+    try:
+        return await inference_pool.run(detect_and_align, contents, wait=INFERENCE_SLOT_WAIT_SECONDS)
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+
+
+async def enroll_batch(entries: list[tuple[str, Optional[bytes]]], strict: bool, seen: set) -> list[dict]:
+    records = [
+        {"file": name, "rollNumber": os.path.splitext(os.path.basename(name))[0], "status": None, "faces": 0}
+        for name, _ in entries
+    ]
+    detections = await asyncio.gather(*[
+        detect_enrollment_photo(contents) for _, contents in entries if contents is not None
+    ])
+    detections = iter(detections)
+
+    crops = []
+    for record, (_, contents) in zip(records, entries):
+        if contents is None:
+            record["status"] = "unsupported_file"
+            continue
+        detection = next(detections)
+        if detection is None:
+            record["status"] = "unreadable"
+            continue
+        record_stages(detection["timings"])
+        record["faces"] = len(detection["crops"])
+        if record["rollNumber"] in seen:
+            record["status"] = "duplicate"
+        elif record["faces"] == 0:
+            record["status"] = "no_face"
+        elif record["faces"] > 1 and strict:
+            record["status"] = "multiple_faces"
+        else:
+            record["status"] = "enrolled"
+            seen.add(record["rollNumber"])
+            crops.append(detection["crops"][:1])
+
+    if crops:
+        with timed("embedding"):
+            embeddings = iter(await embedding_batcher.embed(np.concatenate(crops)))
+        for record in records:
+            if record["status"] == "enrolled":
+                record["embedding"] = next(embeddings)
+    return records
+
+
+@app.post("/bulk-enroll")
+async def bulk_enroll(
+    archive: UploadFile = File(...),
+    enroll: bool = Form(False),
+    strict: bool = Form(True)
+):
+    """
+    Embeds a zip or tar archive of <rollNumber>.jpg photos, BULK_ENROLL_BATCH
+    photos at a time, and streams one NDJSON line per photo: its embedding,
+    or why it was rejected (no_face, multiple_faces, duplicate, unreadable,
+    unsupported_file). The last line has status "done" and the counts. With
+    `enroll` the students are also (re-)enrolled for /identify.
+    """
+    if enroll and not identity_index.writable:
+        # Checked up front: once the stream has started the error could not be reported
+        raise HTTPException(status_code=409, detail="The /identify index is read-only on this worker")
+    entries = iter_archive(archive.file)
+    try:
+        batch = await run_in_threadpool(read_batch, entries, BULK_ENROLL_BATCH)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Unreadable archive: {e}")
+
+    async def results():
+        counts = {}
+        seen = set()
+        current = batch
+        while current:
+            for record in await enroll_batch(current, strict, seen):
+                embedding = record.pop("embedding", None)
+                if embedding is not None:
+                    if enroll:
+                        await run_in_threadpool(identity_index.add, record["rollNumber"], embedding)
+                    record["embedding"] = embedding.tolist()
+                counts[record["status"]] = counts.get(record["status"], 0) + 1
+                yield json.dumps(record) + "\n"
+            try:
+                current = await run_in_threadpool(read_batch, entries, BULK_ENROLL_BATCH)
+            except Exception as e:
+                yield json.dumps({"status": "error", "detail": f"Unreadable archive: {e}"}) + "\n"
+                return
+        yield json.dumps({"status": "done", "counts": counts}) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+async def read_students(studentEmbeddings: Optional[str], embeddingsBlob: Optional[UploadFile]) -> Optional[dict]:
+    """
+    Reads a gallery sent either as JSON (`studentEmbeddings`) or as a binary
+    embedding blob (`embeddingsBlob`). Returns None when neither was sent.
+    """
+    if embeddingsBlob is not None:
+        try:
+            return students_from_rows(*decode_embeddings(await embeddingsBlob.read()))
+        except WireFormatError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if studentEmbeddings is not None:
+        return students_from_payload(json.loads(studentEmbeddings))
+    return None
+
+
+@app.get("/galleries/{gallery_id}")
+async def get_gallery(gallery_id: str):
+    entry = await run_in_threadpool(gallery_cache.get, gallery_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"Gallery '{gallery_id}' is not cached")
+    return entry.describe()
+
+
+@app.put("/galleries/{gallery_id}")
+async def put_gallery(
+    gallery_id: str,
+    version: str = Form(...),
+    studentEmbeddings: Optional[str] = Form(None),
+    embeddingsBlob: Optional[UploadFile] = File(None)
+):
+    students = await read_students(studentEmbeddings, embeddingsBlob)
+    if students is None:
+        raise HTTPException(status_code=400, detail="Either studentEmbeddings or embeddingsBlob is required")
+    # Off the event loop: publishing waits on file locks and writes the shared files
+    entry = await run_in_threadpool(gallery_cache.put, gallery_id, version, students)
+    return entry.describe()
+
+
+@app.patch("/galleries/{gallery_id}")
+async def patch_gallery(
+    gallery_id: str,
+    baseVersion: str = Form(...),
+    version: str = Form(...),
+    upserts: str = Form("[]"),
+    removals: str = Form("[]"),
+    upsertsBlob: Optional[UploadFile] = File(None),
+    additions: str = Form("[]"),
+    additionsBlob: Optional[UploadFile] = File(None)
+):
+    """
+    Applies a delta to a cached gallery: `upserts` replace a student's
+    embeddings, `additions` carry only the embeddings of newly added photos
+    and are folded into the student's template, `removals` are roll numbers.
+    """
+    upserted = await read_students(upserts, upsertsBlob)
+    added = await read_students(additions, additionsBlob)
+    try:
+        entry = await run_in_threadpool(
+            gallery_cache.apply_delta, gallery_id, baseVersion, version, upserted, json.loads(removals), added
+        )
+    except StaleGalleryError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return entry.describe()
+
+
+@app.delete("/galleries/{gallery_id}")
+async def delete_gallery(gallery_id: str):
+    if not await run_in_threadpool(gallery_cache.evict, gallery_id):
+        raise HTTPException(status_code=404, detail=f"Gallery '{gallery_id}' is not cached")
+    return {"galleryId": gallery_id}
+
+
+async def resolve_gallery(
+    studentEmbeddings: Optional[str],
+    embeddingsBlob: Optional[UploadFile],
+    galleryId: Optional[str],
+    galleryVersion: Optional[str]
+):
+    """
+    Picks the gallery for a request: inline embeddings (JSON or binary) win and
+    are cached when a galleryId/galleryVersion comes with them, otherwise the
+    cached gallery must exist at the requested version.
+    """
+    students = await read_students(studentEmbeddings, embeddingsBlob)
+    if students is not None:
+        if galleryId and galleryVersion:
+            entry = await run_in_threadpool(gallery_cache.put, galleryId, galleryVersion, students)
+        else:
+            entry = await run_in_threadpool(CachedGallery.from_students, galleryId or "", "", students)
+        return entry.gallery
+
+    if not galleryId:
+        raise HTTPException(status_code=400, detail="Either studentEmbeddings, embeddingsBlob or galleryId is required")
+
+    entry = await run_in_threadpool(gallery_cache.get, galleryId, galleryVersion)
+    if entry is None:
+        raise HTTPException(status_code=409, detail=f"Gallery '{galleryId}' is not cached at version '{galleryVersion}'")
+    return entry.gallery
+
+
+@app.get("/identify")
+async def describe_identity_index():
+    return identity_index.describe()
+
+
+@app.post("/identify")
+async def identify(
+    images: List[UploadFile] = File(...),
+    topK: int = Form(IDENTIFY_TOP_K)
+):
+    """
+    Searches every enrolled student (not one division) for each face. Faces
+    are labelled with the best candidate when it clears the match threshold.
+    """
+    if topK < 1:
+        raise HTTPException(status_code=400, detail="topK must be at least 1")
+
+    with timed("multipart_read"):
+        photos = [(file.filename, await file.read()) for file in images]
+
+    detections = await analyze_photos([contents for _, contents in photos])
+    for detection in detections:
+        FACES_PER_IMAGE.observe(len(detection["bboxes"]))
+    embeddings = np.concatenate([d["embeddings"] for d in detections])
+
+    with timed("matching"):
+        candidates = await run_in_threadpool(identity_index.search, embeddings, topK) if len(embeddings) else []
+
+    results = []
+    offset = 0
+    for (fileName, _), detection in zip(photos, detections):
+        faces = []
+        for bbox, face_candidates in zip(detection["bboxes"], candidates[offset:offset + len(detection["bboxes"])]):
+            best = face_candidates[0] if face_candidates else (UNKNOWN, 0.0)
+            faces.append({
+                "bbox": [round(float(v), 1) for v in bbox],
+                "rollNumber": best[0] if best[1] >= MATCH_SIMILARITY else UNKNOWN,
+                "score": best[1],
+                "candidates": [{"rollNumber": r, "score": s} for r, s in face_candidates],
+            })
+        offset += len(detection["bboxes"])
+        results.append({"fileName": fileName, "faces": faces})
+    return {"results": results}
+
+
+@app.delete("/identify/students/{rollNumber}")
+async def remove_identity(rollNumber: str):
+    if not await run_in_threadpool(identity_index.delete, rollNumber):
+        raise HTTPException(status_code=404, detail=f"Student '{rollNumber}' is not enrolled")
+    return {"rollNumber": rollNumber}
+
+
+@app.post("/identify/snapshot")
+async def snapshot_identity_index():
+    await run_in_threadpool(identity_index.snapshot)
+    return identity_index.describe()
+
+
+@app.get("/uploads/{subjectId}/{lectureId}")
+async def get_upload_status(subjectId: str, lectureId: str):
+    files = s3_uploader.status(f"{lecture_path(subjectId, lectureId)}/annotated_images")
+    if files is None:
+        raise HTTPException(status_code=404, detail="No uploads tracked for this lecture")
+    return {"files": files}
+
+
+# uploadStatus of every result right after matching, per ANNOTATION_MODE
+ANNOTATION_STATUS = {"inline": "pending", "deferred": "pending", "lazy": "on_request", "none": "skipped"}
+
+
+async def render_in_background(image, bboxes: np.ndarray, labels: list[str]) -> bytes:
+    image_bytes, timings = await asyncio.get_running_loop().run_in_executor(
+        annotation_executor, render_annotated, image, bboxes, labels
+    )
+    record_stages(timings)
+    return image_bytes
+
+
+async def annotate_lecture(photos: list[tuple[str, bytes, np.ndarray, list[str]]], path: str):
+    """Renders and uploads a lecture's annotated images once its results went out (ANNOTATION_MODE=deferred)."""
+    for fileName, contents, bboxes, labels in photos:
+        try:
+            image_bytes = await render_in_background(contents, bboxes, labels)
+        except Exception:
+            logger.exception("Annotation of %s/%s failed", path, fileName)
+            continue
+        s3_uploader.submit(image_bytes, fileName, path)
+
+
+async def process_lecture(photos: list[tuple[str, bytes]], gallery, subjectId: str, lectureId: str,
+                          admission_wait: Optional[float] = 0.0,
+                          slot_wait: Optional[float] = INFERENCE_SLOT_WAIT_SECONDS):
+    """
+    Runs the attendance pipeline over a lecture's photos and yields one result
+    per photo, in order, as soon as it is ready. Photos move through detect,
+    embed, match and (ANNOTATION_MODE=inline) annotate stages concurrently;
+    see utils/stages.py. With UPLOAD_MODE=inline the generator only finishes
+    once every upload made for the lecture is in S3, and inline annotated
+    images are then marked "uploaded". "deferred" annotation starts once all
+    results are out and "lazy" leaves it to GET /annotated.
+
+    A busy inference pool refuses the lecture on its first photo (after
+    `admission_wait` seconds); every later inference call of the lecture
+    waits up to `slot_wait` seconds for a slot (None: as long as it takes).
+    """
+    keep_image = inference_pool.shares_memory and ANNOTATION_MODE == "inline"
+    path = f"{lecture_path(subjectId, lectureId)}/annotated_images"
+    uploads = []
+
+    async def detect(photo: dict) -> dict:
+        wait = admission_wait if photo["index"] == 0 else slot_wait
+        photo["key"], photo["detection"] = await detect_photo(photo["contents"], keep_image, QUALITY_GATE, wait)
+        detection = photo["detection"]
+        FACES_PER_IMAGE.observe(len(detection["bboxes"]) + len(detection["rejected_bboxes"]))
+        for reason in detection["rejected_reasons"]:
+            FACES_REJECTED.inc(reason=str(reason))
+        return photo
+
+    async def embed(photo: dict) -> dict:
+        # Concurrent embed workers share EmbeddingBatcher batches
+        await embed_detections([photo["key"]], [photo["detection"]])
+        photo["detection"].pop("crops", None)
+        return photo
+
+    async def match(photo: dict) -> dict:
+        fileName, detection = photo["fileName"], photo["detection"]
+        with timed("matching"):
+            matched_ids, scores = match_faces(detection["embeddings"], gallery)
+
+        s3_url, s3_key = s3_location(fileName, path) if ANNOTATION_MODE != "none" else (None, None)
+        photo["result"] = {
+            "fileName": fileName,
+            "fileSize": None,
+            "matchedIds": matched_ids,
+            "scores": scores,
+            "url": s3_url,
+            "key": s3_key,
+            "uploadStatus": ANNOTATION_STATUS[ANNOTATION_MODE],
+            # Faces the quality gate kept away from recognition; they are not in matchedIds
+            "rejectedFaces": [
+                {"bbox": bbox.round(1).tolist(), "detScore": round(float(score), 4), "reason": str(reason)}
+                for bbox, score, reason in zip(
+                    detection["rejected_bboxes"], detection["rejected_det_scores"], detection["rejected_reasons"]
+                )
+            ]
+        }
+        return photo
+
+    async def annotate(photo: dict) -> dict:
+        detection, result = photo["detection"], photo["result"]
+        image_bytes, timings = await inference_pool.run(
+            render_annotated, detection.pop("image", photo["contents"]), detection["bboxes"], result["matchedIds"],
+            wait=slot_wait
+        )
+        record_stages(timings)
+
+        # Uploads run in the background while the next image is rendered
+        uploads.append(s3_uploader.submit(image_bytes, result["fileName"], path))
+        result["fileSize"] = len(image_bytes)
+        return photo
+
+    stages = [
+        Stage(detect, PIPELINE_DETECT_CONCURRENCY),
+        Stage(embed, PIPELINE_EMBED_CONCURRENCY),
+        Stage(match),
+    ]
+    if ANNOTATION_MODE == "inline":
+        stages.append(Stage(annotate, PIPELINE_ANNOTATE_CONCURRENCY))
+
+    processed = []
+    items = [{"index": i, "fileName": fileName, "contents": contents} for i, (fileName, contents) in enumerate(photos)]
+    async for _, photo in run_stages(items, stages, PIPELINE_DEPTH):
+        processed.append(photo)
+        yield photo["result"]
+
+    detections = [photo["detection"] for photo in processed]
+    results = [photo["result"] for photo in processed]
+    labels = [result["matchedIds"] for result in results]
+
+    # Boxes, labels and embeddings of the whole lecture, so /rematch never has to run inference
+    # again and lazy annotations can be drawn without it
+    if STORE_LECTURE_FACES or ANNOTATION_MODE == "lazy":
+        faces_blob = encode_lecture_faces([fileName for fileName, _ in photos], detections, labels)
+        uploads.append(s3_uploader.submit(faces_blob, LECTURE_FACES_FILE, lecture_path(subjectId, lectureId)))
+
+    if UPLOAD_MODE == "inline":
+        # Per-upload times go to the histogram from the upload threads; this is the wait left over
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*[asyncio.wrap_future(f) for f in uploads], return_exceptions=True)
+        record_request_stage("s3_upload", time.perf_counter() - started)
+        failures = [o for o in outcomes if isinstance(o, Exception)]
+        if failures:
+            # Don't leave half a lecture's annotated images behind
+            for outcome in outcomes:
+                if not isinstance(outcome, Exception):
+                    await run_in_threadpool(delete_from_s3, outcome[1])
+            raise HTTPException(status_code=500, detail=f"Upload failed: {str(failures[0])}")
+        if ANNOTATION_MODE == "inline":
+            for result in results:
+                result["uploadStatus"] = "uploaded"
+
+    if ANNOTATION_MODE == "deferred":
+        task = asyncio.create_task(annotate_lecture([
+            (fileName, contents, detection["bboxes"], matched_ids)
+            for (fileName, contents), detection, matched_ids in zip(photos, detections, labels)
+        ], path))
+        annotation_tasks.add(task)
+        task.add_done_callback(annotation_tasks.discard)
+
+
+async def render_stored_photo(subjectId: str, lectureId: str, fileName: str) -> bytes:
+    path = lecture_path(subjectId, lectureId)
+    try:
+        with timed("s3_download"):
+            blob, original = await asyncio.gather(
+                run_in_threadpool(download_from_s3, f"{path}/{LECTURE_FACES_FILE}"),
+                run_in_threadpool(download_from_s3, f"{path}/images/{fileName}"),
+            )
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    photo = next((p for p in decode_lecture_faces(blob) if p["fileName"] == fileName), None)
+    if photo is None or photo["labels"] is None:
+        raise HTTPException(status_code=404, detail=f"No stored labels for '{fileName}'")
+
+    image_bytes = await render_in_background(original, photo["bboxes"], photo["labels"])
+    s3_uploader.submit(image_bytes, fileName, f"{path}/annotated_images")
+    return image_bytes
+
+
+@app.get("/annotated/{subjectId}/{lectureId}/{fileName}")
+async def get_annotated_image(subjectId: str, lectureId: str, fileName: str):
+    """
+    Annotated image of one lecture photo. Images rendered before come from
+    annotated_images/; otherwise the photo the Backend stored under images/
+    is drawn with the boxes and labels kept in faces.npz, and the result is
+    cached in annotated_images/ for the next request.
+    """
+    key = f"{lecture_path(subjectId, lectureId)}/annotated_images/{fileName}"
+    try:
+        image_bytes = await run_in_threadpool(download_from_s3, key)
+    except FileNotFoundError:
+        if key not in annotation_renders:
+            task = asyncio.create_task(render_stored_photo(subjectId, lectureId, fileName))
+            annotation_renders[key] = task
+            task.add_done_callback(lambda _: annotation_renders.pop(key, None))
+        image_bytes = await asyncio.shield(annotation_renders[key])
+    return Response(content=image_bytes, media_type="image/jpeg")
 
 
 @app.post("/verify-attendance")
 async def verify_attendance(
     images: List[UploadFile] = File(...),
-    studentEmbeddings: str = Form(...),
     subjectId: str = Form(...),
-    lectureId: str = Form(...)
+    lectureId: str = Form(...),
+    studentEmbeddings: Optional[str] = Form(None),
+    embeddingsBlob: Optional[UploadFile] = File(None),
+    galleryId: Optional[str] = Form(None),
+    galleryVersion: Optional[str] = Form(None)
 ):
-    start = time.time()
-    studentEmbeddings = json.loads(studentEmbeddings)
-
-    embeddings_map = {}
-    for student in studentEmbeddings:
-        rollNumber = student['rollNumber']
-        if len(student['embeddings']) > 0:
-            embeddings_map[rollNumber] = {
-                "images": [item['image'] for item in student['embeddings']],
-                "values": [np.array(item['embedding']) for item in student['embeddings']]
-            }
-
-    font = ImageFont.load_default()
-    results = []
+    # Stack the whole division once; every image is then matched with one matmul
+    with timed("multipart_read"):
+        gallery = await resolve_gallery(studentEmbeddings, embeddingsBlob, galleryId, galleryVersion)
+        photos = [(file.filename, await file.read()) for file in images]
+    GALLERY_EMBEDDINGS.observe(gallery.size)
 
-    for file in images:
-        contents = await file.read()
-        image_np = np.array(Image.open(io.BytesIO(contents)).convert("RGB"))
-        faces = face_analyzer.get(image_np)
+    results = [result async for result in process_lecture(photos, gallery, subjectId, lectureId)]
+
+    return JSONResponse(content={"results": results})
 
-        pil_img = Image.fromarray(image_np)
-        draw = ImageDraw.Draw(pil_img)
-        matched_ids = []
 
-        for face in faces:
-            encoding = face.normed_embedding
-            bbox = face.bbox.astype(int)
-            top, right, bottom, left = bbox[1], bbox[2], bbox[3], bbox[0]
+@app.post("/verify-attendance/video")
+async def verify_attendance_video(
+    subjectId: str = Form(...),
+    lectureId: str = Form(...),
+    video: Optional[UploadFile] = File(None),
+    frames: Optional[List[UploadFile]] = File(None),
+    studentEmbeddings: Optional[str] = Form(None),
+    embeddingsBlob: Optional[UploadFile] = File(None),
+    galleryId: Optional[str] = Form(None),
+    galleryVersion: Optional[str] = Form(None)
+):
+    """
+    Attendance from a short `video` or a burst of photos (`frames`). Faces
+    are tracked across sampled frames (utils/tracking.py) and every track is
+    recognized once, from its best face. Answers with one result in the
+    /verify-attendance shape, plus the `tracks` behind its matchedIds; no
+    annotated image is produced.
+    """
+    if (video is None) == (not frames):
+        raise HTTPException(status_code=400, detail="Send either a video or frames")
 
-            best_match = None
-            best_distance = float("inf")
+    with timed("multipart_read"):
+        gallery = await resolve_gallery(studentEmbeddings, embeddingsBlob, galleryId, galleryVersion)
+        contents = await video.read() if video is not None else None
+        photos = [await frame.read() for frame in frames] if frames else None
+    GALLERY_EMBEDDINGS.observe(gallery.size)
+    fileName = video.filename if video is not None else "burst"
 
-            # Compare with stored student embeddings
-            for rollNumber, data in embeddings_map.items():
-                db_encodings = data['values']
-                distances = np.linalg.norm(db_encodings - encoding, axis=1)
-                min_distance = np.min(distances)
+    try:
+        tracked = await inference_pool.run(track_faces, contents, suffix_of(fileName), photos)
+    except (ValueError, OSError) as e:
+        raise HTTPException(status_code=400, detail=f"Unreadable upload: {e}")
+    record_stages(tracked["timings"])
 
-                if min_distance < best_distance and min_distance < 0.8:  # threshold tuned
-                    best_match = rollNumber
-                    best_distance = min_distance
+    # One embedding per track; tracks of the same face split up by the tracker are merged again
+    with timed("embedding"):
+        embeddings = await embedding_batcher.embed(tracked["crops"])
+    groups = merge_tracks(embeddings, tracked["qualities"], TRACK_MERGE_SIMILARITY, tracked["trackFrames"])
+    best = [group[0] for group in groups]
 
-            label = best_match if best_match else "Unknown"
-            matched_ids.append(label)
+    with timed("matching"):
+        matched_ids, scores = match_faces(embeddings[best], gallery)
 
-            # 🟥 Red for Unknown, 🟩 Green for known
-            box_color = (255, 0, 0) if label == "Unknown" else (0, 255, 0)
-            draw.rectangle(((left, top), (right, bottom)), outline=box_color, width=3)
+    tracks = [
+        {**tracked["tracks"][group[0]], "mergedTrackIds": [tracked["tracks"][i]["trackId"] for i in group[1:]]}
+        for group in groups
+    ]
 
-            text_bbox = draw.textbbox((0, 0), label, font=font)
-            draw.rectangle(
-                [(left, bottom), (left + text_bbox[2] + 6, bottom + text_bbox[3] + 6)],
-                fill=box_color
-            )
-            draw.text((left + 3, bottom + 3), label, fill=(0, 0, 0), font=font)
+    # Best face per track, so /rematch works for video lectures too (no labels: nothing to annotate)
+    if STORE_LECTURE_FACES:
+        faces_blob = encode_lecture_faces([fileName], [{
+            "bboxes": np.array([track["bbox"] for track in tracks], dtype=np.float32).reshape(-1, 4),
+            "det_scores": np.array([track["detScore"] for track in tracks], dtype=np.float32),
+            "embeddings": embeddings[best],
+        }])
+        upload = s3_uploader.submit(faces_blob, LECTURE_FACES_FILE, lecture_path(subjectId, lectureId))
+        if UPLOAD_MODE == "inline":
+            try:
+                with timed("s3_upload"):
+                    await asyncio.wrap_future(upload)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
-        # Save annotated image
-        buf = io.BytesIO()
-        pil_img.save(buf, format='JPEG')
-        image_bytes = buf.getvalue()
+    return {"results": [{
+        "fileName": fileName,
+        "fileSize": None,
+        "matchedIds": matched_ids,
+        "scores": scores,
+        "url": None,
+        "key": None,
+        "uploadStatus": "skipped",
+        "tracks": tracks,
+        "frames": tracked["frames"],
+    }]}
 
-        timestamped_name = f"{file.filename}"
-        path = f"lectures/{subjectId}/{lectureId}/annotated_images"
 
+async def load_lecture_faces(subjectId: str, lectureId: str, limit: asyncio.Semaphore) -> Optional[list[dict]]:
+    async with limit:
         try:
-            s3_url, s3_key = upload_to_s3(image_bytes, timestamped_name, path)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+            blob = await run_in_threadpool(
+                download_from_s3, f"{lecture_path(subjectId, lectureId)}/{LECTURE_FACES_FILE}"
+            )
+        except FileNotFoundError:
+            return None
+    return decode_lecture_faces(blob)
 
-        try:
-            results.append({
-                "fileName": file.filename,
-                "fileSize": len(image_bytes),
-                "matchedIds": matched_ids,
-                "url": s3_url,
-                "key": s3_key
-            })
-        except Exception as e:
-            delete_from_s3(s3_key)
-            raise HTTPException(status_code=500, detail=f"Post-upload failure: {str(e)}")
 
-    print(f"Time taken: {time.time() - start}")
-    return JSONResponse(content={"results": results})
+@app.post("/rematch")
+async def rematch(
+    lectures: str = Form(...),
+    studentEmbeddings: Optional[str] = Form(None),
+    embeddingsBlob: Optional[UploadFile] = File(None),
+    galleryId: Optional[str] = Form(None),
+    galleryVersion: Optional[str] = Form(None)
+):
+    """
+    Re-matches stored lectures against the current gallery using the faces
+    kept in their faces.npz: no images, no inference, only matching.
+    `lectures` is a JSON list of {"subjectId", "lectureId"}; lectures that
+    were never stored come back with status "not_found".
+    """
+    gallery = await resolve_gallery(studentEmbeddings, embeddingsBlob, galleryId, galleryVersion)
+    GALLERY_EMBEDDINGS.observe(gallery.size)
+    requested = json.loads(lectures)
+
+    with timed("s3_download"):
+        limit = asyncio.Semaphore(REMATCH_DOWNLOAD_CONCURRENCY)
+        stored = await asyncio.gather(*[
+            load_lecture_faces(lecture["subjectId"], lecture["lectureId"], limit) for lecture in requested
+        ])
+
+    response = []
+    with timed("matching"):
+        for lecture, photos in zip(requested, stored):
+            entry = {"subjectId": lecture["subjectId"], "lectureId": lecture["lectureId"]}
+            if photos is None:
+                response.append({**entry, "status": "not_found"})
+                continue
+            results = []
+            for photo in photos:
+                matched_ids, scores = match_faces(photo["embeddings"], gallery)
+                results.append({
+                    "fileName": photo["fileName"],
+                    "matchedIds": matched_ids,
+                    "scores": scores,
+                    "bboxes": photo["bboxes"].round(1).tolist(),
+                })
+            response.append({**entry, "status": "rematched", "results": results})
+    return {"lectures": response}
+
+
+async def run_job(job: Job, photos: list[tuple[str, bytes]], gallery, subjectId: str, lectureId: str):
+    await job.start()
+    try:
+        # The job was already accepted, so a busy pool only delays it: every inference call waits its turn
+        async for result in process_lecture(photos, gallery, subjectId, lectureId, admission_wait=None, slot_wait=None):
+            await job.add_result(result)
+    except HTTPException as e:
+        await job.fail(e.detail)
+    except Exception as e:
+        await job.fail(str(e))
+    else:
+        await job.finish()
+
+
+@app.post("/jobs/verify-attendance", status_code=202)
+async def create_attendance_job(
+    images: List[UploadFile] = File(...),
+    subjectId: str = Form(...),
+    lectureId: str = Form(...),
+    studentEmbeddings: Optional[str] = Form(None),
+    embeddingsBlob: Optional[UploadFile] = File(None),
+    galleryId: Optional[str] = Form(None),
+    galleryVersion: Optional[str] = Form(None)
+):
+    """
+    Same inputs as /verify-attendance, but answers with a job ID right away.
+    Results show up per image on GET /jobs/{jobId} and /jobs/{jobId}/events.
+    """
+    with timed("multipart_read"):
+        gallery = await resolve_gallery(studentEmbeddings, embeddingsBlob, galleryId, galleryVersion)
+        photos = [(file.filename, await file.read()) for file in images]
+    GALLERY_EMBEDDINGS.observe(gallery.size)
+
+    try:
+        job = job_store.create(len(photos))
+    except JobStoreFullError as e:
+        raise HTTPException(status_code=503, detail=f"Server busy: {e}", headers={"Retry-After": "5"})
+    job.task = asyncio.create_task(run_job(job, photos, gallery, subjectId, lectureId))
+    return job.describe()
+
+
+def get_job_or_404(job_id: str) -> Job:
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return job
+
+
+@app.get("/jobs/{job_id}")
+async def get_attendance_job(job_id: str):
+    return get_job_or_404(job_id).describe()
+
+
+@app.get("/jobs/{job_id}/events")
+async def stream_attendance_job(job_id: str, last_event_id: Optional[str] = Header(None)):
+    """
+    Server-sent events: one `result` per processed image, then `done` (with
+    all results) or `error`. Reconnecting clients resume via Last-Event-ID.
+    """
+    job = get_job_or_404(job_id)
+    start = int(last_event_id) + 1 if last_event_id and last_event_id.isdigit() else 0
+
+    async def events():
+        async for index, event, data in job.stream(start):
+            yield f"id: {index}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
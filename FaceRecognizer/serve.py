@@ -0,0 +1,47 @@
+"""
+Multi-worker launcher: starts the shared inference process
+(utils/inference_server.py), waits until its models are loaded, then runs
+main:app on several uvicorn workers that send it all their inference
+(INFERENCE_BACKEND=shared) and share cached galleries through
+GALLERY_SHARED_DIR. Plain `uvicorn main:app --workers N` still works, with
+one copy of the models and galleries per worker.
+
+Run from FaceRecognizer/:
+python serve.py --workers 4 --port 10000
+"""
+
+import argparse
+import multiprocessing
+import os
+import secrets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=2, help="uvicorn worker processes")
+    args = parser.parse_args()
+
+    # Read by utils.config in the inference process and in every worker
+    os.environ["INFERENCE_BACKEND"] = "shared"
+    os.environ.setdefault("GALLERY_SHARED_DIR", "/dev/shm/face-recognizer-galleries")
+    # Inherited by the inference process and the workers only
+    os.environ.setdefault("INFERENCE_AUTHKEY", secrets.token_hex(32))
+
+    import uvicorn
+    from utils.inference_server import serve, wait_until_ready
+
+    inference = multiprocessing.get_context("spawn").Process(target=serve, name="inference", daemon=True)
+    inference.start()
+    try:
+        wait_until_ready(alive=inference.is_alive)
+        print(f"Inference process {inference.pid} ready, starting {args.workers} workers")
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
+    finally:
+        inference.terminate()
+        inference.join()
+
+
+if __name__ == "__main__":
+    main()
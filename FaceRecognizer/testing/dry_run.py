@@ -1,14 +1,20 @@
+# Run from FaceRecognizer/: python -m testing.dry_run
 import os
 import json
 import cv2
 import numpy as np
 from insightface.app import FaceAnalysis
 
-# Paths
-DATASET_DIR = "student_images" # other: "temp_student_images"
-TEST_DIR = "lecture_images" # other: "temp_lecture_images"
-OUTPUT_DIR = "annotated_images"
-DB_PATH = "db.json"
+from utils.matcher import normalize
+from utils.store import EmbeddingStore, import_json
+
+# Paths (relative to this folder)
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATASET_DIR = os.path.join(HERE, "student_images") # other: "temp_student_images"
+TEST_DIR = os.path.join(HERE, "lecture_images") # other: "temp_lecture_images"
+OUTPUT_DIR = os.path.join(HERE, "annotated_images")
+DB_DIR = os.path.join(HERE, "db")  # embedding store, see utils/store.py
+LEGACY_DB_PATH = os.path.join(HERE, "db.json")
 
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
@@ -19,14 +25,13 @@ app.prepare(ctx_id=0, det_size=(640, 640))
 # ------------------------
 # Step 1: Generate / Load embeddings for dataset
 # ------------------------
-# Load existing DB if available
-if os.path.exists(DB_PATH):
-    with open(DB_PATH, "r") as f:
-        db = json.load(f)
-    print(f"[INFO] Loaded {len(db)} embeddings from {DB_PATH}")
+# Open the store, importing the old db.json the first time
+if not os.path.exists(DB_DIR) and os.path.exists(LEGACY_DB_PATH):
+    db = import_json(LEGACY_DB_PATH, DB_DIR)
+    print(f"[INFO] Imported {len(db)} embeddings from {LEGACY_DB_PATH}")
 else:
-    db = {}
-    print("[INFO] No existing DB found. Creating new one.")
+    db = EmbeddingStore(DB_DIR)
+    print(f"[INFO] Loaded {len(db)} embeddings from {DB_DIR}")
 
 # Process dataset images
 for file in os.listdir(DATASET_DIR):
@@ -47,27 +52,20 @@ for file in os.listdir(DATASET_DIR):
         print(f"[WARN] No face detected in {file}")
         continue
 
-    # Take first face
-    emb = faces[0].embedding.tolist()
-    db[student_id] = emb
+    # Take first face; the store appends it to its log right away
+    db.put(student_id, faces[0].embedding)
     print(f"[INFO] Added embedding for {student_id}")
 
-# Save (updated) database
-with open(DB_PATH, "w") as f:
-    json.dump(db, f, indent=2)
-
-print(f"\n✅ Database updated and stored in {DB_PATH}")
+# Fold the log into the memory-mapped matrix
+db.compact()
+print(f"\n✅ Database updated and stored in {DB_DIR}")
 
 
 # ------------------------
 # Step 2: Compare with test_data
 # ------------------------
-with open(DB_PATH, "r") as f:
-    db = json.load(f)
-
-def cosine_similarity(a, b):
-    a, b = np.array(a), np.array(b)
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+student_ids, db_matrix = db.rows()
+db_matrix = normalize(db_matrix)  # cosine similarity = dot product of unit vectors
 
 results = {}
 THRESHOLD = 0.35
@@ -82,14 +80,10 @@ for file in os.listdir(TEST_DIR):
     present = []
 
     for face in faces:
-        emb = face.embedding.tolist()
-
-        # Compare with db
-        best_match, best_score = None, -1
-        for student_id, db_emb in db.items():
-            score = cosine_similarity(emb, db_emb)
-            if score > best_score:
-                best_match, best_score = student_id, score
+        # Compare with every db entry at once
+        scores = db_matrix @ normalize(face.embedding)
+        best = int(np.argmax(scores)) if len(scores) else -1
+        best_match, best_score = (student_ids[best], float(scores[best])) if best >= 0 else (None, -1)
 
         bbox = face.bbox.astype(int)
 
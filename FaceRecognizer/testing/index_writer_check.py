@@ -0,0 +1,91 @@
+"""
+Checks several workers on one INDEX_DIR (serve.py) without the InsightFace
+models: spawned processes stand in for uvicorn workers, each running main:app
+with the stand-in detector and recognizer of testing/tracking_check.py. All
+of them open the index at once, so only one holds it for writing, and every
+one of them then gets /generate-embeddings with a rollNumber, as the Backend
+sends it when a student is created. Every request must return the
+embeddings; only the writer's student ends up in the index.
+
+Run from FaceRecognizer/:
+python -m testing.index_writer_check --workers 3
+"""
+
+import argparse
+import io
+import multiprocessing
+import os
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from testing.tracking_check import COLOURS, SIDE
+
+
+def photo(colour: tuple[int, int, int]) -> bytes:
+    image = np.full((480, 640, 3), 90, dtype=np.uint8)
+    image[150:150 + SIDE, 250:250 + SIDE] = colour
+    buf = io.BytesIO()
+    Image.fromarray(image).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def worker(number: int, barrier, results):
+    from fastapi.testclient import TestClient
+
+    import main
+    from testing.tracking_check import StandInAnalyzer
+    from utils.pipeline import use_face_analyzer
+
+    with use_face_analyzer(StandInAnalyzer()), TestClient(main.app) as client:
+        # Every worker has opened INDEX_DIR before any of them enrolls
+        barrier.wait()
+        response = client.post("/generate-embeddings", data={"rollNumber": f"S{number}"},
+                               files=[("files", ("student.png", photo(COLOURS[number])))])
+        results.put({
+            "rollNumber": f"S{number}",
+            "status": response.status_code,
+            "embeddings": len(response.json().get("embeddings", [])),
+            "writable": main.identity_index.writable,
+        })
+        barrier.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=3)
+    args = parser.parse_args()
+    if not 2 <= args.workers <= len(COLOURS):
+        parser.error(f"--workers must be between 2 and {len(COLOURS)}")
+
+    index_dir = tempfile.mkdtemp(prefix="index-")
+    # Inherited by the spawned workers, which read utils.config before worker() runs
+    os.environ.update(INDEX_DIR=index_dir, INFERENCE_BACKEND="thread", AWS_BUCKET_NAME="index-writer-check",
+                      AWS_REGION="us-east-1", ANNOTATION_MODE="none")
+    context = multiprocessing.get_context("spawn")
+    barrier, results = context.Barrier(args.workers), context.Queue()
+    processes = [context.Process(target=worker, args=(i, barrier, results)) for i in range(args.workers)]
+    for process in processes:
+        process.start()
+    outcome = [results.get(timeout=300) for _ in processes]
+    for process in processes:
+        process.join()
+
+    for o in sorted(outcome, key=lambda o: o["rollNumber"]):
+        print(f"{o['rollNumber']}: {o['status']}, {o['embeddings']} embedding(s), "
+              f"{'writer' if o['writable'] else 'read-only'}")
+    assert all(o["status"] == 200 and o["embeddings"] == 1 for o in outcome), outcome
+    writers = [o["rollNumber"] for o in outcome if o["writable"]]
+    assert len(writers) == 1, outcome
+
+    from utils.index import IdentityIndex
+    index = IdentityIndex.open(index_dir)
+    enrolled = {o["rollNumber"] for o in outcome if o["rollNumber"] in index._rows_by_id}
+    index.close()
+    assert enrolled == set(writers), (enrolled, writers)
+    print("✅ Every worker returns the embeddings; only the one holding INDEX_DIR enrolls")
+
+
+if __name__ == "__main__":
+    main()
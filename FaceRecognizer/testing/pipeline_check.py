@@ -0,0 +1,79 @@
+"""
+Checks utils/stages.py with simulated stages (blocking sleeps on threads, as
+inference and rendering would be): results keep their input order, the
+number of photos in flight stays bounded, a failing stage stops the run,
+and a 10-photo lecture takes about as long as its slowest stage rather than
+the sum of all stages.
+
+Run from FaceRecognizer/:
+python -m testing.pipeline_check
+"""
+
+import asyncio
+import time
+
+from utils.stages import Stage, run_stages
+
+PHOTOS = 10
+# Seconds per photo: detect (decode included), embed, match, annotate (render + encode)
+STAGE_SECONDS = {"detect": 0.06, "embed": 0.03, "match": 0.005, "annotate": 0.05}
+
+
+def simulated(name: str, in_flight: dict):
+    async def stage(item):
+        if name == "detect":
+            in_flight["now"] += 1
+            in_flight["peak"] = max(in_flight["peak"], in_flight["now"])
+        await asyncio.to_thread(time.sleep, STAGE_SECONDS[name])
+        if name == "annotate":
+            in_flight["now"] -= 1
+        return item
+    return stage
+
+
+async def run(concurrency: int, depth: int) -> tuple[float, list, int]:
+    in_flight = {"now": 0, "peak": 0}
+    stages = [Stage(simulated(name, in_flight), concurrency if name != "match" else 1) for name in STAGE_SECONDS]
+    started = time.perf_counter()
+    order = [index async for index, _ in run_stages(list(range(PHOTOS)), stages, depth)]
+    return time.perf_counter() - started, order, in_flight["peak"]
+
+
+async def failing():
+    async def boom(item):
+        if item == 3:
+            raise ValueError("photo 3 is broken")
+        return item
+
+    seen = []
+    try:
+        async for index, _ in run_stages(list(range(PHOTOS)), [Stage(boom), Stage(simulated("match", {}))]):
+            seen.append(index)
+    except ValueError as e:
+        return seen, str(e)
+    return seen, None
+
+
+async def main():
+    sequential = PHOTOS * sum(STAGE_SECONDS.values())
+    slowest = PHOTOS * max(STAGE_SECONDS.values())
+
+    wall, order, peak = await run(concurrency=1, depth=1)
+    print(f"Sequential estimate {sequential:.2f}s, slowest stage {slowest:.2f}s, staged {wall:.2f}s "
+          f"(peak {peak} photos in flight)")
+    assert order == list(range(PHOTOS)), order
+    assert wall < slowest + sum(STAGE_SECONDS.values()) + 0.1, wall
+    # One photo per worker plus one per queue slot, per stage
+    assert peak <= 2 * len(STAGE_SECONDS) + 1, peak
+
+    wall, order, peak = await run(concurrency=2, depth=2)
+    print(f"Two workers per stage: {wall:.2f}s (peak {peak} photos in flight)")
+    assert order == list(range(PHOTOS)), order
+
+    seen, error = await failing()
+    assert error == "photo 3 is broken" and 3 not in seen, (seen, error)
+    print("✅ Staged processing keeps order, bounds in-flight photos and stops on the first error")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
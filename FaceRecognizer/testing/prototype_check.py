@@ -0,0 +1,149 @@
+"""
+Checks per-student templates (utils/prototypes.py) against matching every
+enrollment embedding, without the InsightFace models:
+
+- testing/db.json (one real embedding per student): templates must score
+  exactly like the raw gallery.
+- A synthetic class whose students enrolled 3 to 40 photos each, spread over
+  a few "poses": templates must identify fresh photos as well as the raw
+  gallery without accepting more strangers, at a cost that no longer grows
+  with the photos per student, and folding photos in one at a time must give
+  the same centroids as building the templates from all of them.
+
+Run from FaceRecognizer/:
+python -m testing.prototype_check
+"""
+
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from utils.config import PROTOTYPE_EXEMPLARS
+from utils.gallery import CachedGallery, GalleryCache
+from utils.matcher import MATCH_SIMILARITY, UNKNOWN, Gallery, match_faces, normalize, score_faces
+
+STUDENTS = 60
+POSES = 3
+DIM = 512
+
+
+def raw_gallery(students: dict[str, np.ndarray]) -> Gallery:
+    roll_numbers = sorted(students)
+    return Gallery(np.concatenate([students[r] for r in roll_numbers]),
+                   [r for r in roll_numbers for _ in range(len(students[r]))])
+
+
+def synthetic_class(photos: int, seed: int = 0):
+    """
+    Enrollment embeddings per student, fresh photos of every student and
+    photos of people who are not enrolled.
+    """
+    rng = np.random.default_rng(seed)
+
+    def person():
+        return normalize(rng.normal(size=DIM)) * np.sqrt(0.55), normalize(rng.normal(size=(POSES, DIM))) * np.sqrt(0.2)
+
+    def sample(identity, poses, n):
+        # Photos of one pose are ~0.75 similar, across poses ~0.55, of other people ~0
+        noise = normalize(rng.normal(size=(n, DIM))) * np.sqrt(0.25)
+        return normalize(identity + poses[rng.integers(len(poses), size=n)] + noise)
+
+    students, queries, truth = {}, [], []
+    for i in range(STUDENTS):
+        roll_number = f"S{i:03d}"
+        identity, poses = person()
+        students[roll_number] = sample(identity, poses, photos)
+        queries.append(sample(identity, poses, 5))
+        truth += [roll_number] * 5
+    strangers = np.concatenate([sample(*person(), 5) for _ in range(STUDENTS)])
+    return students, np.concatenate(queries), truth, strangers
+
+
+def evaluate(gallery: Gallery, queries: np.ndarray, truth: list[str], strangers: np.ndarray,
+             repeats: int = 20) -> tuple[float, float, float, float]:
+    """
+    Top-1 accuracy, share of photos matched to the right student above the
+    match threshold, share of strangers matched to anyone, and milliseconds
+    per scoring call of 40 faces.
+    """
+    scores = score_faces(queries, gallery)
+    best = np.asarray(gallery.roll_numbers)[scores.argmax(axis=1)]
+    correct = best == np.asarray(truth)
+    accepted = correct & (scores.max(axis=1) >= MATCH_SIMILARITY)
+    false_accepts = score_faces(strangers, gallery).max(axis=1) >= MATCH_SIMILARITY
+    started = time.perf_counter()
+    for _ in range(repeats):
+        score_faces(queries[:40], gallery)
+    ms = (time.perf_counter() - started) / repeats * 1000
+    return float(correct.mean()), float(accepted.mean()), float(false_accepts.mean()), ms
+
+
+def check_db():
+    db = json.loads(Path(__file__).with_name("db.json").read_text())
+    students = {roll_number: normalize(np.asarray(vector, dtype=np.float32))[None] for roll_number, vector in db.items()}
+    queries = np.concatenate(list(students.values()))
+    raw = score_faces(queries, raw_gallery(students))
+    templated = score_faces(queries, CachedGallery.from_students("db", "1", students).gallery)
+    print(f"db.json: {len(students)} students, largest score difference {np.abs(raw - templated).max():.2e}")
+    assert np.allclose(raw, templated, atol=1e-5)
+
+
+def check_incremental(students: dict[str, np.ndarray]):
+    cache = GalleryCache()
+    cache.put("class", "0", {roll_number: vectors[:1] for roll_number, vectors in students.items()})
+    for photo in range(1, min(len(v) for v in students.values())):
+        cache.apply_delta("class", str(photo - 1), str(photo), {}, [],
+                          {roll_number: vectors[photo:photo + 1] for roll_number, vectors in students.items()})
+    folded = cache.get("class")
+    rebuilt = CachedGallery.from_students("class", "", {r: v[:photo + 1] for r, v in students.items()})
+    assert folded.gallery.size <= rebuilt.gallery.size + STUDENTS, (folded.gallery.size, rebuilt.gallery.size)
+    centroids = np.stack([folded.templates[r].centroid for r in sorted(students)])
+    expected = np.stack([rebuilt.templates[r].centroid for r in sorted(students)])
+    assert np.allclose(centroids, expected, atol=1e-5)
+    print(f"Folded {photo} photos per student one at a time: {folded.gallery.size} rows "
+          f"(built at once: {rebuilt.gallery.size})")
+
+
+def check_interleaved(students: dict[str, np.ndarray], queries: np.ndarray):
+    # Rows arriving photo by photo (S000, S001, ..., S000, ...) must still score per student
+    roll_numbers = sorted(students)
+    photos = min(len(v) for v in students.values())
+    interleaved = Gallery(np.concatenate([students[r][photo:photo + 1] for photo in range(photos) for r in roll_numbers]),
+                          [r for _ in range(photos) for r in roll_numbers])
+    grouped = raw_gallery({r: students[r][:photos] for r in roll_numbers})
+    assert interleaved.roll_numbers == grouped.roll_numbers, interleaved.roll_numbers[:5]
+    assert np.allclose(score_faces(queries, interleaved), score_faces(queries, grouped), atol=1e-6)
+    labels, _ = match_faces(queries, interleaved)
+    known = [label for label in labels if label != UNKNOWN]
+    assert len(known) == len(set(known)), "a student was matched twice"
+    print(f"Interleaved rows of {len(roll_numbers)} students score like grouped ones, {len(known)} faces matched once each")
+
+
+def main():
+    check_db()
+    students, queries, _, _ = synthetic_class(3, seed=2)
+    check_interleaved(students, queries)
+
+    print(f"{'photos':>6} {'rows':>10} {'top-1':>11} {'accepted':>11} {'strangers':>11} {'ms':>11}   (raw / templates)")
+    for photos in (3, 10, 40):
+        students, queries, truth, strangers = synthetic_class(photos)
+        raw = raw_gallery(students)
+        templated = CachedGallery.from_students("class", "", students).gallery
+        raw_top1, raw_accepted, raw_strangers, raw_ms = evaluate(raw, queries, truth, strangers)
+        top1, accepted, strangers_accepted, ms = evaluate(templated, queries, truth, strangers)
+        print(f"{photos:>6} {raw.size:>5}/{templated.size:<4} {raw_top1:>5.3f}/{top1:<5.3f} "
+              f"{raw_accepted:>5.3f}/{accepted:<5.3f} {raw_strangers:>5.3f}/{strangers_accepted:<5.3f} "
+              f"{raw_ms:>5.2f}/{ms:<5.2f}")
+        assert top1 >= raw_top1 - 0.01, (photos, top1, raw_top1)
+        assert accepted >= raw_accepted - 0.01, (photos, accepted, raw_accepted)
+        assert strangers_accepted <= raw_strangers + 0.01, (photos, strangers_accepted, raw_strangers)
+        assert templated.size <= STUDENTS * (1 + PROTOTYPE_EXEMPLARS), templated.size
+
+    check_incremental(synthetic_class(10, seed=1)[0])
+    print("✅ Templates match as well as every embedding at a fixed number of rows per student")
+
+
+if __name__ == "__main__":
+    main()
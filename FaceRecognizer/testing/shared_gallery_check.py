@@ -0,0 +1,169 @@
+"""
+Checks galleries shared between worker processes (GALLERY_SHARED_DIR,
+utils/gallery.py) without the InsightFace models. Several spawned
+processes stand in for uvicorn workers:
+
+- every worker must score a gallery another worker uploaded exactly like
+  its own copy, and see a delta applied by another worker;
+- a gallery evicted by a worker's LRU leaves the shared directory;
+- threads of one worker reading and updating a gallery at once do not
+  deadlock on the file lock and the cache's own lock;
+- with a private copy per worker (no shared directory) every worker's PSS
+  grows by the whole gallery, with the shared directory the workers split
+  one memory-mapped copy between them.
+
+Run from FaceRecognizer/:
+python -m testing.shared_gallery_check --workers 4 --students 5000
+"""
+
+import argparse
+import gc
+import multiprocessing
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from utils.gallery import GalleryCache
+from utils.matcher import normalize, score_faces
+
+MB = 1024 * 1024
+
+
+def memory() -> dict:
+    values = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Pss"):
+                values[key.lower()] = int(rest.split()[0]) * 1024
+    return values
+
+
+def synthetic_students(students: int, photos: int) -> dict[str, np.ndarray]:
+    rng = np.random.default_rng(0)
+    return {f"S{i:05d}": normalize(rng.normal(size=(photos, 512))) for i in range(students)}
+
+
+def worker(shared_dir: str, students: int, photos: int, queries: np.ndarray, barrier, results):
+    # Stands in for one uvicorn worker: without a shared directory it builds its own copy from the upload
+    payload = synthetic_students(students, photos) if not shared_dir else None
+    gc.collect()
+    before = memory()
+
+    if shared_dir:
+        entry = GalleryCache(shared_dir=shared_dir).get("class", "1")
+    else:
+        entry = GalleryCache(shared_dir="").put("class", "1", payload)
+        del payload
+    gc.collect()
+    scores = score_faces(queries, entry.gallery)
+    # PSS divides shared pages between the processes mapping them, so measure while all are alive
+    barrier.wait()
+    after = memory()
+    results.put({"rss": after["rss"] - before["rss"], "pss": after["pss"] - before["pss"], "scores": scores})
+    barrier.wait()
+
+
+def run(shared_dir: str, workers: int, students: int, photos: int, queries: np.ndarray) -> list[dict]:
+    context = multiprocessing.get_context("spawn")
+    barrier, results = context.Barrier(workers), context.Queue()
+    processes = [
+        context.Process(target=worker, args=(shared_dir, students, photos, queries, barrier, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    outcome = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return outcome
+
+
+def check_delta(shared_dir: str, students: dict[str, np.ndarray]):
+    uploader, other = GalleryCache(shared_dir=shared_dir), GalleryCache(shared_dir=shared_dir)
+    other.get("class", "1")
+    new_photo = normalize(np.random.default_rng(1).normal(size=(1, 512)))
+    uploader.apply_delta("class", "1", "2", {}, ["S00000"], {"S00001": new_photo})
+    updated = other.get("class", "2")
+    assert updated is not None and "S00000" not in updated.templates, "delta not visible to the other worker"
+    assert updated.templates["S00001"].count == len(students["S00001"]) + 1
+    assert other.get("class", "1") is None
+    print("A delta applied by one worker is seen by the others")
+
+
+def check_eviction(shared_dir: str, students: dict[str, np.ndarray]):
+    small = dict(list(students.items())[:10])
+    worker, other = GalleryCache(max_entries=2, shared_dir=shared_dir), GalleryCache(shared_dir=shared_dir)
+    for gallery_id in ("a", "b", "c"):
+        worker.put(gallery_id, "1", small)
+    assert other.get("a", "1") is None and other.get("c", "1") is not None
+    assert not list(Path(shared_dir, "a").glob("*.npy")), "evicted gallery still in the shared directory"
+    # Content another worker published since is left alone
+    other.put("b", "2", dict(list(students.items())[10:20]))
+    worker.put("d", "1", small)  # evicts its own "b"
+    assert other.get("b", "2") is not None
+    print("A gallery evicted by a worker's LRU is removed from the shared directory")
+
+
+def check_threads(shared_dir: str, students: dict[str, np.ndarray]):
+    cache = GalleryCache(shared_dir=shared_dir)
+    small = dict(list(students.items())[:10])
+    cache.put("threads", "0", small)
+
+    def writer():
+        for version in range(1, 40):
+            cache.put("threads", str(version), small if version % 2 else dict(list(students.items())[10:20]))
+
+    def reader():
+        for _ in range(200):
+            cache.get("threads")
+
+    threads = [threading.Thread(target=writer, daemon=True)] + [threading.Thread(target=reader, daemon=True) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+    assert not any(thread.is_alive() for thread in threads), "threads of one worker deadlocked"
+    print("Threads reading and updating one gallery do not deadlock")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--students", type=int, default=5000)
+    parser.add_argument("--photos", type=int, default=5)
+    args = parser.parse_args()
+
+    students = synthetic_students(args.students, args.photos)
+    queries = normalize(np.random.default_rng(2).normal(size=(40, 512)))
+    shared_dir = tempfile.mkdtemp(prefix="galleries-", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    published = GalleryCache(shared_dir=shared_dir).put("class", "1", students)
+    gallery_mb = published.gallery.matrix.nbytes / MB
+    print(f"Gallery: {args.students} students x {args.photos} embeddings, "
+          f"{published.gallery.size} template rows ({gallery_mb:.1f} MB)")
+
+    private = run("", args.workers, args.students, args.photos, queries)
+    shared = run(shared_dir, args.workers, args.students, args.photos, queries)
+    for name, outcome in (("private copies", private), ("shared directory", shared)):
+        rss = np.mean([o["rss"] for o in outcome]) / MB
+        pss = np.mean([o["pss"] for o in outcome]) / MB
+        print(f"{name:>16}: per worker RSS +{rss:.1f} MB, PSS +{pss:.1f} MB; "
+              f"{args.workers} workers PSS +{pss * args.workers:.1f} MB")
+
+    expected = score_faces(queries, published.gallery)
+    assert all(np.allclose(o["scores"], expected, atol=1e-6) for o in private + shared)
+    private_pss = np.mean([o["pss"] for o in private])
+    shared_pss = np.mean([o["pss"] for o in shared])
+    assert shared_pss * args.workers < private_pss * 1.5, (shared_pss, private_pss)
+
+    check_delta(shared_dir, students)
+    check_eviction(shared_dir, students)
+    check_threads(shared_dir, students)
+    print("✅ Workers share one memory-mapped copy of the gallery and score it like their own")
+
+
+if __name__ == "__main__":
+    main()
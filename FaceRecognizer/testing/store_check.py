@@ -0,0 +1,106 @@
+"""
+Checks the embedding store (utils/store.py) and the /identify index on top
+of it: load time of a 100k-vector store against a JSON gallery,
+log replay (append, put, delete, a torn trailing record), compaction, an
+IVF index re-opened from its snapshot, and a second opener (another worker)
+getting a read-only view.
+
+Run from FaceRecognizer/:
+python -m testing.store_check
+"""
+
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from utils.index import IdentityIndex
+from utils.matcher import normalize
+from utils.store import EmbeddingStore, ReadOnlyStoreError
+
+ROWS = 100_000
+JSON_ROWS = 10_000  # parsing 100k rows of JSON takes most of a minute
+
+rng = np.random.default_rng(3)
+root = Path(tempfile.mkdtemp())
+ids = [f"S{i:06d}" for i in range(ROWS)]
+matrix = normalize(rng.normal(size=(ROWS, 512)))
+
+# Compacted store vs JSON
+store = EmbeddingStore(root / "db")
+store.rewrite(ids, matrix)
+store.close()
+(root / "db.json").write_text(json.dumps(dict(zip(ids[:JSON_ROWS], matrix[:JSON_ROWS].tolist()))))
+
+start = time.perf_counter()
+loaded_ids, loaded = EmbeddingStore(root / "db").rows()
+store_ms = (time.perf_counter() - start) * 1000
+start = time.perf_counter()
+from_json = json.loads((root / "db.json").read_text())
+json_ms = (time.perf_counter() - start) * 1000
+print(f"Loaded {ROWS} vectors from the store in {store_ms:.1f}ms, {JSON_ROWS} from JSON in {json_ms:.0f}ms")
+assert loaded_ids == ids and isinstance(loaded, np.memmap) and np.array_equal(loaded[123], matrix[123])
+
+# Log replay
+store = EmbeddingStore(root / "small", dim=4)
+store.append("a", np.ones((2, 4)))
+store.append("b", np.full(4, 2.0))
+store.put("a", np.full(4, 3.0))
+store.delete("b")
+store.append("c", np.full(4, 4.0))
+store.close()
+with open(root / "small" / (root / "small" / "CURRENT").read_text() / "log.bin", "ab") as f:
+    f.write(b"A\x01\x00\x01\x00")  # torn record: header cut short
+
+store = EmbeddingStore(root / "small")
+row_ids, rows = store.rows()
+assert row_ids == ["a", "c"] and rows[:, 0].tolist() == [3.0, 4.0], (row_ids, rows)
+store.append("d", np.full(4, 5.0))  # appends after the cut-off record stay readable
+store.close()
+store = EmbeddingStore(root / "small")
+assert store.rows()[0] == ["a", "c", "d"]
+
+# Compaction
+store.compact()
+assert store.log_records == 0 and store.rows()[0] == ["a", "c", "d"]
+assert len(list((root / "small").glob("gen-*"))) == 1
+print("✅ Log replay and compaction keep the live rows")
+
+# IVF index persisted in a store
+index = IdentityIndex.open(root / "index", nlist=32, nprobe=4, train_size=2000)
+for i in range(3000):
+    index.add(ids[i], matrix[i])
+index.delete(ids[0])
+before = index.search(matrix[1:50], 1)
+index.close()
+
+reopened = IdentityIndex.open(root / "index", nlist=32, nprobe=4, train_size=2000)
+assert reopened.search(matrix[1:50], 1) == before and reopened.size == 2999
+reopened.snapshot()
+reopened.close()
+reopened = IdentityIndex.open(root / "index", nlist=32, nprobe=4, train_size=2000)
+assert reopened.trained and not reopened.dirty
+assert [r[0][0] for r in reopened.search(matrix[1:50], 1)] == ids[1:50]
+assert ids[0] not in [r[0][0] for r in reopened.search(matrix[:1], 3)]
+print("✅ Index re-opens from its log and from its snapshot with the same answers")
+reopened.close()
+
+# One writer: a second opener (another worker on the same INDEX_DIR) only reads
+writer = IdentityIndex.open(root / "index", nlist=32, nprobe=4, train_size=2000)
+reader = IdentityIndex.open(root / "index", nlist=32, nprobe=4, train_size=2000)
+assert writer.writable and not reader.writable
+for update in (lambda: reader.add("new", matrix[0]), lambda: reader.delete(ids[1]), reader.snapshot):
+    try:
+        update()
+        raise AssertionError("a read-only index accepted an update")
+    except ReadOnlyStoreError:
+        pass
+assert reader.size == 2999 and "new" not in [r[0][0] for r in reader.search(matrix[:1], 1)]
+writer.add("new", matrix[0])
+writer.close()
+reader.close()
+reopened = IdentityIndex.open(root / "index", nlist=32, nprobe=4, train_size=2000)
+assert reopened.writable and reopened.search(matrix[:1], 1)[0][0][0] == "new"
+print("✅ Only the first process to open the index writes it")
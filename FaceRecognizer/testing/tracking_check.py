@@ -0,0 +1,112 @@
+"""
+Checks the video tracker (utils/tracking.py) without the InsightFace models:
+a synthetic pan across a "classroom" of coloured squares, encoded as MP4, is
+tracked with a stand-in detector that finds the squares and a stand-in
+recognizer that embeds their colour. Every square has to come out as exactly
+one identity, while only a fraction of the frames reaches the detector. Track
+merging must not chain look-alikes together nor join faces seen side by side.
+
+Run from FaceRecognizer/:
+python -m testing.tracking_check
+"""
+
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+from utils.matcher import normalize
+from utils.pipeline import use_face_analyzer
+from utils.tracking import merge_tracks, track_faces
+
+FRAME = (640, 480)
+SIDE = 90
+COLOURS = [(230, 40, 40), (40, 230, 40), (40, 40, 230), (230, 230, 40), (230, 40, 230), (40, 230, 230)]
+
+
+class SquareDetector:
+    def detect(self, image, max_num=0, metric='default'):
+        boxes, kpss = [], []
+        for colour in COLOURS:
+            mask = np.all(np.abs(image.astype(np.int16) - colour) < 60, axis=2)
+            ys, xs = np.nonzero(mask)
+            if len(xs) < SIDE * SIDE // 4:
+                continue
+            x1, y1, x2, y2 = xs.min(), ys.min(), xs.max(), ys.max()
+            boxes.append([x1, y1, x2, y2, min(1.0, len(xs) / (SIDE * SIDE))])
+            w, h = x2 - x1, y2 - y1
+            kpss.append([[x1 + w * x, y1 + h * y] for x, y in [(.3, .4), (.7, .4), (.5, .6), (.35, .8), (.65, .8)]])
+        return np.array(boxes, dtype=np.float32).reshape(-1, 5), np.array(kpss, dtype=np.float32).reshape(-1, 5, 2)
+
+
+class ColourRecognizer:
+    input_size = (112, 112)
+
+    def get_feat(self, crops):
+        centre = np.stack([crop[40:72, 40:72].reshape(-1, 3).mean(axis=0) for crop in crops])
+        return np.concatenate([centre, np.zeros((len(crops), 509))], axis=1).astype(np.float32)
+
+
+class StandInAnalyzer:
+    def __init__(self):
+        self.det_model = SquareDetector()
+        self.models = {'detection': self.det_model, 'recognition': ColourRecognizer()}
+
+
+def panning_video(seconds: int = 4, fps: int = 30) -> bytes:
+    rng = np.random.default_rng(0)
+    width = FRAME[0] * 3
+    room = cv2.resize((rng.random((FRAME[1] // 8, width // 8, 3)) * 80 + 60).astype(np.uint8), (width, FRAME[1]))
+    for i, colour in enumerate(COLOURS):
+        x, y = 150 + i * 280, 80 + (i % 2) * 200
+        room[y:y + SIDE, x:x + SIDE] = colour[::-1]  # BGR for the writer
+
+    path = tempfile.mktemp(suffix=".mp4")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, FRAME)
+    frames = seconds * fps
+    for i in range(frames):
+        x = round(i * (width - FRAME[0]) / (frames - 1))
+        writer.write(np.ascontiguousarray(room[:, x:x + FRAME[0]]))
+    writer.release()
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+
+def main():
+    analyzer = StandInAnalyzer()
+    with use_face_analyzer(analyzer):
+        tracked = track_faces(panning_video(), ".mp4")
+
+    embeddings = normalize(analyzer.models['recognition'].get_feat(list(tracked["crops"])))
+    groups = merge_tracks(embeddings, tracked["qualities"], 0.99, tracked["trackFrames"])
+    frames = tracked["frames"]
+    print(f"{frames['processed']} of {frames['sampled']} sampled frames detected, "
+          f"{len(tracked['tracks'])} tracks, {len(groups)} identities")
+
+    assert frames["processed"] < frames["sampled"], frames
+    assert len(tracked["tracks"]) <= 2 * len(COLOURS), tracked["tracks"]
+    assert len(groups) == len(COLOURS), groups
+    print("✅ Every face is tracked to one identity and recognized once")
+    check_merging()
+
+
+def check_merging():
+    # a ~ b and b ~ c, but a and c are different faces: no chaining through b
+    angles = np.radians([0, 40, 80])
+    chain = np.stack([np.cos(angles), np.sin(angles)], axis=1).astype(np.float32)
+    groups = merge_tracks(chain, [1.0, 2.0, 3.0], 0.7)
+    assert sorted(map(sorted, groups)) in ([[0, 1], [2]], [[0], [1, 2]]), groups
+    # Identical twins side by side in one frame stay two tracks
+    twins = normalize(np.array([[1, 0], [1, 0.01], [1, 0.02]], dtype=np.float32))
+    groups = merge_tracks(twins, [1.0, 2.0, 3.0], 0.9, [[0, 5], [5], [9]])
+    assert len(groups) == 2 and [0, 1] not in map(sorted, groups), groups
+    assert groups[0][0] == 2 or groups[1][0] == 2  # best quality first
+    print("✅ Merging neither chains look-alikes nor joins faces from the same frame")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,15 @@
+# Run from FaceRecognizer/: python -m testing.train
 import face_recognition
-import json
 import os
 
-# Path to the dataset and database file
-dataset_folder = "dataset"
-db_file = "db.json"
+from utils.store import EmbeddingStore
 
-# Load existing data if db.json exists
-if os.path.exists(db_file):
-    with open(db_file, "r") as f:
-        student_db = json.load(f)
-else:
-    student_db = []
+# Path to the dataset and embedding store (face_recognition encodings are 128-d)
+here = os.path.dirname(os.path.abspath(__file__))
+dataset_folder = os.path.join(here, "dataset")
+db_dir = os.path.join(here, "face_recognition_db")
+
+student_db = EmbeddingStore(db_dir, dim=128)
 
 # Range of student image IDs
 start_id = 1
@@ -32,17 +30,9 @@ for i in range(start_id, end_id + 1):
         print(f"⚠️ No face found in image: {roll_number}")
         continue
 
-    embedding = encodings[0]
-    student_record = {
-        "roll_number": roll_number,
-        "embedding": embedding.tolist()
-    }
-
-    student_db.append(student_record)
+    # Re-running replaces a student's embedding instead of duplicating it
+    student_db.put(roll_number, encodings[0])
     print(f"✅ Processed: {roll_number}")
 
-# Save updated database
-with open(db_file, "w") as f:
-    json.dump(student_db, f, indent=2)
-
-print("✅ All embeddings saved to db.json")
+student_db.compact()
+print(f"✅ All embeddings saved to {db_dir}")
@@ -0,0 +1,139 @@
+"""
+Checks the S3 upload subsystem against moto's in-process S3 stand-in
+(pip install moto). Point AWS_ENDPOINT_URL at MinIO or `moto_server`
+instead to exercise a real HTTP endpoint.
+
+Besides plain concurrent uploads it runs main:app (UPLOAD_MODE=deferred,
+ANNOTATION_MODE=lazy) with the stand-in models of testing/tracking_check.py:
+a lecture's uploads report "pending" until S3 accepts them, and an annotated
+image is only drawn and uploaded once GET /annotated asks for it. Uploads
+that S3 keeps refusing must end up "failed" once botocore runs out of retries.
+
+Run from FaceRecognizer/:
+python -m testing.upload_check
+"""
+
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("AWS_BUCKET_NAME", "attendance-test")
+os.environ.setdefault("AWS_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("UPLOAD_MODE", "deferred")
+os.environ.setdefault("ANNOTATION_MODE", "lazy")
+os.environ.setdefault("S3_RETRIES", "3")
+os.environ.setdefault("INFERENCE_BACKEND", "thread")
+os.environ.setdefault("INDEX_DIR", tempfile.mkdtemp(prefix="index-"))
+
+from botocore.awsrequest import AWSResponse
+from moto import mock_aws
+
+
+class ErrorBody(io.BytesIO):
+    def stream(self, **kwargs):
+        yield self.getvalue()
+
+
+def wait_for(condition, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+with mock_aws():
+    from utils.config import S3_RETRIES
+    from utils.storage import S3Uploader, bucket, download_from_s3, get_s3_client
+
+    get_s3_client().create_bucket(Bucket=bucket)
+
+    path = "lectures/subject/lecture/annotated_images"
+    images = {f"{i}.jpg": os.urandom(256 * 1024) for i in range(20)}
+
+    uploader = S3Uploader(concurrency=8)
+    start = time.time()
+    futures = [uploader.submit(data, name, path) for name, data in images.items()]
+    for future in futures:
+        future.result()
+    print(f"Uploaded {len(images)} images in {time.time() - start:.2f}s")
+
+    status = uploader.status(path)
+    assert all(s["status"] == "uploaded" for s in status.values()), status
+    for name, data in images.items():
+        assert download_from_s3(f"{path}/{name}") == data
+
+    uploader.shutdown()
+    print("✅ Concurrent uploads match their source bytes")
+
+    # S3 answers every PutObject with 503 SlowDown: the first attempt and S3_RETRIES retries, then failed
+    attempts = []
+
+    def slow_down(request, **kwargs):
+        attempts.append(request.url)
+        body = b"<Error><Code>SlowDown</Code><Message>Please reduce your request rate.</Message></Error>"
+        return AWSResponse(request.url, 503, {}, ErrorBody(body))
+
+    events = get_s3_client().meta.events
+    events.register_first("before-send.s3.PutObject", slow_down)
+    uploader = S3Uploader(concurrency=2)
+    future = uploader.submit(b"refused", "refused.jpg", path)
+    error = future.exception(timeout=60)
+    events.unregister("before-send.s3.PutObject", slow_down)
+    uploader.shutdown()
+
+    status = uploader.status(path)["refused.jpg"]
+    print(f"Refused upload after {len(attempts)} attempts: {status}")
+    assert error is not None and len(attempts) == 1 + S3_RETRIES, (error, attempts)
+    assert status["status"] == "failed" and "SlowDown" in status["error"], status
+    print("✅ An upload S3 keeps refusing is reported failed once the retries run out")
+
+    from fastapi.testclient import TestClient
+
+    import main
+    from testing.index_writer_check import photo
+    from testing.tracking_check import COLOURS, StandInAnalyzer
+    from utils.lecture_faces import FILENAME as LECTURE_FACES_FILE, lecture_path
+    from utils.pipeline import use_face_analyzer
+
+    lecture = lecture_path("maths", "l1")
+    lecture_photo = photo(COLOURS[0])
+    gate = threading.Event()
+
+    def hold(**kwargs):
+        gate.wait(30)
+
+    with use_face_analyzer(StandInAnalyzer()), TestClient(main.app) as client:
+        response = client.post("/generate-embeddings", files=[("files", ("S1.png", lecture_photo))])
+        gallery = [{"rollNumber": "S1", "embeddings": [response.json()["embeddings"][0]]}]
+
+        # Deferred: the response goes out while S3 is still holding the lecture's faces.npz
+        events.register_first("before-send.s3.PutObject", hold)
+        response = client.post("/verify-attendance", data={
+            "subjectId": "maths", "lectureId": "l1", "studentEmbeddings": json.dumps(gallery)
+        }, files=[("images", ("1.png", lecture_photo))])
+        assert response.status_code == 200, response.text
+        [result] = response.json()["results"]
+        assert result["matchedIds"] == ["S1"], result
+        assert main.s3_uploader.status(lecture)[LECTURE_FACES_FILE]["status"] == "pending"
+        gate.set()
+        wait_for(lambda: main.s3_uploader.status(lecture)[LECTURE_FACES_FILE]["status"] != "pending")
+        events.unregister("before-send.s3.PutObject", hold)
+        assert main.s3_uploader.status(lecture)[LECTURE_FACES_FILE]["status"] == "uploaded"
+        print("✅ Deferred uploads go from pending to uploaded after the response")
+
+        # Lazy: nothing is drawn until the annotated image is asked for
+        assert result["uploadStatus"] == "on_request", result
+        assert client.get("/uploads/maths/l1").status_code == 404
+        get_s3_client().put_object(Bucket=bucket, Key=f"{lecture}/images/1.png", Body=lecture_photo)
+        drawn = client.get("/annotated/maths/l1/1.png")
+        assert drawn.status_code == 200 and drawn.content, drawn.status_code
+        wait_for(lambda: client.get("/uploads/maths/l1").json()["files"]["1.png"]["status"] != "pending")
+        assert client.get("/uploads/maths/l1").json()["files"]["1.png"]["status"] == "uploaded"
+        assert download_from_s3(f"{lecture}/annotated_images/1.png") == drawn.content
+        assert client.get("/annotated/maths/l1/1.png").content == drawn.content
+        print("✅ Lazy annotations are drawn from faces.npz on request and cached in S3")
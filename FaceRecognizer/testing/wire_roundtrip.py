@@ -0,0 +1,69 @@
+"""
+Round-trip check for the embedding wire formats.
+
+Builds a synthetic division gallery, sends it through the JSON payload and the
+binary blob (float32 and float16), and checks that /verify-attendance style
+matching gives the same matchedIds in every format.
+
+Run from FaceRecognizer/:
+python -m testing.wire_roundtrip
+"""
+
+import json
+
+import numpy as np
+
+from utils.gallery import CachedGallery, students_from_payload, students_from_rows
+from utils.matcher import match_faces, normalize
+from utils.wire import decode_embeddings, encode_embeddings
+
+STUDENTS = 135
+EMBEDDINGS_PER_STUDENT = 3
+FACES = 60
+
+rng = np.random.default_rng(7)
+
+# Synthetic division: a few noisy enrollment photos per student
+identities = normalize(rng.normal(size=(STUDENTS, 512)))
+roll_numbers = [f"24CI2110{i:03d}" for i in range(1, STUDENTS + 1)]
+student_embeddings = [
+    {
+        "rollNumber": roll_number,
+        "embeddings": [
+            {"image": f"{k}.jpg", "embedding": normalize(identity + rng.normal(scale=0.03, size=512)).tolist()}
+            for k in range(EMBEDDINGS_PER_STUDENT)
+        ],
+    }
+    for roll_number, identity in zip(roll_numbers, identities)
+]
+
+# Lecture photo: some enrolled students plus strangers
+present = rng.choice(STUDENTS, size=FACES - 10, replace=False)
+faces = normalize(np.concatenate([
+    identities[present] + rng.normal(scale=0.03, size=(len(present), 512)),
+    rng.normal(size=(10, 512)),
+]))
+
+# JSON path, as /verify-attendance parses it
+json_students = students_from_payload(json.loads(json.dumps(student_embeddings)))
+expected, expected_scores = match_faces(faces, CachedGallery.from_students("json", "", json_students).gallery)
+
+row_ids = [s["rollNumber"] for s in student_embeddings for _ in s["embeddings"]]
+matrix = np.array([e["embedding"] for s in student_embeddings for e in s["embeddings"]], dtype=np.float32)
+
+json_size = len(json.dumps(student_embeddings))
+for dtype in ("float32", "float16"):
+    blob = encode_embeddings(row_ids, matrix, dtype)
+    ids, decoded = decode_embeddings(blob)
+    assert ids == row_ids, f"{dtype}: row ids changed"
+
+    labels, scores = match_faces(faces, CachedGallery.from_students(dtype, "", students_from_rows(ids, decoded)).gallery)
+    assert labels == expected, f"{dtype}: matchedIds differ from JSON"
+    assert np.allclose(scores, expected_scores, atol=1e-2), f"{dtype}: scores drifted"
+
+    print(f"✅ {dtype}: {len(blob)} bytes vs {json_size} bytes of JSON, identical matchedIds")
+
+# /generate-embeddings response: file names as row ids
+ids, decoded = decode_embeddings(encode_embeddings(["1.jpg", "2.jpg"], matrix[:2]))
+assert ids == ["1.jpg", "2.jpg"] and np.array_equal(decoded, matrix[:2])
+print(f"✅ {sum(label != 'Unknown' for label in expected)} of {FACES} faces matched in every format")
@@ -0,0 +1,56 @@
+"""
+Reading enrollment photos out of zip and tar archives (optionally gzip, bzip2
+or xz compressed) without extracting them to disk. Tar archives are read as
+a stream; zip archives need a seekable file because their index is at the end.
+"""
+
+import tarfile
+import zipfile
+from pathlib import PurePosixPath
+from typing import BinaryIO, Iterator
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png"}
+
+
+def _skip(name: str) -> bool:
+    # Folders and macOS resource forks added by Finder's "Compress"
+    path = PurePosixPath(name)
+    return name.endswith("/") or "__MACOSX" in path.parts or path.name.startswith("._")
+
+
+def iter_archive(file: BinaryIO) -> Iterator[tuple[str, bytes | None]]:
+    """
+    Yields (member name, contents) for every file in the archive, one at a
+    time. Members that are not images come with None instead of contents.
+    """
+    if zipfile.is_zipfile(file):
+        file.seek(0)
+        with zipfile.ZipFile(file) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or _skip(info.filename):
+                    continue
+                supported = PurePosixPath(info.filename).suffix.lower() in IMAGE_SUFFIXES
+                yield info.filename, archive.read(info) if supported else None
+        return
+
+    file.seek(0)
+    try:
+        archive = tarfile.open(fileobj=file, mode="r|*")
+    except tarfile.TarError:
+        raise ValueError("Expected a zip or tar archive")
+    with archive:
+        for member in archive:
+            if not member.isfile() or _skip(member.name):
+                continue
+            supported = PurePosixPath(member.name).suffix.lower() in IMAGE_SUFFIXES
+            yield member.name, archive.extractfile(member).read() if supported else None
+
+
+def read_batch(entries: Iterator, size: int) -> list:
+    """Next `size` entries of an iterator (fewer at the end, none when exhausted)."""
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) == size:
+            break
+    return batch
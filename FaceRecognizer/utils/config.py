@@ -1,10 +1,143 @@
-
 import os
 from dotenv import load_dotenv
 
+# Settings below are read at import time, so .env has to be loaded first
+load_dotenv()
+
 def load_env():
     load_dotenv()
     os.environ["AWS_ACCESS_KEY_ID"] = os.getenv("AWS_ACCESS_KEY_ID", "")
     os.environ["AWS_SECRET_ACCESS_KEY"] = os.getenv("AWS_SECRET_ACCESS_KEY", "")
     os.environ["AWS_BUCKET_NAME"] = os.getenv("AWS_BUCKET_NAME", "")
     os.environ["AWS_REGION"] = os.getenv("AWS_REGION", "")
+
+# Gallery cache
+GALLERY_CACHE_SIZE = int(os.getenv("GALLERY_CACHE_SIZE", "32"))
+# Directory (best on tmpfs, e.g. /dev/shm/...) where cached galleries are published as
+# memory-mapped files that every worker process reads; empty keeps them per process
+GALLERY_SHARED_DIR = os.getenv("GALLERY_SHARED_DIR", "")
+# Students are matched through the centroid of their embeddings plus at most
+# PROTOTYPE_EXEMPLARS diverse ones; embeddings PROTOTYPE_DEDUP_SIMILARITY alike
+# to a kept row are not kept again
+PROTOTYPE_EXEMPLARS = int(os.getenv("PROTOTYPE_EXEMPLARS", "4"))
+PROTOTYPE_DEDUP_SIMILARITY = float(os.getenv("PROTOTYPE_DEDUP_SIMILARITY", "0.9"))
+
+# Inference execution: "thread" shares one FaceAnalysis, "process" gives every worker its own,
+# "shared" sends the work to the one inference process listening on INFERENCE_SOCKET
+# (started by serve.py), so several uvicorn workers share one copy of the models
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "thread")
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET", "/tmp/face-recognizer-inference.sock")
+# Shared secret of the inference process and its workers; the process runs whatever
+# steps a client holding it sends, so there is no default (serve.py generates one)
+INFERENCE_AUTHKEY = os.getenv("INFERENCE_AUTHKEY", "")
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(os.cpu_count() or 1)))
+# Tasks allowed in flight (running + waiting) before requests get "server busy"
+INFERENCE_QUEUE_DEPTH = int(os.getenv("INFERENCE_QUEUE_DEPTH", str(4 * INFERENCE_WORKERS)))
+# A lecture is refused with "server busy" only on its first photo; its later photos wait up
+# to INFERENCE_SLOT_WAIT_SECONDS for a slot instead of failing a half-processed lecture
+INFERENCE_SLOT_WAIT_SECONDS = float(os.getenv("INFERENCE_SLOT_WAIT_SECONDS", "60"))
+
+# Recognition batching: faces per ONNX call, and how long to wait for more
+# faces from other requests before running a partial batch (0 = no waiting)
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "64"))
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))
+
+# Photos of one request move through detect -> embed -> match -> annotate stages
+# concurrently; each stage gets this many workers and at most PIPELINE_DEPTH photos
+# wait between two stages
+PIPELINE_DEPTH = int(os.getenv("PIPELINE_DEPTH", "2"))
+PIPELINE_DETECT_CONCURRENCY = int(os.getenv("PIPELINE_DETECT_CONCURRENCY", "2"))
+PIPELINE_EMBED_CONCURRENCY = int(os.getenv("PIPELINE_EMBED_CONCURRENCY", "2"))
+PIPELINE_ANNOTATE_CONCURRENCY = int(os.getenv("PIPELINE_ANNOTATE_CONCURRENCY", "2"))
+
+# Model
+# InsightFace model pack (buffalo_l, buffalo_m, buffalo_s, ...) and the pack's models to
+# load; the service only ever uses detection and recognition
+MODEL_PACK = os.getenv("MODEL_PACK", "buffalo_l")
+MODEL_MODULES = [m for m in os.getenv("MODEL_MODULES", "detection,recognition").split(",") if m]
+DET_SIZE = int(os.getenv("DET_SIZE", "640"))
+
+# CPU-optimized inference (opt-in): INFERENCE_DEVICE=cpu skips CUDA and applies the
+# ONNX Runtime session settings below; MODEL_PRECISION=int8 loads the quantized
+# "<MODEL_PACK>_int8" pack built by `python -m utils.quantize` (implies cpu)
+INFERENCE_DEVICE = os.getenv("INFERENCE_DEVICE", "auto")
+MODEL_PRECISION = os.getenv("MODEL_PRECISION", "fp32")
+ORT_INTRA_OP_THREADS = int(os.getenv("ORT_INTRA_OP_THREADS", "0"))
+ORT_INTER_OP_THREADS = int(os.getenv("ORT_INTER_OP_THREADS", "0"))
+ORT_GRAPH_OPTIMIZATION = os.getenv("ORT_GRAPH_OPTIMIZATION", "all")
+
+# Image decoding: "full" decodes every upload at full resolution, "draft" decodes
+# JPEGs with DCT scaling close to DET_SIZE for detection and re-decodes at the
+# smallest scale that keeps faces at least REC_MIN_FACE_PX wide for recognition
+DECODE_MODE = os.getenv("DECODE_MODE", "draft")
+REC_MIN_FACE_PX = int(os.getenv("REC_MIN_FACE_PX", "112"))
+
+# Quality gate between detection and recognition for attendance photos, off until its
+# thresholds are validated on real lecture photos: faces whose shorter side is under
+# QUALITY_MIN_FACE_PX original pixels, scoring under QUALITY_MIN_DET_SCORE, turned further
+# than QUALITY_MAX_YAW (nose offset from the eye midpoint over the eye distance, 0 = frontal)
+# or less sharp than QUALITY_MIN_SHARPNESS (Laplacian variance at the detection scale, as
+# /detect reports it) are not embedded
+QUALITY_GATE = os.getenv("QUALITY_GATE", "false").lower() == "true"
+QUALITY_MIN_FACE_PX = float(os.getenv("QUALITY_MIN_FACE_PX", "24"))
+QUALITY_MIN_DET_SCORE = float(os.getenv("QUALITY_MIN_DET_SCORE", "0.55"))
+QUALITY_MAX_YAW = float(os.getenv("QUALITY_MAX_YAW", "0.7"))
+QUALITY_MIN_SHARPNESS = float(os.getenv("QUALITY_MIN_SHARPNESS", "20"))
+
+# S3 uploads of annotated images: "inline" waits for them before answering,
+# "deferred" answers right away and reports progress on /uploads
+UPLOAD_MODE = os.getenv("UPLOAD_MODE", "inline")
+S3_UPLOAD_CONCURRENCY = int(os.getenv("S3_UPLOAD_CONCURRENCY", "8"))
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", str(max(10, S3_UPLOAD_CONCURRENCY + 2))))
+S3_RETRIES = int(os.getenv("S3_RETRIES", "5"))
+
+# Annotated images: "inline" renders them while answering, "deferred" renders and
+# uploads them after the response, "lazy" only keeps the boxes and labels (faces.npz)
+# and renders on the first GET /annotated, "none" skips them. Rendered images are
+# shrunk to ANNOTATION_MAX_SIDE pixels on their long side (0 keeps the original size)
+ANNOTATION_MODE = os.getenv("ANNOTATION_MODE", "inline")
+ANNOTATION_MAX_SIDE = int(os.getenv("ANNOTATION_MAX_SIDE", "0"))
+ANNOTATION_JPEG_QUALITY = int(os.getenv("ANNOTATION_JPEG_QUALITY", "75"))
+# Threads rendering deferred and lazy annotations, kept off the inference pool
+ANNOTATION_WORKERS = int(os.getenv("ANNOTATION_WORKERS", "2"))
+
+# Detection + embedding results cached by image hash: in-memory LRU (0 disables) and
+# an optional on-disk tier in INFERENCE_CACHE_DIR
+INFERENCE_CACHE_MB = float(os.getenv("INFERENCE_CACHE_MB", "256"))
+INFERENCE_CACHE_DIR = os.getenv("INFERENCE_CACHE_DIR", "")
+INFERENCE_CACHE_DISK_MB = float(os.getenv("INFERENCE_CACHE_DISK_MB", "2048"))
+
+# Institution-wide identification (/identify): IVF-flat index over every enrolled
+# student, snapshotted to INDEX_DIR. Queries scan the IVF_NPROBE nearest of IVF_NLIST
+# clusters; the index is searched exhaustively until IVF_TRAIN_SIZE embeddings
+# (default 39 x IVF_NLIST) are enrolled
+INDEX_DIR = os.getenv("INDEX_DIR", "data/index")
+IVF_NLIST = int(os.getenv("IVF_NLIST", "256"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+IVF_TRAIN_SIZE = int(os.getenv("IVF_TRAIN_SIZE", "0"))
+IDENTIFY_TOP_K = int(os.getenv("IDENTIFY_TOP_K", "5"))
+
+# Bulk enrollment (/bulk-enroll): archive photos decoded and embedded per batch
+BULK_ENROLL_BATCH = int(os.getenv("BULK_ENROLL_BATCH", "32"))
+
+# Keep every lecture's face boxes and embeddings in S3 (faces.npz) for /rematch
+STORE_LECTURE_FACES = os.getenv("STORE_LECTURE_FACES", "true").lower() == "true"
+REMATCH_DOWNLOAD_CONCURRENCY = int(os.getenv("REMATCH_DOWNLOAD_CONCURRENCY", "16"))
+
+# Video and burst attendance (/verify-attendance/video): candidate frames per second,
+# camera pan (fraction of the frame width) or time gap after which a candidate is
+# detected, and a cap on detected frames. Detections join a track at TRACK_IOU overlap;
+# tracks unseen for TRACK_MAX_AGE detected frames stop matching, and tracks whose best
+# faces are all pairwise TRACK_MERGE_SIMILARITY alike, never in the same frame, are merged
+# after recognition
+VIDEO_SAMPLE_FPS = float(os.getenv("VIDEO_SAMPLE_FPS", "5"))
+VIDEO_MIN_SHIFT = float(os.getenv("VIDEO_MIN_SHIFT", "0.1"))
+VIDEO_MAX_GAP_SECONDS = float(os.getenv("VIDEO_MAX_GAP_SECONDS", "1.0"))
+VIDEO_MAX_FRAMES = int(os.getenv("VIDEO_MAX_FRAMES", "60"))
+TRACK_IOU = float(os.getenv("TRACK_IOU", "0.3"))
+TRACK_MAX_AGE = int(os.getenv("TRACK_MAX_AGE", "5"))
+TRACK_MERGE_SIMILARITY = float(os.getenv("TRACK_MERGE_SIMILARITY", "0.55"))
+
+# Background attendance jobs (/jobs): how long finished jobs stay queryable
+JOB_TTL_SECONDS = float(os.getenv("JOB_TTL_SECONDS", "3600"))
+MAX_JOBS = int(os.getenv("MAX_JOBS", "1000"))
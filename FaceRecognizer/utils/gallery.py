@@ -0,0 +1,332 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from urllib.parse import quote
+
+import numpy as np
+
+from utils.config import GALLERY_CACHE_SIZE, GALLERY_SHARED_DIR
+from utils.matcher import Gallery, normalize
+from utils.prototypes import Template
+
+
+class StaleGalleryError(Exception):
+    pass
+
+
+class CachedGallery:
+    """
+    One versioned gallery (usually a division). Keeps the per-student
+    templates (utils/prototypes.py) so that deltas can be applied without the
+    Backend re-sending everything, plus the stacked Gallery of their rows
+    used for matching.
+    """
+
+    def __init__(self, gallery_id: str, version: str, templates: dict[str, Template],
+                 gallery: Gallery | None = None, content_hash: str | None = None):
+        self.gallery_id = gallery_id
+        self.version = version
+        self.templates = templates
+        # Both are passed in when the rows already exist (SharedGalleries)
+        self.gallery = gallery if gallery is not None else self._stack()
+        self.content_hash = content_hash or self._hash()
+
+    @classmethod
+    def from_students(cls, gallery_id: str, version: str, students: dict[str, np.ndarray]) -> "CachedGallery":
+        return cls(gallery_id, version, templates_from(students))
+
+    def _stack(self) -> Gallery:
+        roll_numbers = sorted(self.templates)
+        if not roll_numbers:
+            return Gallery(np.empty((0, 512), dtype=np.float32), [])
+
+        rows = [self.templates[r].rows() for r in roll_numbers]
+        matrix = np.concatenate(rows)
+        row_ids = [r for r, student_rows in zip(roll_numbers, rows) for _ in range(len(student_rows))]
+        return Gallery(matrix, row_ids)
+
+    def _hash(self) -> str:
+        digest = hashlib.sha256()
+        for roll_number in self.gallery.roll_numbers:
+            digest.update(roll_number.encode())
+            digest.update(b"\0%d\0" % self.templates[roll_number].count)
+        digest.update(self.gallery.matrix.tobytes())
+        return digest.hexdigest()
+
+    def describe(self) -> dict:
+        return {
+            "galleryId": self.gallery_id,
+            "version": self.version,
+            "contentHash": self.content_hash,
+            "students": len(self.gallery),
+            "embeddings": sum(template.count for template in self.templates.values()),
+            "templateRows": self.gallery.size,
+        }
+
+
+def templates_from(students: dict[str, np.ndarray]) -> dict[str, Template]:
+    return {roll_number: Template.from_vectors(vectors) for roll_number, vectors in students.items()}
+
+
+def students_from_payload(student_embeddings: list[dict]) -> dict[str, np.ndarray]:
+    """
+    Converts the Backend's `studentEmbeddings` payload into rollNumber -> (k x 512)
+    float32 arrays. Students without embeddings are left out.
+    """
+    students = {}
+    for student in student_embeddings:
+        vectors = [item['embedding'] for item in student.get('embeddings') or []]
+        if vectors:
+            students[student['rollNumber']] = normalize(np.asarray(vectors, dtype=np.float32))
+    return students
+
+
+def students_from_rows(row_ids: list[str], matrix: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Same as students_from_payload, for the binary wire format where every row
+    carries its roll number.
+    """
+    matrix = normalize(matrix)
+    rows = {}
+    for row, roll_number in enumerate(row_ids):
+        rows.setdefault(roll_number, []).append(row)
+    return {roll_number: matrix[indices] for roll_number, indices in rows.items()}
+
+
+MANIFEST = "manifest.json"
+
+
+def _replace_with(path: Path, write):
+    temporary = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(temporary, "wb") as f:
+        write(f)
+    os.replace(temporary, path)
+
+
+class SharedGalleries:
+    """
+    Galleries published to a directory every worker process reads
+    (GALLERY_SHARED_DIR, best on tmpfs such as /dev/shm). Per gallery ID
+    there is a directory holding the template rows and running sums (.npy)
+    and the students (.json) in files named after the content hash, and
+    manifest.json with the current version and content hash, small enough to
+    check on every request. Workers open the .npy files with mmap_mode="r",
+    so every worker matches against the same pages instead of its own copy.
+    Writers hold an exclusive flock on the gallery, readers a shared one.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, gallery_id: str) -> Path:
+        # Dots escaped too, so "." and ".." stay inside the directory
+        return self.directory / quote(gallery_id, safe="").replace(".", "%2E")
+
+    @contextmanager
+    def locked(self, gallery_id: str, exclusive: bool = True):
+        path = self._path(gallery_id)
+        if not exclusive and not path.exists():
+            yield  # nothing published, nothing to read
+            return
+        path.mkdir(exist_ok=True)
+        with open(path / ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def manifest(self, gallery_id: str) -> dict | None:
+        try:
+            return json.loads((self._path(gallery_id) / MANIFEST).read_text())
+        except FileNotFoundError:
+            return None
+
+    def read(self, gallery_id: str) -> CachedGallery | None:
+        """Opens the published gallery; the caller holds the lock."""
+        manifest = self.manifest(gallery_id)
+        if manifest is None:
+            return None
+        path, content_hash = self._path(gallery_id), manifest["contentHash"]
+        matrix = np.load(path / f"{content_hash}.rows.npy", mmap_mode="r")
+        totals = np.load(path / f"{content_hash}.totals.npy", mmap_mode="r")
+        students = json.loads((path / f"{content_hash}.students.json").read_text())
+
+        templates, row_ids, offset = {}, [], 0
+        for i, (roll_number, count, rows) in enumerate(students):
+            templates[roll_number] = Template(totals[i], count, matrix[offset + 1:offset + rows], centroid=matrix[offset])
+            row_ids.extend([roll_number] * rows)
+            offset += rows
+        return CachedGallery(gallery_id, manifest["version"], templates, Gallery(matrix, row_ids), content_hash)
+
+    def publish(self, entry: CachedGallery) -> CachedGallery:
+        """
+        Writes `entry` (the caller holds the exclusive lock) and returns it
+        re-opened from the shared files. Content that is already published
+        only gets the new version.
+        """
+        path, content_hash = self._path(entry.gallery_id), entry.content_hash
+        gallery = entry.gallery
+        current = self.manifest(entry.gallery_id)
+        if current is None or current["contentHash"] != content_hash:
+            totals = np.zeros((len(gallery), gallery.matrix.shape[1]), dtype=np.float64)
+            for i, roll_number in enumerate(gallery.roll_numbers):
+                totals[i] = entry.templates[roll_number].total
+            rows = np.diff(np.append(gallery.offsets, gallery.size))
+            students = [[r, entry.templates[r].count, int(n)] for r, n in zip(gallery.roll_numbers, rows)]
+            _replace_with(path / f"{content_hash}.rows.npy", lambda f: np.save(f, gallery.matrix))
+            _replace_with(path / f"{content_hash}.totals.npy", lambda f: np.save(f, totals))
+            _replace_with(path / f"{content_hash}.students.json", lambda f: f.write(json.dumps(students).encode()))
+
+        manifest = {"version": entry.version, "contentHash": content_hash}
+        _replace_with(path / MANIFEST, lambda f: f.write(json.dumps(manifest).encode()))
+        # Workers still mapping older content keep their pages until they drop it
+        for stale in self._content_files(path):
+            if not stale.name.startswith(content_hash):
+                stale.unlink(missing_ok=True)
+        return self.read(entry.gallery_id)
+
+    @staticmethod
+    def _content_files(path: Path) -> list[Path]:
+        return [*path.glob("*.npy"), *path.glob("*.students.json")]
+
+    def remove(self, gallery_id: str, content_hash: str | None = None) -> bool:
+        """Unpublishes the gallery; with `content_hash`, only while it still holds that content."""
+        with self.locked(gallery_id):
+            path = self._path(gallery_id)
+            manifest = self.manifest(gallery_id)
+            if content_hash is not None and (manifest is None or manifest["contentHash"] != content_hash):
+                return False
+            existed = manifest is not None
+            for published in [path / MANIFEST, *self._content_files(path)]:
+                published.unlink(missing_ok=True)
+            return existed
+
+
+class GalleryCache:
+    """
+    LRU cache of CachedGallery objects keyed by gallery ID. With a shared
+    directory (GALLERY_SHARED_DIR) every upload and delta is also published
+    there, and galleries another worker process published are picked up
+    from it, memory-mapped. A gallery the LRU evicts is unpublished as well
+    (unless another worker has replaced its content since), so that
+    GALLERY_CACHE_SIZE also bounds what stays in the shared directory.
+    """
+
+    def __init__(self, max_entries: int = GALLERY_CACHE_SIZE, shared_dir: str = GALLERY_SHARED_DIR):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, CachedGallery] = OrderedDict()
+        self._lock = threading.RLock()
+        self.shared = SharedGalleries(shared_dir) if shared_dir else None
+        self._unpublish: list[tuple[str, str]] = []  # evicted, removed once no gallery lock is held
+
+    def _shared_lock(self, gallery_id: str):
+        return self.shared.locked(gallery_id) if self.shared is not None else nullcontext()
+
+    def get(self, gallery_id: str, version: str | None = None) -> CachedGallery | None:
+        if self.shared is not None:
+            entry = self._get_shared(gallery_id, version)
+            self._unpublish_evicted()
+            return entry
+        with self._lock:
+            entry = self._entries.get(gallery_id)
+            if entry is None or (version is not None and entry.version != version):
+                return None
+            self._entries.move_to_end(gallery_id)
+            return entry
+
+    def _get_shared(self, gallery_id: str, version: str | None) -> CachedGallery | None:
+        """The published gallery is authoritative: another worker may have updated or evicted it."""
+        with self.shared.locked(gallery_id, exclusive=False):
+            manifest = self.shared.manifest(gallery_id)
+            if manifest is None:
+                with self._lock:
+                    self._entries.pop(gallery_id, None)
+                return None
+            if version is not None and manifest["version"] != version:
+                return None
+            with self._lock:
+                entry = self._entries.get(gallery_id)
+            if entry is None or entry.content_hash != manifest["contentHash"]:
+                entry = self.shared.read(gallery_id)
+            else:
+                entry.version = manifest["version"]
+            return self._remember(entry)
+
+    def put(self, gallery_id: str, version: str, students: dict[str, np.ndarray]) -> CachedGallery:
+        entry = CachedGallery.from_students(gallery_id, version, students)
+        # Lock order everywhere: the gallery's file lock first, then the in-process lock
+        with self._shared_lock(gallery_id), self._lock:
+            entry = self._put(entry)
+        self._unpublish_evicted()
+        return entry
+
+    def _put(self, entry: CachedGallery) -> CachedGallery:
+        if self.shared is not None:
+            entry = self.shared.publish(entry)
+        return self._remember(entry)
+
+    def _remember(self, entry: CachedGallery) -> CachedGallery:
+        gallery_id, version = entry.gallery_id, entry.version
+        with self._lock:
+            current = self._entries.get(gallery_id)
+            # Same content re-uploaded under a new version: keep the stacked arrays
+            if current is not None and current.content_hash == entry.content_hash:
+                current.version = version
+                entry = current
+            self._entries[gallery_id] = entry
+            self._entries.move_to_end(gallery_id)
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                if self.shared is not None:
+                    self._unpublish.append((evicted.gallery_id, evicted.content_hash))
+        return entry
+
+    def _unpublish_evicted(self):
+        # Taking another gallery's lock while holding one could deadlock two workers
+        with self._lock:
+            evicted, self._unpublish = self._unpublish, []
+        for gallery_id, content_hash in evicted:
+            self.shared.remove(gallery_id, content_hash)
+
+    def apply_delta(self, gallery_id: str, base_version: str, version: str,
+                    upserts: dict[str, np.ndarray], removals: list[str],
+                    additions: dict[str, np.ndarray] | None = None) -> CachedGallery:
+        """
+        Removes students, replaces the embeddings of upserted ones and folds
+        `additions` (embeddings of new photos) into the students' templates
+        without their old embeddings. Untouched templates are shared with the
+        previous version.
+        """
+        with self._shared_lock(gallery_id), self._lock:
+            current = self._entries.get(gallery_id)
+            if self.shared is not None:
+                # Another worker may have moved the gallery on since
+                latest = self.shared.read(gallery_id)
+                current = self._remember(latest) if latest is not None else None
+            if current is None or current.version != base_version:
+                raise StaleGalleryError(f"Gallery '{gallery_id}' is not cached at version '{base_version}'")
+
+            templates = dict(current.templates)
+            for roll_number in removals:
+                templates.pop(roll_number, None)
+            templates.update(templates_from(upserts))
+            for roll_number, vectors in (additions or {}).items():
+                template = templates.get(roll_number)
+                templates[roll_number] = template.add(vectors) if template else Template.from_vectors(vectors)
+            entry = self._put(CachedGallery(gallery_id, version, templates))
+        self._unpublish_evicted()
+        return entry
+
+    def evict(self, gallery_id: str) -> bool:
+        with self._lock:
+            evicted = self._entries.pop(gallery_id, None) is not None
+        if self.shared is not None:
+            evicted = self.shared.remove(gallery_id) or evicted
+        return evicted
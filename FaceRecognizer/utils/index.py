@@ -0,0 +1,281 @@
+"""
+Approximate nearest-neighbour index over every enrolled student, used by
+/identify to search the whole institution instead of one division.
+
+IVF-flat: vectors are partitioned into IVF_NLIST clusters by spherical
+k-means and a query only scores the rows of the IVF_NPROBE clusters whose
+centroids are closest to it, exactly (float32 dot products of normalized
+vectors). Until IVF_TRAIN_SIZE vectors are enrolled, every row is scored.
+
+The index is persisted in an EmbeddingStore (utils/store.py): every
+enrollment and deletion is appended to the store's log as it happens, and a
+snapshot compacts the live rows, IVF centroids and list assignments into a
+new generation. Only the first process to open a store writes it, others get
+a read-only view of it as it was at open. The vectors load with mmap_mode="r", so they stay in the page
+cache instead of the heap; rows enrolled since are kept in memory.
+"""
+
+import threading
+
+import numpy as np
+
+from utils.config import IVF_NLIST, IVF_NPROBE, IVF_TRAIN_SIZE
+from utils.matcher import normalize
+from utils.store import EmbeddingStore
+
+ASSIGN_CHUNK = 65536
+
+
+def spherical_kmeans(vectors: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Returns k unit-length centroids of normalized `vectors`."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        empty = np.bincount(labels, minlength=k) == 0
+        centroids = normalize(sums)
+        # Re-seed clusters that lost all their members
+        centroids[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()), replace=False)]
+    return centroids
+
+
+class IdentityIndex:
+    def __init__(self, dim: int = 512, nlist: int = IVF_NLIST, nprobe: int = IVF_NPROBE,
+                 train_size: int = IVF_TRAIN_SIZE, store: EmbeddingStore | None = None):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_size = train_size or 39 * nlist
+
+        self._base = np.empty((0, dim), dtype=np.float32)  # snapshot rows, possibly memory-mapped
+        self._tail = np.empty((0, dim), dtype=np.float32)  # rows added since, over-allocated
+        self._row_ids: list[str] = []
+        self._alive = np.empty(0, dtype=bool)
+        self._rows_by_id: dict[str, list[int]] = {}
+        self._centroids = None
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._lists: list[list[int]] = []
+        self._list_arrays: dict[int, np.ndarray] = {}
+        self._lock = threading.RLock()
+        self._store = store  # enrollments are logged here as they happen
+        self.dirty = False  # changed since the last snapshot
+
+    def __len__(self):
+        return len(self._rows_by_id)
+
+    @property
+    def size(self) -> int:
+        """Live rows (embeddings) in the index."""
+        with self._lock:
+            return int(self._alive[:len(self._row_ids)].sum())
+
+    @property
+    def trained(self) -> bool:
+        return self._centroids is not None
+
+    def _vectors(self, rows: np.ndarray) -> np.ndarray:
+        """Vectors of sorted row numbers, read across the snapshot and the in-memory tail."""
+        split = np.searchsorted(rows, len(self._base))
+        if split == len(rows):
+            return self._base[rows]
+        if split == 0:
+            return self._tail[rows - len(self._base)]
+        return np.concatenate([self._base[rows[:split]], self._tail[rows[split:] - len(self._base)]])
+
+    def _reserve(self, extra: int):
+        used = len(self._row_ids) - len(self._base)
+        if used + extra > len(self._tail):
+            capacity = max(64, 2 * (used + extra))
+            self._tail = np.concatenate([self._tail[:used], np.empty((capacity - used, self.dim), dtype=np.float32)])
+        total = len(self._row_ids) + extra
+        if total > len(self._alive):
+            capacity = max(64, 2 * total)
+            self._alive = np.concatenate([self._alive, np.zeros(capacity - len(self._alive), dtype=bool)])
+            self._assignments = np.concatenate([
+                self._assignments, np.full(capacity - len(self._assignments), -1, dtype=np.int32)
+            ])
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        return np.concatenate([
+            np.argmax(vectors[i:i + ASSIGN_CHUNK] @ self._centroids.T, axis=1)
+            for i in range(0, len(vectors), ASSIGN_CHUNK)
+        ]).astype(np.int32) if len(vectors) else np.empty(0, dtype=np.int32)
+
+    def _file(self, rows: np.ndarray, assignments: np.ndarray):
+        self._assignments[rows] = assignments
+        for row, cluster in zip(rows.tolist(), assignments.tolist()):
+            self._lists[cluster].append(row)
+            self._list_arrays.pop(cluster, None)
+
+    def _list_array(self, cluster: int) -> np.ndarray:
+        rows = self._list_arrays.get(cluster)
+        if rows is None:
+            rows = self._list_arrays[cluster] = np.asarray(self._lists[cluster], dtype=np.intp)
+        return rows
+
+    def add(self, roll_number: str, vectors: np.ndarray) -> int:
+        """Enrolls (or re-enrolls, replacing the old rows) one student. Returns the rows added."""
+        vectors = normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+        with self._lock:
+            # Logged first, so a read-only store (utils/store.py) leaves the index untouched
+            if self._store is not None:
+                self._store.put(roll_number, vectors)
+            self._remove(roll_number)
+            self._insert(roll_number, vectors)
+            self.dirty = True
+        return len(vectors)
+
+    def _insert(self, roll_number: str, vectors: np.ndarray):
+        self._reserve(len(vectors))
+        start = len(self._row_ids)
+        rows = np.arange(start, start + len(vectors))
+        used = start - len(self._base)
+        self._tail[used:used + len(vectors)] = vectors
+        self._row_ids.extend([roll_number] * len(vectors))
+        self._alive[rows] = True
+        self._rows_by_id.setdefault(roll_number, []).extend(rows.tolist())
+
+        if self.trained:
+            self._file(rows, self._assign(vectors))
+        elif self.size >= self.train_size:
+            self.train()
+
+    def _remove(self, roll_number: str) -> int:
+        rows = self._rows_by_id.pop(roll_number, [])
+        self._alive[rows] = False
+        return len(rows)
+
+    def delete(self, roll_number: str) -> int:
+        with self._lock:
+            if self._store is not None and roll_number in self._rows_by_id:
+                self._store.delete(roll_number)
+            removed = self._remove(roll_number)
+            if removed:
+                self.dirty = True
+        return removed
+
+    def train(self, sample: int = 64):
+        """(Re)clusters the live rows and rebuilds the inverted lists."""
+        with self._lock:
+            live = np.flatnonzero(self._alive[:len(self._row_ids)])
+            if len(live) == 0:
+                return
+            vectors = self._vectors(live)
+            rng = np.random.default_rng(0)
+            training = vectors[np.sort(rng.choice(len(live), size=min(len(live), sample * self.nlist), replace=False))]
+            self._centroids = spherical_kmeans(training, min(self.nlist, len(training)))
+            self._lists = [[] for _ in range(len(self._centroids))]
+            self._list_arrays = {}
+            self._file(live, self._assign(vectors))
+
+    def _candidates(self, probes: np.ndarray | None) -> np.ndarray:
+        if probes is None:
+            return np.flatnonzero(self._alive[:len(self._row_ids)])
+        rows = np.sort(np.concatenate([self._list_array(int(c)) for c in probes]))
+        return rows[self._alive[rows]]
+
+    def _top_students(self, rows: np.ndarray, scores: np.ndarray, k: int) -> list[tuple[str, float]]:
+        """Best score per student, for the k best students."""
+        if k < 1:
+            return []
+        take = min(len(scores), 8 * k)
+        while True:
+            top = np.argpartition(-scores, take - 1)[:take] if take < len(scores) else np.arange(len(scores))
+            found = {}
+            for i in top[np.argsort(-scores[top])]:
+                roll_number = self._row_ids[rows[i]]
+                if roll_number not in found:
+                    found[roll_number] = float(scores[i])
+                    if len(found) == k:
+                        return list(found.items())
+            if take == len(scores):
+                return list(found.items())
+            take = min(len(scores), 4 * take)
+
+    def search(self, queries: np.ndarray, k: int = 5) -> list[list[tuple[str, float]]]:
+        """Top `k` (rollNumber, cosine similarity) per query embedding, best first."""
+        queries = normalize(np.asarray(queries, dtype=np.float32).reshape(-1, self.dim))
+        with self._lock:
+            if not self.trained:
+                rows = self._candidates(None)
+                scores = self._vectors(rows) @ queries.T if len(rows) else np.empty((0, len(queries)), np.float32)
+                return [self._top_students(rows, scores[:, i], k) if len(rows) else [] for i in range(len(queries))]
+
+            nprobe = min(self.nprobe, len(self._centroids))
+            coarse = queries @ self._centroids.T
+            probes = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe]
+            results = []
+            for query, probe in zip(queries, probes):
+                rows = self._candidates(probe)
+                results.append(self._top_students(rows, self._vectors(rows) @ query, k) if len(rows) else [])
+            return results
+
+    def snapshot(self):
+        """
+        Compacts the backing store into a new generation holding only the
+        live rows together with the IVF centroids and list assignments, then
+        re-opens the index on it (memory-mapped).
+        """
+        if self._store is None:
+            raise ValueError("This index has no backing store")
+        with self._lock:
+            live = np.flatnonzero(self._alive[:len(self._row_ids)])
+            extras = {"centroids": self._centroids, "assignments": self._assignments[live]} if self.trained else None
+            self._store.rewrite([self._row_ids[row] for row in live], self._vectors(live), extras)
+            self._load_store()
+
+    @classmethod
+    def open(cls, directory: str, mmap: bool = True, **kwargs) -> "IdentityIndex":
+        """Opens (or creates) the index persisted in the embedding store at `directory`."""
+        store = EmbeddingStore(directory, mmap=mmap)
+        index = cls(dim=store.dim, store=store, **kwargs)
+        with index._lock:
+            index._load_store()
+        return index
+
+    def _load_store(self):
+        store = self._store
+        self._base = store.base_vectors
+        self._tail = np.empty((0, self.dim), dtype=np.float32)
+        self._row_ids = list(store.base_ids)
+        self._alive = store.base_alive.copy()
+        self._assignments = np.full(len(self._row_ids), -1, dtype=np.int32)
+        self._rows_by_id = {}
+        for row in np.flatnonzero(self._alive).tolist():
+            self._rows_by_id.setdefault(self._row_ids[row], []).append(row)
+
+        self._centroids = store.extra("centroids")
+        self._list_arrays = {}
+        if self.trained:
+            self._lists = [[] for _ in range(len(self._centroids))]
+            self._file(np.arange(len(self._row_ids)), store.extra("assignments"))
+
+        # Enrollments logged since the generation was written
+        for roll_number, vectors in store.tail.items():
+            self._insert(roll_number, vectors)
+        if not self.trained and self.size >= self.train_size:
+            self.train()
+        self.dirty = store.log_records > 0
+
+    def describe(self) -> dict:
+        with self._lock:
+            return {
+                "students": len(self),
+                "embeddings": self.size,
+                "trained": self.trained,
+                "nlist": len(self._centroids) if self.trained else 0,
+                "nprobe": self.nprobe,
+                "tombstones": len(self._row_ids) - self.size,
+                "store": self._store.describe() if self._store is not None else None,
+            }
+
+    @property
+    def writable(self) -> bool:
+        """False when another process holds the backing store for writing."""
+        return self._store is None or self._store.writable
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
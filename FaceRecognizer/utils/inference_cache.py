@@ -0,0 +1,159 @@
+"""
+Cache of detection and embedding results keyed by the SHA-256 of the image
+bytes plus the model configuration, so re-submitted photos (a retried
+lecture, re-sent enrollment photos) skip inference.
+
+An entry holds the boxes, detection scores, keypoints and embeddings of one
+image as numpy arrays, plus the faces the quality gate rejected. Gated and
+ungated results of the same bytes are cached under different keys. The memory tier is an LRU bounded by
+INFERENCE_CACHE_MB; the optional disk tier (INFERENCE_CACHE_DIR) keeps one
+.npz per image and evicts the least recently used files beyond
+INFERENCE_CACHE_DISK_MB.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from utils.config import (
+    DECODE_MODE, DET_SIZE, INFERENCE_CACHE_DIR, INFERENCE_CACHE_DISK_MB, INFERENCE_CACHE_MB,
+    MODEL_MODULES, MODEL_PACK, MODEL_PRECISION, QUALITY_MAX_YAW, QUALITY_MIN_DET_SCORE, QUALITY_MIN_FACE_PX,
+    QUALITY_MIN_SHARPNESS, REC_MIN_FACE_PX
+)
+from utils.metrics import CACHE_LOOKUPS
+
+FIELDS = ("bboxes", "det_scores", "kps", "embeddings", "rejected_bboxes", "rejected_det_scores", "rejected_reasons")
+
+# Anything that changes what detection or recognition returns for the same bytes
+MODEL_FINGERPRINT = "|".join(str(v) for v in (
+    MODEL_PACK, MODEL_PRECISION, ",".join(MODEL_MODULES), DET_SIZE, DECODE_MODE, REC_MIN_FACE_PX
+)).encode()
+# Added for results of the quality gate, which depend on its thresholds too
+QUALITY_FINGERPRINT = "|".join(str(v) for v in (
+    "gate", QUALITY_MIN_FACE_PX, QUALITY_MIN_DET_SCORE, QUALITY_MAX_YAW, QUALITY_MIN_SHARPNESS
+)).encode()
+
+
+def entry_size(entry: dict) -> int:
+    return sum(entry[field].nbytes for field in FIELDS)
+
+
+class InferenceCache:
+    def __init__(self, memory_mb: float = INFERENCE_CACHE_MB, directory: str = INFERENCE_CACHE_DIR,
+                 disk_mb: float = INFERENCE_CACHE_DISK_MB):
+        self.memory_limit = int(memory_mb * 2 ** 20)
+        self.disk_limit = int(disk_mb * 2 ** 20)
+        self.directory = Path(directory) if directory else None
+        self._memory: OrderedDict[str, dict] = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: OrderedDict[str, int] | None = None  # key -> file size, least recently used first
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory_limit > 0 or self.directory is not None
+
+    def key(self, contents: bytes, quality_gate: bool = False) -> str:
+        digest = hashlib.sha256(MODEL_FINGERPRINT)
+        if quality_gate:
+            digest.update(QUALITY_FINGERPRINT)
+        digest.update(contents)
+        return digest.hexdigest()
+
+    def lookup(self, contents: bytes, quality_gate: bool = False) -> tuple[str, dict | None]:
+        key = self.key(contents, quality_gate)
+        entry = self.get(key)
+        # Callers annotate the result dict, so hand out a copy
+        return key, dict(entry) if entry is not None else None
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.npz"
+
+    def _scan_disk(self):
+        """Indexes the files left by earlier runs, oldest first (caller holds the lock)."""
+        if self._disk is not None:
+            return
+        files = sorted(self.directory.glob("*/*.npz"), key=lambda p: p.stat().st_mtime)
+        self._disk = OrderedDict((path.stem, path.stat().st_size) for path in files)
+        self._disk_bytes = sum(self._disk.values())
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                CACHE_LOOKUPS.inc(tier="memory", result="hit")
+                return entry
+            if self.memory_limit > 0:
+                CACHE_LOOKUPS.inc(tier="memory", result="miss")
+            if self.directory is None:
+                return None
+            self._scan_disk()
+            if key not in self._disk:
+                CACHE_LOOKUPS.inc(tier="disk", result="miss")
+                return None
+            self._disk.move_to_end(key)
+
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                entry = {field: data[field] for field in FIELDS}
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self._disk_bytes -= self._disk.pop(key, 0)
+            CACHE_LOOKUPS.inc(tier="disk", result="miss")
+            return None
+
+        CACHE_LOOKUPS.inc(tier="disk", result="hit")
+        self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, detection: dict):
+        entry = {field: np.ascontiguousarray(detection[field]) for field in FIELDS}
+        self._remember(key, entry)
+        if self.directory is None:
+            return
+
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(temporary, "wb") as f:
+            np.savez(f, **entry)
+        os.replace(temporary, path)
+
+        with self._lock:
+            self._scan_disk()
+            self._disk_bytes += path.stat().st_size - self._disk.pop(key, 0)
+            self._disk[key] = path.stat().st_size
+            while self._disk_bytes > self.disk_limit and len(self._disk) > 1:
+                old, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                self._path(old).unlink(missing_ok=True)
+
+    def _remember(self, key: str, entry: dict):
+        size = entry_size(entry)
+        if size > self.memory_limit:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= entry_size(self._memory.pop(key))
+            self._memory[key] = entry
+            self._memory_bytes += size
+            while self._memory_bytes > self.memory_limit:
+                _, old = self._memory.popitem(last=False)
+                self._memory_bytes -= entry_size(old)
+
+    def describe(self) -> dict:
+        with self._lock:
+            return {
+                "memoryEntries": len(self._memory),
+                "memoryBytes": self._memory_bytes,
+                "diskEntries": len(self._disk) if self._disk is not None else None,
+                "diskBytes": self._disk_bytes if self._disk is not None else None,
+            }
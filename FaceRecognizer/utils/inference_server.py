@@ -0,0 +1,89 @@
+"""
+One inference process for several uvicorn workers (INFERENCE_BACKEND=shared).
+
+The process loads the FaceAnalysis once and serves the pipeline steps of
+utils/pipeline.py to every worker over a Unix socket (a multiprocessing
+manager at INFERENCE_SOCKET). Each worker connection is served on its own
+thread; at most INFERENCE_WORKERS steps run at once, on the one set of ONNX
+sessions, so the models are in memory once per node instead of once per
+worker. Steps and their arguments travel pickled, exactly as with the
+process backend. Any client holding INFERENCE_AUTHKEY can make the process run
+code, so the key is required; serve.py generates a random one per start.
+
+Loading the models in a parent and forking the workers would not work:
+ONNX Runtime's thread pools do not survive fork. serve.py starts this
+process next to the workers.
+"""
+
+import os
+import threading
+import time
+from multiprocessing.managers import BaseManager
+
+from utils.config import INFERENCE_AUTHKEY, INFERENCE_SOCKET, INFERENCE_WORKERS
+from utils.pipeline import init_worker
+
+
+class _ServerManager(BaseManager):
+    pass
+
+
+class _ClientManager(BaseManager):
+    pass
+
+
+_ClientManager.register("runner")
+
+
+def _authkey() -> bytes:
+    if not INFERENCE_AUTHKEY:
+        raise RuntimeError("INFERENCE_AUTHKEY must be set for the shared inference process (serve.py sets one)")
+    return INFERENCE_AUTHKEY.encode()
+
+
+class Runner:
+    def __init__(self, workers: int = INFERENCE_WORKERS):
+        self._slots = threading.BoundedSemaphore(max(workers, 1))
+
+    def run(self, fn, args: tuple):
+        with self._slots:
+            return fn(*args)
+
+
+def serve(address: str = INFERENCE_SOCKET, workers: int = INFERENCE_WORKERS):
+    """Loads the models and serves steps until the process is stopped."""
+    init_worker()
+    runner = Runner(workers)
+    _ServerManager.register("runner", callable=lambda: runner)
+    if os.path.exists(address):
+        os.remove(address)
+    manager = _ServerManager(address=address, authkey=_authkey())
+    manager.get_server().serve_forever()
+
+
+def connect(address: str = INFERENCE_SOCKET):
+    """
+    Proxy whose run(fn, args) executes in the inference process. Every
+    thread calling it gets its own connection.
+    """
+    manager = _ClientManager(address=address, authkey=_authkey())
+    manager.connect()
+    return manager.runner()
+
+
+def wait_until_ready(address: str = INFERENCE_SOCKET, timeout: float = 300.0, alive=lambda: True):
+    """Waits for the inference process to accept connections (model loading takes a while)."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return connect(address)
+        except (FileNotFoundError, ConnectionRefusedError):
+            if not alive():
+                raise RuntimeError("The inference process exited before it was ready")
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"No inference process on {address} after {timeout:.0f}s")
+            time.sleep(0.5)
+
+
+if __name__ == "__main__":
+    serve()
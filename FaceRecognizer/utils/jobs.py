@@ -0,0 +1,121 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+
+from utils.config import JOB_TTL_SECONDS, MAX_JOBS
+
+
+class JobStoreFullError(Exception):
+    pass
+
+
+class Job:
+    """
+    A lecture processed in the background. Every state change is appended to
+    `events`, which the SSE stream replays from any position.
+    """
+
+    def __init__(self, total: int):
+        self.id = uuid.uuid4().hex
+        self.status = "queued"
+        self.total = total
+        self.results = []
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.events = []
+        self.task = None
+        self._changed = asyncio.Condition()
+
+    async def _publish(self, event: str, data: dict):
+        async with self._changed:
+            self.events.append((event, data))
+            self._changed.notify_all()
+
+    async def start(self):
+        self.status = "running"
+        await self._publish("status", self.describe(with_results=False))
+
+    async def add_result(self, result: dict):
+        self.results.append(result)
+        await self._publish("result", result)
+
+    async def finish(self):
+        self.status = "completed"
+        self.finished_at = time.time()
+        await self._publish("done", self.describe())
+
+    async def fail(self, error: str):
+        self.status = "failed"
+        self.error = error
+        self.finished_at = time.time()
+        await self._publish("error", self.describe(with_results=False))
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    async def stream(self, start: int = 0):
+        """Yields (index, event, data) from `start` on until the job has finished."""
+        index = start
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: len(self.events) > index)
+                pending = self.events[index:]
+            for event, data in pending:
+                yield index, event, data
+                index += 1
+                if event in ("done", "error"):
+                    return
+
+    def describe(self, with_results: bool = True) -> dict:
+        job = {
+            "jobId": self.id,
+            "status": self.status,
+            "total": self.total,
+            "processed": len(self.results),
+            "error": self.error,
+        }
+        if with_results:
+            job["results"] = self.results
+        return job
+
+
+class JobStore:
+    """
+    In-memory jobs of this process. Finished jobs are dropped after
+    JOB_TTL_SECONDS, and the oldest finished ones once more than MAX_JOBS
+    exist. Queued and running jobs are never dropped: with MAX_JOBS of them
+    in flight, create() refuses new ones.
+    """
+
+    def __init__(self, ttl: float = JOB_TTL_SECONDS, max_jobs: int = MAX_JOBS):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+
+    def create(self, total: int) -> Job:
+        self._prune(room=1)
+        if len(self._jobs) >= self.max_jobs:
+            raise JobStoreFullError(f"{len(self._jobs)} jobs are still running")
+        job = Job(total)
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        self._prune()
+        return self._jobs.get(job_id)
+
+    def _prune(self, room: int = 0):
+        now = time.time()
+        finished = []
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and now - job.finished_at > self.ttl:
+                del self._jobs[job_id]
+            elif job.finished:
+                finished.append(job_id)
+        # Oldest finished first; running jobs stay, their clients are still waiting
+        excess = len(self._jobs) + room - self.max_jobs
+        for job_id in finished[:max(excess, 0)]:
+            del self._jobs[job_id]
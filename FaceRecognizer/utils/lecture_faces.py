@@ -0,0 +1,58 @@
+"""
+Per-lecture record of every detected face, stored next to the annotated
+images as lectures/{subjectId}/{lectureId}/faces.npz so attendance can be
+re-matched against a changed gallery (/rematch) without running inference.
+
+The .npz holds, for F faces over the lecture's photos:
+    files       (images,) photo file names
+    offsets     (images + 1,) faces of photo i are rows offsets[i]:offsets[i + 1]
+    bboxes      (F x 4) float32 boxes in original image pixels
+    det_scores  (F,) float32
+    embeddings  (F x 512) float16, L2-normalised
+    labels      (F,) matched roll number or "Unknown" per face, used to render
+                annotated images lazily (optional, older files have none)
+"""
+
+import io
+
+import numpy as np
+
+FILENAME = "faces.npz"
+
+
+def lecture_path(subjectId: str, lectureId: str) -> str:
+    return f"lectures/{subjectId}/{lectureId}"
+
+
+def encode_lecture_faces(file_names: list[str], detections: list[dict], labels: list[list[str]] | None = None) -> bytes:
+    counts = [len(d["bboxes"]) for d in detections]
+    extra = {"labels": np.array([label for photo in labels for label in photo], dtype=str)} if labels else {}
+    buf = io.BytesIO()
+    np.savez(
+        buf,
+        files=np.array(file_names, dtype=str),
+        offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        bboxes=np.concatenate([d["bboxes"] for d in detections]).astype(np.float32).reshape(-1, 4),
+        det_scores=np.concatenate([d["det_scores"] for d in detections]).astype(np.float32),
+        embeddings=np.concatenate([d["embeddings"] for d in detections]).astype(np.float16).reshape(-1, 512),
+        **extra,
+    )
+    return buf.getvalue()
+
+
+def decode_lecture_faces(blob: bytes) -> list[dict]:
+    """One dict per photo: fileName, bboxes, det_scores, float32 embeddings and labels (or None)."""
+    with np.load(io.BytesIO(blob), allow_pickle=False) as data:
+        offsets = data["offsets"]
+        embeddings = data["embeddings"].astype(np.float32)
+        labels = data["labels"].tolist() if "labels" in data.files else None
+        return [
+            {
+                "fileName": str(name),
+                "bboxes": data["bboxes"][start:end],
+                "det_scores": data["det_scores"][start:end],
+                "embeddings": embeddings[start:end],
+                "labels": labels[start:end] if labels is not None else None,
+            }
+            for name, start, end in zip(data["files"], offsets[:-1], offsets[1:])
+        ]
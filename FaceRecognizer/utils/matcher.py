@@ -0,0 +1,136 @@
+import numpy as np
+
+# Embeddings are L2-normalised, so the old euclidean cut-off of 0.8 maps onto
+# cosine similarity as 1 - d^2 / 2.
+MATCH_DISTANCE = 0.8
+MATCH_SIMILARITY = 1.0 - (MATCH_DISTANCE ** 2) / 2.0
+
+UNKNOWN = "Unknown"
+
+
+class Gallery:
+    """
+    Student embeddings stacked into one contiguous float32 (N x 512) matrix.
+
+    Rows belonging to the same student are stored next to each other (rows
+    given interleaved are regrouped, students in order of first appearance),
+    so `offsets[i]` is the first row of `roll_numbers[i]`.
+    """
+
+    def __init__(self, matrix: np.ndarray, row_ids: list[str]):
+        # score_faces takes one maximum per run of rows, so a student's rows must be one run
+        row_ids = list(row_ids)
+        _, first_rows, student_of_row = np.unique(
+            np.asarray(row_ids, dtype=str), return_index=True, return_inverse=True
+        )
+        appearance = np.argsort(first_rows)
+        rank = np.empty_like(appearance)
+        rank[appearance] = np.arange(len(appearance))
+        student_of_row = rank[student_of_row.reshape(-1)]
+
+        order = np.argsort(student_of_row, kind="stable")
+        if np.any(order != np.arange(len(order))):
+            matrix = np.asarray(matrix)[order]
+            row_ids = [row_ids[row] for row in order]
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.row_ids = row_ids
+
+        rows_per_student = np.bincount(student_of_row, minlength=len(appearance))
+        self.offsets = (np.cumsum(rows_per_student) - rows_per_student).astype(np.intp)
+        self.roll_numbers = [row_ids[row] for row in self.offsets]
+
+    def __len__(self):
+        return len(self.roll_numbers)
+
+    @property
+    def size(self) -> int:
+        return self.matrix.shape[0]
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def build_gallery(student_embeddings: list[dict]) -> Gallery:
+    """
+    Builds a Gallery from the Backend's `studentEmbeddings` payload:
+    [{"rollNumber": ..., "embeddings": [{"image": ..., "embedding": [...]}]}]
+    """
+    row_ids = []
+    vectors = []
+    for student in student_embeddings:
+        rollNumber = student['rollNumber']
+        for item in student.get('embeddings') or []:
+            row_ids.append(rollNumber)
+            vectors.append(item['embedding'])
+
+    if not vectors:
+        return Gallery(np.empty((0, 512), dtype=np.float32), [])
+
+    return Gallery(normalize(np.asarray(vectors, dtype=np.float32)), row_ids)
+
+
+def score_faces(encodings: np.ndarray, gallery: Gallery) -> np.ndarray:
+    """
+    Returns a (faces x students) matrix holding, for each student, the best
+    cosine similarity over all of that student's enrollment embeddings.
+    """
+    encodings = normalize(np.atleast_2d(encodings))
+    sims = encodings @ gallery.matrix.T
+    return np.maximum.reduceat(sims, gallery.offsets, axis=1)
+
+
+def assign(scores: np.ndarray, threshold: float = MATCH_SIMILARITY) -> np.ndarray:
+    """
+    One-to-one assignment of faces to students. Pairs are accepted greedily in
+    order of decreasing similarity, so a student is claimed by at most one face
+    and every face gets at most one student. Returns the student column per
+    face, or -1 when nothing above `threshold` is left for it.
+    """
+    n_faces, n_students = scores.shape
+    assignment = np.full(n_faces, -1, dtype=np.intp)
+
+    faces, students = np.nonzero(scores >= threshold)
+    if faces.size == 0:
+        return assignment
+
+    order = np.argsort(-scores[faces, students], kind="stable")
+    face_taken = np.zeros(n_faces, dtype=bool)
+    student_taken = np.zeros(n_students, dtype=bool)
+    for face, student in zip(faces[order], students[order]):
+        if face_taken[face] or student_taken[student]:
+            continue
+        assignment[face] = student
+        face_taken[face] = True
+        student_taken[student] = True
+
+    return assignment
+
+
+def match_faces(encodings: np.ndarray, gallery: Gallery, threshold: float = MATCH_SIMILARITY) -> tuple[list[str], list[float]]:
+    """
+    Matches every face of one image against the gallery with a single matrix
+    multiply. Returns the label per face (roll number or "Unknown") and its
+    similarity score (best gallery similarity for unknown faces).
+    """
+    if len(encodings) == 0:
+        return [], []
+    if len(gallery) == 0:
+        return [UNKNOWN] * len(encodings), [0.0] * len(encodings)
+
+    scores = score_faces(encodings, gallery)
+    assignment = assign(scores, threshold)
+
+    labels = []
+    similarities = []
+    for face, student in enumerate(assignment):
+        if student < 0:
+            labels.append(UNKNOWN)
+            similarities.append(float(scores[face].max()))
+        else:
+            labels.append(gallery.roll_numbers[student])
+            similarities.append(float(scores[face, student]))
+
+    return labels, similarities
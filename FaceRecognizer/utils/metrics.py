@@ -0,0 +1,147 @@
+"""
+Prometheus-style metrics for the recognizer, rendered in the text exposition
+format on /metrics, plus per-request stage timings for the Server-Timing
+response header.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets=LATENCY_BUCKETS, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.label_names = label_names
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock:
+            series = self._series.setdefault(key, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                labels = dict(zip(self.label_names, key))
+                for bound, bucket_count in zip(self.buckets, series["buckets"]):
+                    lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': bound})} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {series['count']}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(dict(zip(self.label_names, key)))} {value}")
+        return lines
+
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+STAGE_SECONDS = Histogram(
+    "recognizer_stage_seconds",
+    "Time spent per pipeline stage (multipart_read, cache, decode, detection, quality, alignment, tracking, embedding, matching, annotation, jpeg_encode, s3_upload, s3_download).",
+    label_names=("stage",)
+)
+FACES_PER_IMAGE = Histogram(
+    "recognizer_faces_per_image",
+    "Faces detected per processed image.",
+    buckets=(0, 1, 2, 5, 10, 20, 40, 60, 80, 100, 150, 200)
+)
+GALLERY_EMBEDDINGS = Histogram(
+    "recognizer_gallery_embeddings",
+    "Gallery embeddings matched against per request.",
+    buckets=(0, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+)
+CACHE_LOOKUPS = Counter(
+    "recognizer_inference_cache_lookups_total",
+    "Inference cache lookups per tier (memory, disk) and result (hit, miss).",
+    label_names=("tier", "result")
+)
+
+FACES_REJECTED = Counter(
+    "recognizer_faces_rejected_total",
+    "Detected faces the quality gate kept away from recognition, per reason (too_small, low_score, pose, blurry).",
+    label_names=("reason",)
+)
+
+# Stage -> seconds for the request being handled, for the Server-Timing header
+_request_timings: ContextVar[dict | None] = ContextVar("request_timings", default=None)
+
+
+def start_request_timings() -> dict:
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def record_request_stage(stage: str, seconds: float):
+    """Adds to the current request's Server-Timing only, not to the histograms."""
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def record_stage(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    record_request_stage(stage, seconds)
+
+
+def record_stages(timings: dict):
+    """Records the timings a pipeline step measured inside the worker pool."""
+    for stage, seconds in timings.items():
+        record_stage(stage, seconds)
+
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def server_timing_header(timings: dict) -> str:
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
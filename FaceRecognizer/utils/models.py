@@ -0,0 +1,58 @@
+import insightface
+import onnxruntime
+
+from utils.config import (
+    DET_SIZE, INFERENCE_DEVICE, MODEL_MODULES, MODEL_PACK, MODEL_PRECISION,
+    ORT_GRAPH_OPTIMIZATION, ORT_INTER_OP_THREADS, ORT_INTRA_OP_THREADS
+)
+
+PROVIDERS = ['CUDAExecutionProvider', 'CPUExecutionProvider']
+CPU_PROVIDERS = ['CPUExecutionProvider']
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+
+def quantized_pack(pack: str) -> str:
+    return f"{pack}_int8"
+
+
+def cpu_session_options() -> onnxruntime.SessionOptions:
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = ORT_INTRA_OP_THREADS
+    options.inter_op_num_threads = ORT_INTER_OP_THREADS
+    options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[ORT_GRAPH_OPTIMIZATION]
+    return options
+
+
+def tune_cpu_sessions(face_analyzer):
+    """
+    InsightFace creates its sessions with default options, so recreate them
+    from the same model files with the configured threads and graph
+    optimization level. Input/output names are unchanged.
+    """
+    options = cpu_session_options()
+    for model in face_analyzer.models.values():
+        model.session = onnxruntime.InferenceSession(model.model_file, sess_options=options, providers=CPU_PROVIDERS)
+
+
+def load_face_analyzer(pack: str = MODEL_PACK, modules: list[str] | None = MODEL_MODULES, det_size: int = DET_SIZE,
+                       precision: str = MODEL_PRECISION, device: str = INFERENCE_DEVICE):
+    """
+    Loads only the ONNX sessions in `modules` (all of the pack when None);
+    the gender/age and landmark models are never read by this service.
+    """
+    cpu = device == "cpu" or precision == "int8"
+    name = quantized_pack(pack) if precision == "int8" else pack
+
+    face_analyzer = insightface.app.FaceAnalysis(
+        name=name, allowed_modules=modules, providers=CPU_PROVIDERS if cpu else PROVIDERS
+    )
+    face_analyzer.prepare(ctx_id=-1 if cpu else 0, det_size=(det_size, det_size))
+    if cpu:
+        tune_cpu_sessions(face_analyzer)
+    return face_analyzer
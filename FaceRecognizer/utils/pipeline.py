@@ -0,0 +1,310 @@
+"""
+CPU-bound steps of the recognition pipeline. These run inside the inference
+pool (utils/workers.py), so they only take and return picklable values and
+look up the process-local FaceAnalysis through get_face_analyzer().
+"""
+
+import io
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from insightface.utils import face_align
+from PIL import Image, ImageDraw, ImageFont
+
+from utils.config import (
+    ANNOTATION_JPEG_QUALITY, ANNOTATION_MAX_SIDE, DECODE_MODE, DET_SIZE, EMBED_MAX_BATCH, REC_MIN_FACE_PX
+)
+from utils.matcher import UNKNOWN, normalize
+from utils.models import load_face_analyzer
+from utils.quality import blur_reasons, face_sharpness, face_sizes, geometry_reasons, image_sharpness
+
+_face_analyzer = None
+
+
+def get_face_analyzer():
+    global _face_analyzer
+    if _face_analyzer is None:
+        _face_analyzer = load_face_analyzer()
+    return _face_analyzer
+
+
+@contextmanager
+def use_face_analyzer(face_analyzer):
+    """Temporarily runs the pipeline with another FaceAnalysis (offline tools only)."""
+    global _face_analyzer
+    previous, _face_analyzer = _face_analyzer, face_analyzer
+    try:
+        yield face_analyzer
+    finally:
+        _face_analyzer = previous
+
+
+def init_worker():
+    """Process pool initializer: each worker process owns its own FaceAnalysis."""
+    get_face_analyzer()
+
+
+def decode_image(contents: bytes) -> np.ndarray:
+    return np.array(Image.open(io.BytesIO(contents)).convert("RGB"))
+
+
+def decode_scaled(contents: bytes, reduction: int = 1) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Decodes a JPEG straight to roughly 1/`reduction` of its size using DCT
+    scaling (PIL draft mode), so the full-resolution bitmap is never built.
+    Other formats are decoded in full. Returns the image and the (x, y)
+    factors mapping its pixels back to the original image.
+    """
+    pil_img = Image.open(io.BytesIO(contents))
+    full_size = pil_img.size
+    if reduction > 1:
+        pil_img.draft("RGB", (full_size[0] // reduction, full_size[1] // reduction))
+
+    image = np.array(pil_img.convert("RGB"))
+    scale = np.array([full_size[0] / image.shape[1], full_size[1] / image.shape[0]], dtype=np.float32)
+    return image, scale
+
+
+def detection_reduction(size: tuple[int, int], det_size: int = DET_SIZE) -> int:
+    """Largest JPEG reduction (1, 2, 4 or 8) that still leaves the detector `det_size` pixels on both sides."""
+    reduction = 1
+    while reduction < 8 and min(size) // (reduction * 2) >= det_size:
+        reduction *= 2
+    return reduction
+
+
+def recognition_reduction(bboxes: np.ndarray, min_face_px: int = REC_MIN_FACE_PX) -> int:
+    """Largest JPEG reduction that keeps the smallest detected face at least `min_face_px` wide."""
+    if len(bboxes) == 0:
+        return 1
+    smallest = np.min(np.minimum(bboxes[:, 2] - bboxes[:, 0], bboxes[:, 3] - bboxes[:, 1]))
+    reduction = 1
+    while reduction < 8 and smallest / (reduction * 2) >= min_face_px:
+        reduction *= 2
+    return reduction
+
+
+def detect_and_align(contents: bytes, keep_image: bool = False, decode_mode: str = DECODE_MODE,
+                     quality_gate: bool = False) -> dict:
+    """
+    Decodes one upload, detects its faces and returns their aligned 112x112
+    recognition crops. Recognition itself runs later in embed_crops, batched
+    over many images. The decoded image is only handed back when `keep_image`
+    is set (thread pool), since pickling it out of a worker process costs more
+    than decoding it again.
+
+    In "draft" mode the detector sees a DCT-scaled decode close to DET_SIZE.
+    Boxes and keypoints are mapped back to the original image, which is then
+    decoded again at the smallest scale that keeps every face at least
+    REC_MIN_FACE_PX wide (full resolution when faces are small) for the crops.
+
+    With `quality_gate`, faces failing the checks in utils/quality.py are
+    moved out of bboxes/det_scores/kps into rejected_bboxes,
+    rejected_det_scores and rejected_reasons before the recognition decode,
+    so they no longer force a full-resolution one. Sharpness is measured at
+    the scale /detect measures it at.
+    """
+    face_analyzer = get_face_analyzer()
+    rec_model = face_analyzer.models['recognition']
+    timings = {}
+
+    started = time.perf_counter()
+    if decode_mode == "draft":
+        det_image, det_scale = decode_scaled(contents, detection_reduction(Image.open(io.BytesIO(contents)).size))
+    else:
+        det_image, det_scale = decode_scaled(contents)
+    timings["decode"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    bboxes, kpss = face_analyzer.det_model.detect(det_image, max_num=0, metric='default')
+    bboxes = bboxes.astype(np.float32).reshape(-1, 5)
+    kpss = kpss.astype(np.float32).reshape(-1, 5, 2) if kpss is not None else np.empty((0, 5, 2), dtype=np.float32)
+    bboxes[:, :4] *= np.tile(det_scale, 2)
+    kpss *= det_scale
+    timings["detection"] = time.perf_counter() - started
+
+    rejected = []
+
+    def reject(reasons: np.ndarray):
+        nonlocal bboxes, kpss
+        failed = reasons != ""
+        rejected.append((bboxes[failed], reasons[failed]))
+        bboxes, kpss = bboxes[~failed], kpss[~failed]
+
+    if quality_gate:
+        started = time.perf_counter()
+        reject(geometry_reasons(bboxes[:, :4], bboxes[:, 4], kpss))
+        if len(bboxes) > 0:
+            # Sharpness depends on the scale it is measured at: use /detect's, so that
+            # QUALITY_MIN_SHARPNESS means what /detect reports
+            sharpness_image, sharpness_scale = det_image, det_scale
+            reduction = detection_reduction((det_image.shape[1], det_image.shape[0])) if decode_mode != "draft" else 1
+            if reduction > 1:
+                sharpness_image = np.array(Image.fromarray(det_image).reduce(reduction))
+                sharpness_scale = det_scale * np.array(
+                    [det_image.shape[1] / sharpness_image.shape[1], det_image.shape[0] / sharpness_image.shape[0]],
+                    dtype=np.float32,
+                )
+            reject(blur_reasons(sharpness_image, bboxes[:, :4] / np.tile(sharpness_scale, 2)))
+            del sharpness_image
+        timings["quality"] = time.perf_counter() - started
+
+    if decode_mode == "draft" and len(bboxes) > 0:
+        del det_image
+        started = time.perf_counter()
+        rec_image, rec_scale = decode_scaled(contents, recognition_reduction(bboxes))
+        timings["decode"] += time.perf_counter() - started
+    else:
+        rec_image, rec_scale = det_image, det_scale
+
+    started = time.perf_counter()
+    crops = [
+        face_align.norm_crop(rec_image, landmark=kps / rec_scale, image_size=rec_model.input_size[0])
+        for kps in kpss
+    ]
+    timings["alignment"] = time.perf_counter() - started
+
+    result = {
+        "bboxes": bboxes[:, :4],
+        "det_scores": bboxes[:, 4],
+        "kps": kpss,
+        "crops": np.stack(crops) if crops else np.empty((0, 112, 112, 3), dtype=np.uint8),
+        "rejected_bboxes": np.concatenate([b[:, :4] for b, _ in rejected] + [np.empty((0, 4), dtype=np.float32)]),
+        "rejected_det_scores": np.concatenate([b[:, 4] for b, _ in rejected] + [np.empty(0, dtype=np.float32)]),
+        "rejected_reasons": np.concatenate([r for _, r in rejected] + [np.empty(0, dtype=str)]),
+        "det_scale": float(det_scale[0]),
+        "rec_scale": float(rec_scale[0]),
+        "timings": timings,
+    }
+    # Only a full-resolution decode is any use for the annotated image
+    if keep_image and np.allclose(rec_scale, 1.0):
+        result["image"] = rec_image
+    return result
+
+
+def detect_faces(contents: bytes, det_size: int = DET_SIZE) -> dict:
+    """
+    Detection only (/detect): decodes the upload close to `det_size`, runs
+    the detector at that input size and returns boxes in original image
+    pixels with their scores, face sizes and sharpness. No crops, no
+    recognition.
+    """
+    face_analyzer = get_face_analyzer()
+    timings = {}
+
+    started = time.perf_counter()
+    size = Image.open(io.BytesIO(contents)).size
+    image, scale = decode_scaled(contents, detection_reduction(size, det_size))
+    timings["decode"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    bboxes, _ = face_analyzer.det_model.detect(image, input_size=(det_size, det_size), max_num=0, metric='default')
+    bboxes = bboxes.astype(np.float32).reshape(-1, 5)
+    timings["detection"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    sharpness = face_sharpness(image, bboxes[:, :4])
+    boxes = bboxes[:, :4] * np.tile(scale, 2)
+    timings["quality"] = time.perf_counter() - started
+
+    return {
+        "width": size[0],
+        "height": size[1],
+        "bboxes": boxes,
+        "det_scores": bboxes[:, 4],
+        "sizes": face_sizes(boxes),
+        "sharpness": sharpness,
+        "image_sharpness": image_sharpness(image),
+        "timings": timings,
+    }
+
+
+def embed_crops(crops: np.ndarray, max_batch: int = EMBED_MAX_BATCH) -> np.ndarray:
+    """
+    Runs the ArcFace model over aligned crops, `max_batch` crops per ONNX
+    call, and returns L2-normalised (N x 512) embeddings.
+    """
+    if len(crops) == 0:
+        return np.empty((0, 512), dtype=np.float32)
+
+    rec_model = get_face_analyzer().models['recognition']
+    features = [
+        rec_model.get_feat(list(crops[i:i + max_batch]))
+        for i in range(0, len(crops), max_batch)
+    ]
+    return normalize(np.concatenate(features))
+
+
+def enroll_photo(contents: bytes, strict: bool = True) -> dict:
+    """
+    Embeds the student in one enrollment photo. Photos without a face are
+    reported as "no_face"; with several faces the photo is reported as
+    "multiple_faces" when `strict`, otherwise the highest scoring face is used.
+    """
+    detection = detect_and_align(contents)
+    faces = len(detection["crops"])
+    result = {"status": "enrolled", "faces": faces, "embedding": None, "timings": detection["timings"]}
+    if faces == 0:
+        result["status"] = "no_face"
+    elif faces > 1 and strict:
+        result["status"] = "multiple_faces"
+    else:
+        started = time.perf_counter()
+        result["embedding"] = embed_crops(detection["crops"][:1])[0]
+        result["timings"]["embedding"] = time.perf_counter() - started
+    return result
+
+
+def render_annotated(image, bboxes: np.ndarray, labels: list[str], max_side: int = ANNOTATION_MAX_SIDE,
+                     quality: int = ANNOTATION_JPEG_QUALITY) -> tuple[bytes, dict]:
+    """
+    Draws the matched labels onto the image and returns it as JPEG bytes,
+    with the time spent per stage. `image` is either the decoded array or
+    the original upload bytes. With `max_side` the output is shrunk to that
+    many pixels on its long side; JPEGs are then decoded with DCT scaling
+    instead of at full resolution.
+    """
+    timings = {}
+    started = time.perf_counter()
+    if isinstance(image, bytes):
+        pil_img = Image.open(io.BytesIO(image))
+        full_size = pil_img.size
+        if max_side and max(full_size) > max_side:
+            ratio = max_side / max(full_size)
+            pil_img.draft("RGB", (int(full_size[0] * ratio), int(full_size[1] * ratio)))
+        pil_img = pil_img.convert("RGB")
+        timings["decode"] = time.perf_counter() - started
+        started = time.perf_counter()
+    else:
+        pil_img = Image.fromarray(image)
+        full_size = pil_img.size
+
+    if max_side and max(pil_img.size) > max_side:
+        pil_img.thumbnail((max_side, max_side))
+    scale = pil_img.size[0] / full_size[0]
+
+    font = ImageFont.load_default()
+    draw = ImageDraw.Draw(pil_img)
+
+    for bbox, label in zip((bboxes * scale).astype(int), labels):
+        top, right, bottom, left = bbox[1], bbox[2], bbox[3], bbox[0]
+
+        # 🟥 Red for Unknown, 🟩 Green for known
+        box_color = (255, 0, 0) if label == UNKNOWN else (0, 255, 0)
+        draw.rectangle(((left, top), (right, bottom)), outline=box_color, width=3)
+
+        text_bbox = draw.textbbox((0, 0), label, font=font)
+        draw.rectangle(
+            [(left, bottom), (left + text_bbox[2] + 6, bottom + text_bbox[3] + 6)],
+            fill=box_color
+        )
+        draw.text((left + 3, bottom + 3), label, fill=(0, 0, 0), font=font)
+
+    timings["annotation"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    buf = io.BytesIO()
+    pil_img.save(buf, format='JPEG', quality=quality)
+    timings["jpeg_encode"] = time.perf_counter() - started
+    return buf.getvalue(), timings
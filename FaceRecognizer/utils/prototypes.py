@@ -0,0 +1,75 @@
+"""
+Compact per-student templates for matching. Instead of every enrollment
+embedding, a student is matched through the normalized centroid of all of
+them plus at most PROTOTYPE_EXEMPLARS exemplars: embeddings picked to be as
+different from the centroid and from each other as possible (other poses,
+glasses, lighting), skipping near-duplicates of what is already kept. A
+student therefore costs at most 1 + PROTOTYPE_EXEMPLARS gallery rows however
+many photos were enrolled.
+
+Templates keep the running sum and count of the embeddings, so new photos
+are folded in without the old embeddings: the centroid is updated and the
+exemplars are re-picked from the old exemplars and the new embeddings.
+Templates are immutable; add returns a new one, so galleries that share a
+template are never changed under a running match.
+"""
+
+import numpy as np
+
+from utils.config import PROTOTYPE_DEDUP_SIMILARITY, PROTOTYPE_EXEMPLARS
+from utils.matcher import normalize
+
+
+def pick_exemplars(centroid: np.ndarray, candidates: np.ndarray, k: int, dedup: float) -> np.ndarray:
+    """
+    Farthest-point selection: repeatedly keeps the candidate least similar to
+    the centroid and the exemplars kept so far, until `k` are kept or the
+    remaining candidates are all at least `dedup` similar to one of them.
+    """
+    if k <= 0 or len(candidates) == 0:
+        return candidates[:0]
+    # Best similarity of every candidate to anything already kept
+    closest = candidates @ centroid
+    kept = []
+    for _ in range(min(k, len(candidates))):
+        pick = int(np.argmin(closest))
+        if closest[pick] >= dedup:
+            break
+        kept.append(pick)
+        closest = np.maximum(closest, candidates @ candidates[pick])
+    return candidates[kept]
+
+
+class Template:
+    def __init__(self, total: np.ndarray, count: int, exemplars: np.ndarray,
+                 k: int = PROTOTYPE_EXEMPLARS, dedup: float = PROTOTYPE_DEDUP_SIMILARITY,
+                 centroid: np.ndarray | None = None):
+        self.total = total
+        self.count = count
+        self.exemplars = exemplars
+        self.k = k
+        self.dedup = dedup
+        # Passed in when the rows already exist (memory-mapped shared galleries)
+        self.centroid = normalize(total.astype(np.float32)) if centroid is None else centroid
+
+    @classmethod
+    def from_vectors(cls, vectors: np.ndarray, k: int = PROTOTYPE_EXEMPLARS,
+                     dedup: float = PROTOTYPE_DEDUP_SIMILARITY) -> "Template":
+        """Template of normalized (n x 512) `vectors`."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        total = vectors.sum(axis=0, dtype=np.float64)
+        return cls(total, len(vectors), pick_exemplars(normalize(total), vectors, k, dedup), k, dedup)
+
+    def add(self, vectors: np.ndarray) -> "Template":
+        """Folds the normalized (n x 512) `vectors` of new photos into a new template."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) == 0:
+            return self
+        total = self.total + vectors.sum(axis=0, dtype=np.float64)
+        candidates = np.concatenate([self.exemplars, vectors])
+        return Template(total, self.count + len(vectors),
+                        pick_exemplars(normalize(total), candidates, self.k, self.dedup), self.k, self.dedup)
+
+    def rows(self) -> np.ndarray:
+        """The gallery rows of this student: the centroid, then the exemplars."""
+        return np.concatenate([self.centroid[None], self.exemplars])
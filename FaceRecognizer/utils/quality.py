@@ -0,0 +1,79 @@
+"""
+Cheap per-face quality signals computed from the detector's output and the
+decoded image, without running recognition: face size in original image
+pixels, a yaw estimate from the five keypoints and sharpness (variance of
+the Laplacian over the face, resized to a fixed size so faces of different
+sizes compare), plus the sharpness of the whole photo. geometry_reasons and
+blur_reasons turn them into the quality gate's reason codes.
+"""
+
+import cv2
+import numpy as np
+
+from utils.config import QUALITY_MAX_YAW, QUALITY_MIN_DET_SCORE, QUALITY_MIN_FACE_PX, QUALITY_MIN_SHARPNESS
+
+# Reason codes of faces the quality gate keeps away from recognition, in the order they are checked
+TOO_SMALL, LOW_SCORE, POSE, BLURRY = "too_small", "low_score", "pose", "blurry"
+
+# Faces are measured at SHARPNESS_SIZE pixels square, whole photos at IMAGE_SHARPNESS_WIDTH wide
+SHARPNESS_SIZE = 64
+IMAGE_SHARPNESS_WIDTH = 512
+
+
+def sharpness(gray: np.ndarray) -> float:
+    """Variance of the Laplacian of a grayscale patch: low values mean blur."""
+    if gray.size == 0:
+        return 0.0
+    patch = cv2.resize(gray, (SHARPNESS_SIZE, SHARPNESS_SIZE), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(patch, cv2.CV_32F).var())
+
+
+def face_sizes(bboxes: np.ndarray) -> np.ndarray:
+    """Shorter side of every box, in the boxes' pixels."""
+    return np.minimum(bboxes[:, 2] - bboxes[:, 0], bboxes[:, 3] - bboxes[:, 1]).astype(np.float32)
+
+
+def face_sharpness(image: np.ndarray, bboxes: np.ndarray) -> np.ndarray:
+    """Sharpness of every face of an RGB image; `bboxes` are in that image's pixels."""
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    height, width = gray.shape
+    values = []
+    for x1, y1, x2, y2 in bboxes.astype(int):
+        values.append(sharpness(gray[max(y1, 0):min(y2, height), max(x1, 0):min(x2, width)]))
+    return np.array(values, dtype=np.float32)
+
+
+def image_sharpness(image: np.ndarray) -> float:
+    """Sharpness of a whole RGB image at IMAGE_SHARPNESS_WIDTH pixels wide."""
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    height = max(1, round(gray.shape[0] * IMAGE_SHARPNESS_WIDTH / gray.shape[1]))
+    gray = cv2.resize(gray, (IMAGE_SHARPNESS_WIDTH, height), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(gray, cv2.CV_32F).var())
+
+
+def yaw(kpss: np.ndarray) -> np.ndarray:
+    """
+    Offset of the nose from the eye midpoint along the eye axis, over the eye
+    distance, per face: about 0 for a frontal face, growing towards profile.
+    """
+    left, right, nose = kpss[:, 0], kpss[:, 1], kpss[:, 2]
+    axis = right - left
+    distance = np.maximum(np.linalg.norm(axis, axis=1), 1e-6)
+    offset = ((nose - (left + right) / 2) * axis).sum(axis=1) / distance
+    return (np.abs(offset) / distance).astype(np.float32)
+
+
+def geometry_reasons(bboxes: np.ndarray, det_scores: np.ndarray, kpss: np.ndarray,
+                     min_face_px: float = QUALITY_MIN_FACE_PX, min_det_score: float = QUALITY_MIN_DET_SCORE,
+                     max_yaw: float = QUALITY_MAX_YAW) -> np.ndarray:
+    """Reason code per face from its box, score and keypoints alone ("" = passes)."""
+    reasons = np.full(len(bboxes), "", dtype=object)
+    reasons[yaw(kpss) > max_yaw] = POSE
+    reasons[det_scores < min_det_score] = LOW_SCORE
+    reasons[face_sizes(bboxes) < min_face_px] = TOO_SMALL
+    return reasons.astype(str)
+
+
+def blur_reasons(image: np.ndarray, bboxes: np.ndarray, min_sharpness: float = QUALITY_MIN_SHARPNESS) -> np.ndarray:
+    """Reason code per face of `image` (boxes in its pixels) from its sharpness ("" = passes)."""
+    return np.where(face_sharpness(image, bboxes) < min_sharpness, BLURRY, "").astype(str)
@@ -0,0 +1,111 @@
+"""
+Builds the INT8 model pack used by MODEL_PRECISION=int8.
+
+The detection and recognition models of MODEL_PACK are quantized with ONNX
+Runtime and written next to the original pack as "<pack>_int8", which
+load_face_analyzer picks up like any other InsightFace pack. Static
+quantization (default) calibrates activations on the inputs the FP32 models
+see while processing the fixture photos in testing/lecture_images, so the
+calibration data goes through exactly the same preprocessing as in
+production; dynamic quantization needs no calibration data.
+
+Run from FaceRecognizer/:
+python -m utils.quantize --pack buffalo_l --method static
+python -m benchmarks.quantization_check  # compare against FP32 afterwards
+"""
+
+import argparse
+import sys
+import tempfile
+from pathlib import Path
+
+from onnxruntime.quantization import (
+    CalibrationDataReader, QuantFormat, QuantType, quant_pre_process, quantize_dynamic, quantize_static
+)
+
+from utils.config import DET_SIZE, MODEL_MODULES, MODEL_PACK
+from utils.models import load_face_analyzer, quantized_pack
+from utils.pipeline import detect_and_align, embed_crops, use_face_analyzer
+
+FIXTURE_DIR = Path(__file__).resolve().parent.parent / "testing" / "lecture_images"
+
+
+class RecordingSession:
+    """Wraps an InferenceSession and keeps every input feed it runs."""
+
+    def __init__(self, session):
+        self._session = session
+        self.feeds = []
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    def run(self, output_names, input_feed, *args, **kwargs):
+        self.feeds.append(dict(input_feed))
+        return self._session.run(output_names, input_feed, *args, **kwargs)
+
+
+class FeedReader(CalibrationDataReader):
+    def __init__(self, feeds: list[dict]):
+        self._feeds = iter(feeds)
+
+    def get_next(self):
+        return next(self._feeds, None)
+
+
+def collect_calibration_feeds(face_analyzer, fixture_dir: Path, limit: int) -> dict[str, list[dict]]:
+    """Runs detection and recognition on the fixtures, recording model inputs per module."""
+    recorders = {}
+    for module, model in face_analyzer.models.items():
+        recorders[module] = model.session = RecordingSession(model.session)
+
+    with use_face_analyzer(face_analyzer):
+        for path in sorted(fixture_dir.glob("*.jpg"))[:limit]:
+            embed_crops(detect_and_align(path.read_bytes(), decode_mode="full")["crops"])
+
+    return {module: recorder.feeds for module, recorder in recorders.items()}
+
+
+def quantize_model(model_file: str, output: Path, method: str, feeds: list[dict] | None):
+    with tempfile.TemporaryDirectory() as tmp:
+        prepared = Path(tmp) / "prepared.onnx"
+        quant_pre_process(model_file, prepared, skip_symbolic_shape=True)
+        if method == "dynamic":
+            quantize_dynamic(prepared, output, weight_type=QuantType.QInt8)
+        else:
+            quantize_static(
+                prepared, output, FeedReader(feeds),
+                quant_format=QuantFormat.QDQ, per_channel=True,
+                activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8
+            )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Quantize the detection and recognition models to INT8")
+    parser.add_argument("--pack", default=MODEL_PACK, help="Source InsightFace model pack")
+    parser.add_argument("--method", choices=("static", "dynamic"), default="static")
+    parser.add_argument("--calibration-dir", default=str(FIXTURE_DIR), help="Photos used for static calibration")
+    parser.add_argument("--calibration-images", type=int, default=50, help="Maximum calibration photos")
+    args = parser.parse_args(argv)
+
+    face_analyzer = load_face_analyzer(args.pack, MODEL_MODULES, DET_SIZE, precision="fp32", device="cpu")
+    source_dir = Path(face_analyzer.models["recognition"].model_file).parent
+    output_dir = source_dir.parent / quantized_pack(args.pack)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    feeds = {}
+    if args.method == "static":
+        feeds = collect_calibration_feeds(face_analyzer, Path(args.calibration_dir), args.calibration_images)
+
+    for module, model in face_analyzer.models.items():
+        output = output_dir / Path(model.model_file).name
+        print(f"[INFO] Quantizing {module} ({Path(model.model_file).name}, {args.method}"
+              + (f", {len(feeds[module])} calibration batches)" if feeds else ")"))
+        quantize_model(model.model_file, output, args.method, feeds.get(module))
+
+    print(f"✅ INT8 pack written to {output_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""
+Staged processing of the photos of one request. Every stage runs on its own
+workers and hands items to the next one through a bounded queue, so
+decoding/detecting photo i+1, embedding photo i and rendering photo i-1
+overlap, and a lecture takes about as long as its slowest stage instead of
+the sum of all of them. The bounded queues also cap how many photos (and
+their decoded images) are in flight at once.
+"""
+
+import asyncio
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+_DONE = object()
+
+
+@dataclass
+class Stage:
+    fn: Callable[[Any], Awaitable[Any]]
+    concurrency: int = 1
+
+
+class _StageError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+async def run_stages(items: list, stages: list[Stage], depth: int = 2) -> AsyncIterator[tuple[int, Any]]:
+    """
+    Passes every item through `stages` in order and yields (index, result)
+    in input order. At most `depth` items wait between two stages. The first
+    exception raised by a stage stops the pipeline and is re-raised here.
+    """
+    depth = max(depth, 1)
+    queues = [asyncio.Queue(maxsize=depth) for _ in stages]
+    results = asyncio.Queue(maxsize=depth)
+    remaining = [max(stage.concurrency, 1) for stage in stages]
+
+    async def feed():
+        for entry in enumerate(items):
+            await queues[0].put(entry)
+        for _ in range(remaining[0]):
+            await queues[0].put(_DONE)
+
+    async def work(k: int):
+        stage, inbox = stages[k], queues[k]
+        outbox = queues[k + 1] if k + 1 < len(stages) else results
+        try:
+            while True:
+                entry = await inbox.get()
+                if entry is _DONE:
+                    break
+                index, item = entry
+                await outbox.put((index, await stage.fn(item)))
+        except Exception as e:
+            await results.put(_StageError(e))
+            return
+
+        remaining[k] -= 1
+        if remaining[k] == 0 and k + 1 < len(stages):
+            for _ in range(remaining[k + 1]):
+                await outbox.put(_DONE)
+
+    tasks = [asyncio.create_task(feed())] + [
+        asyncio.create_task(work(k)) for k, stage in enumerate(stages) for _ in range(remaining[k])
+    ]
+    try:
+        buffered, next_index = {}, 0
+        while next_index < len(items):
+            entry = await results.get()
+            if isinstance(entry, _StageError):
+                raise entry.error
+            index, result = entry
+            buffered[index] = result
+            while next_index in buffered:
+                yield next_index, buffered.pop(next_index)
+                next_index += 1
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,41 +1,131 @@
-
 import boto3
 import os
 import mimetypes
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from botocore.config import Config
+
+from utils.config import S3_MAX_POOL_CONNECTIONS, S3_RETRIES, S3_UPLOAD_CONCURRENCY
+from utils.metrics import STAGE_SECONDS
 
 bucket = os.getenv("AWS_BUCKET_NAME")
 region = os.getenv("AWS_REGION")
 
-s3 = boto3.client(
-    "s3",
-    region_name=region,
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY")
-)
+_s3 = None
+_s3_lock = threading.Lock()
+
+
+def get_s3_client():
+    """
+    Shared boto3 client (thread-safe), created on first use. Its connection
+    pool is sized for the upload threads and failed calls are retried with
+    exponential backoff. AWS_ENDPOINT_URL points it at MinIO or a moto server.
+    """
+    global _s3
+    with _s3_lock:
+        if _s3 is None:
+            _s3 = boto3.client(
+                "s3",
+                region_name=region,
+                endpoint_url=os.getenv("AWS_ENDPOINT_URL") or None,
+                aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+                aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+                config=Config(
+                    max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                    retries={"max_attempts": S3_RETRIES, "mode": "standard"}
+                )
+            )
+        return _s3
+
+
+def s3_location(filename: str, filepath: str) -> tuple[str, str]:
+    key = f"{filepath}/{filename}"
+    endpoint = os.getenv("AWS_ENDPOINT_URL")
+    if endpoint:
+        url = f"{endpoint.rstrip('/')}/{bucket}/{key}"
+    else:
+        url = f"https://{bucket}.s3.{region}.amazonaws.com/{key}"
+    return url, key
+
 
 def upload_to_s3(image_bytes: bytes, filename: str, filepath: str) -> tuple[str, str]:
     # lectures/<subject_id>/<lec_id>/annotated_images/<timestamp>.jpg
-    key = f"{filepath}/{filename}"
+    url, key = s3_location(filename, filepath)
 
     # Get content type based on file extension
     content_type, _ = mimetypes.guess_type(filename)
     content_type = content_type or "application/octet-stream"  # Fallback
-    
+
     # Upload to S3
-    s3.put_object(Bucket=bucket, Key=key, Body=image_bytes, ContentType=content_type)
+    get_s3_client().put_object(Bucket=bucket, Key=key, Body=image_bytes, ContentType=content_type)
 
-    url = f"https://{bucket}.s3.{region}.amazonaws.com/{key}"
     return url, key
 
 def delete_from_s3(key: str):
-    s3.delete_object(Bucket=bucket, Key=key)
+    get_s3_client().delete_object(Bucket=bucket, Key=key)
 
 def download_from_s3(key: str) -> bytes:
     """
     Downloads an object from S3 and returns its content as bytes.
     """
+    s3 = get_s3_client()
     try:
         response = s3.get_object(Bucket=bucket, Key=key)
         return response["Body"].read()
     except s3.exceptions.NoSuchKey:
         raise FileNotFoundError(f"S3 object with key '{key}' not found.")
+
+
+class S3Uploader:
+    """
+    Uploads objects on a pool of threads sharing the S3 client's connection
+    pool. Every upload is tracked per folder (e.g. a lecture's
+    annotated_images/) so deferred uploads can report their status later.
+    """
+
+    def __init__(self, concurrency: int = S3_UPLOAD_CONCURRENCY, max_tracked: int = 1024):
+        self.concurrency = concurrency
+        self._executor = None
+        self._status: OrderedDict[str, dict] = OrderedDict()
+        self._max_tracked = max_tracked
+        self._lock = threading.Lock()
+
+    def submit(self, image_bytes: bytes, filename: str, filepath: str) -> Future:
+        self._set_status(filepath, filename, {"status": "pending"})
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="s3-upload")
+            executor = self._executor
+        future = executor.submit(self._upload, image_bytes, filename, filepath)
+        future.add_done_callback(lambda f: self._set_status(filepath, filename, (
+            {"status": "failed", "error": str(f.exception())} if f.exception() else {"status": "uploaded"}
+        )))
+        return future
+
+    def _upload(self, image_bytes: bytes, filename: str, filepath: str) -> tuple[str, str]:
+        started = time.perf_counter()
+        try:
+            return upload_to_s3(image_bytes, filename, filepath)
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage="s3_upload")
+
+    def status(self, filepath: str) -> dict | None:
+        with self._lock:
+            files = self._status.get(filepath)
+            return dict(files) if files is not None else None
+
+    def _set_status(self, filepath: str, filename: str, status: dict):
+        with self._lock:
+            self._status.setdefault(filepath, {})[filename] = status
+            self._status.move_to_end(filepath)
+            while len(self._status) > self._max_tracked:
+                self._status.popitem(last=False)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -0,0 +1,313 @@
+"""
+On-disk embedding store: a float32 .npy matrix that loads memory-mapped, an
+id sidecar (one id per row) and an append-only log of later additions and
+deletions, replayed on open. compact() folds the log into a new generation.
+
+Layout of a store directory:
+    CURRENT                 name of the live generation, replaced atomically
+    gen-000003/vectors.npy  (N x dim) float32
+    gen-000003/ids.txt      id of every row, newline separated
+    gen-000003/log.bin      records appended since the generation was written
+    gen-000003/<name>.npy   extra arrays saved with the generation (e.g. IVF lists)
+    LOCK                    flock of the one process allowed to write
+
+Only one process writes a store: the first to open it holds an exclusive
+flock on LOCK until close(); any other process opens it read-only (the
+generation and log as they were at open) and its updates raise
+ReadOnlyStoreError. read_only=True opens it read-only without ever taking
+the lock, for readers that must not become the writer.
+
+Log record: struct "<cHI" (op b"A" add / b"D" delete, id length, rows), the
+UTF-8 id, then rows x dim little-endian float32 for additions. A torn record
+at the end (crash while appending) is cut off on open.
+
+Run from FaceRecognizer/:
+python -m utils.store info testing/db
+python -m utils.store import-json testing/db.json testing/db
+python -m utils.store compact testing/db
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import shutil
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+CURRENT = "CURRENT"
+RECORD = struct.Struct("<cHI")
+ADD = b"A"
+DELETE = b"D"
+WRITER_LOCK = "LOCK"
+
+
+class ReadOnlyStoreError(Exception):
+    pass
+
+
+class EmbeddingStore:
+    def __init__(self, directory: str, dim: int = 512, mmap: bool = True, wait: float = 30.0,
+                 read_only: bool = False):
+        self.directory = Path(directory)
+        self.mmap = mmap
+        self._lock = threading.Lock()
+        self._log = None
+        self._writer_lock = None
+        self.writable = False
+
+        if not read_only:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._writer_lock = open(self.directory / WRITER_LOCK, "a")
+            try:
+                fcntl.flock(self._writer_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.writable = True
+            except BlockingIOError:
+                self._writer_lock.close()
+                self._writer_lock = None
+
+        if self.writable and not (self.directory / CURRENT).exists():
+            self._write_generation(1, [], np.empty((0, dim), dtype=np.float32))
+        # The writer may still be creating the first generation
+        deadline = time.monotonic() + wait
+        while not (self.directory / CURRENT).exists():
+            if time.monotonic() > deadline:
+                raise FileNotFoundError(f"No generation in {self.directory} after {wait:.0f}s")
+            time.sleep(0.1)
+        self._open()
+
+    # -- generations
+
+    def _write_generation(self, number: int, ids: list[str], matrix: np.ndarray, extras: dict | None = None) -> Path:
+        for id_ in ids:
+            if "\n" in id_:
+                raise ValueError(f"Embedding ids cannot contain newlines: {id_!r}")
+        name = f"gen-{number:06d}"
+        target = self.directory / name
+        if target.exists():
+            shutil.rmtree(target)
+        target.mkdir(parents=True)
+        np.save(target / "vectors.npy", np.ascontiguousarray(matrix, dtype=np.float32))
+        (target / "ids.txt").write_text("\n".join(ids))
+        (target / "log.bin").touch()
+        for extra, array in (extras or {}).items():
+            np.save(target / f"{extra}.npy", array)
+
+        pointer = self.directory / f"{CURRENT}.tmp"
+        pointer.write_text(name)
+        os.replace(pointer, self.directory / CURRENT)
+        return target
+
+    def _open(self):
+        self.generation = self.directory / (self.directory / CURRENT).read_text().strip()
+        self.base_vectors = np.load(self.generation / "vectors.npy", mmap_mode="r" if self.mmap else None)
+        self.dim = self.base_vectors.shape[1]
+        ids_text = (self.generation / "ids.txt").read_text()
+        self.base_ids = ids_text.split("\n") if ids_text else []
+        self.base_alive = np.ones(len(self.base_ids), dtype=bool)
+        self._base_rows_by_id = None  # built on first lookup, so plain loads stay fast
+        self.tail: dict[str, np.ndarray] = {}  # ids added since the generation, in log order
+        self.log_records = 0
+        self._replay()
+        if self.writable:
+            self._log = open(self.generation / "log.bin", "ab")
+
+    def _replay(self):
+        path = self.generation / "log.bin"
+        data = path.read_bytes()
+        offset = 0
+        while offset + RECORD.size <= len(data):
+            op, id_length, rows = RECORD.unpack_from(data, offset)
+            end = offset + RECORD.size + id_length + (rows * self.dim * 4 if op == ADD else 0)
+            if end > len(data):
+                break
+            id_ = data[offset + RECORD.size:offset + RECORD.size + id_length].decode()
+            if op == ADD:
+                vectors = np.frombuffer(data, dtype="<f4", count=rows * self.dim,
+                                        offset=offset + RECORD.size + id_length).reshape(rows, self.dim)
+                self._apply_add(id_, vectors)
+            else:
+                self._apply_delete(id_)
+            self.log_records += 1
+            offset = end
+        # A reader may see the writer's record half appended, only the writer cuts it off
+        if offset < len(data) and self.writable:
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+
+    @property
+    def _base_rows(self) -> dict[str, list[int]]:
+        if self._base_rows_by_id is None:
+            rows = {}
+            for row in np.flatnonzero(self.base_alive).tolist():
+                rows.setdefault(self.base_ids[row], []).append(row)
+            self._base_rows_by_id = rows
+        return self._base_rows_by_id
+
+    def _apply_add(self, id_: str, vectors: np.ndarray):
+        previous = self.tail.pop(id_, None)
+        self.tail[id_] = vectors if previous is None else np.concatenate([previous, vectors])
+
+    def _apply_delete(self, id_: str):
+        self.base_alive[self._base_rows.pop(id_, [])] = False
+        self.tail.pop(id_, None)
+
+    def _append(self, op: bytes, id_: str, vectors: np.ndarray | None = None):
+        if not self.writable:
+            raise ReadOnlyStoreError(f"{self.directory} is opened for writing by another process")
+        encoded = id_.encode()
+        if "\n" in id_:
+            raise ValueError(f"Embedding ids cannot contain newlines: {id_!r}")
+        payload = RECORD.pack(op, len(encoded), 0 if vectors is None else len(vectors)) + encoded
+        if vectors is not None:
+            payload += vectors.astype("<f4", copy=False).tobytes()
+        self._log.write(payload)
+        self._log.flush()
+        self.log_records += 1
+
+    # -- updates
+
+    def append(self, id_: str, vectors) -> int:
+        """Adds rows for `id_` (keeping any it already has)."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            self._append(ADD, id_, vectors)
+            self._apply_add(id_, vectors.copy())
+        return len(vectors)
+
+    def delete(self, id_: str) -> bool:
+        with self._lock:
+            if id_ not in self:
+                return False
+            self._append(DELETE, id_)
+            self._apply_delete(id_)
+        return True
+
+    def put(self, id_: str, vectors) -> int:
+        """Replaces every row of `id_`."""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            if id_ in self:
+                self._append(DELETE, id_)
+                self._apply_delete(id_)
+            self._append(ADD, id_, vectors)
+            self._apply_add(id_, vectors.copy())
+        return len(vectors)
+
+    # -- reads
+
+    def __contains__(self, id_: str) -> bool:
+        return id_ in self._base_rows or id_ in self.tail
+
+    def __len__(self):
+        return len(set(self._base_rows) | set(self.tail))
+
+    def rows(self) -> tuple[list[str], np.ndarray]:
+        """
+        Live ids (one per row) and their (N x dim) matrix. Straight from the
+        memory map when nothing was logged since the last compaction.
+        """
+        with self._lock:
+            if self.log_records == 0:
+                return list(self.base_ids), self.base_vectors
+            live = np.flatnonzero(self.base_alive)
+            ids = [self.base_ids[row] for row in live]
+            parts = [self.base_vectors[live]]
+            for id_, vectors in self.tail.items():
+                ids.extend([id_] * len(vectors))
+                parts.append(vectors)
+            return ids, np.concatenate(parts) if parts else np.empty((0, self.dim), dtype=np.float32)
+
+    def extra(self, name: str) -> np.ndarray | None:
+        """Extra array saved with the current generation, if any."""
+        path = self.generation / f"{name}.npy"
+        return np.load(path) if path.exists() else None
+
+    # -- compaction
+
+    def compact(self):
+        ids, matrix = self.rows()
+        self.rewrite(ids, matrix)
+
+    def rewrite(self, ids: list[str], matrix: np.ndarray, extras: dict | None = None):
+        """
+        Writes `ids`/`matrix` (the live rows, in any order) as a new
+        generation with an empty log, plus `extras` aligned with those rows,
+        and removes the old generation.
+        """
+        if not self.writable:
+            raise ReadOnlyStoreError(f"{self.directory} is opened for writing by another process")
+        with self._lock:
+            old = self.generation
+            number = int(old.name.split("-")[1]) + 1
+            self._log.close()
+            self._write_generation(number, ids, matrix, extras)
+            self._open()
+        # Processes that memory-mapped the old generation keep their mapping
+        shutil.rmtree(old, ignore_errors=True)
+
+    def describe(self) -> dict:
+        return {
+            "generation": self.generation.name,
+            "ids": len(self),
+            "baseRows": len(self.base_ids),
+            "logRecords": self.log_records,
+            "dim": self.dim,
+            "writable": self.writable,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            if self._writer_lock is not None:
+                self._writer_lock.close()  # releases the flock
+                self._writer_lock = None
+
+
+def import_json(path: str, directory: str) -> EmbeddingStore:
+    """
+    Imports a db.json gallery, either {"id": [floats]} (testing/dry_run.py) or
+    [{"roll_number": ..., "embedding": [floats]}] (testing/train.py).
+    """
+    data = json.loads(Path(path).read_text())
+    if isinstance(data, list):
+        data = {record["roll_number"]: record["embedding"] for record in data}
+    dim = len(next(iter(data.values()))) if data else 512
+
+    store = EmbeddingStore(directory, dim=dim)
+    ids = list(data)
+    matrix = np.asarray([data[id_] for id_ in ids], dtype=np.float32).reshape(-1, dim)
+    store.rewrite(ids, matrix)
+    return store
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Inspect, import and compact embedding stores")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("info").add_argument("directory")
+    commands.add_parser("compact").add_argument("directory")
+    importer = commands.add_parser("import-json")
+    importer.add_argument("json_file")
+    importer.add_argument("directory")
+    args = parser.parse_args(argv)
+
+    if args.command == "import-json":
+        store = import_json(args.json_file, args.directory)
+    else:
+        store = EmbeddingStore(args.directory)
+        if args.command == "compact":
+            store.compact()
+    print(json.dumps(store.describe(), indent=2))
+    store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,286 @@
+"""
+Face tracking for short videos and photo bursts (/verify-attendance/video).
+
+Frames are sampled adaptively: at most VIDEO_SAMPLE_FPS candidates per
+second are looked at, and a candidate is only run through the detector once
+the camera has panned VIDEO_MIN_SHIFT of the frame width since the last
+detected frame (or VIDEO_MAX_GAP_SECONDS have passed). Detections are linked
+into tracks by IoU after shifting the tracks by the estimated camera motion,
+and every track keeps the aligned crop of its best face only. Recognition
+then runs once per track, so its cost follows the number of distinct faces
+rather than the number of frames; tracks the tracker split up are merged
+again by embedding similarity.
+
+track_faces runs inside the inference pool like the steps in utils/pipeline.py.
+"""
+
+import os
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+import cv2
+import numpy as np
+from insightface.utils import face_align
+
+from utils.config import (
+    TRACK_IOU, TRACK_MAX_AGE, VIDEO_MAX_FRAMES, VIDEO_MAX_GAP_SECONDS, VIDEO_MIN_SHIFT, VIDEO_SAMPLE_FPS
+)
+from utils.pipeline import decode_image, get_face_analyzer
+
+# Width of the grayscale thumbnails used to estimate camera motion
+MOTION_WIDTH = 160
+
+
+@dataclass
+class Track:
+    id: int
+    bbox: np.ndarray
+    first_frame: int
+    last_frame: int
+    frames: int = 1
+    quality: float = -1.0
+    best_frame: int = -1
+    best_bbox: Optional[np.ndarray] = None
+    best_score: float = 0.0
+    crop: Optional[np.ndarray] = None
+    # Processed-frame counter of the tracker when this track was last matched
+    seen_at: int = 0
+    # Every frame the track has a detection in
+    frame_indices: list[int] = field(default_factory=list)
+
+    def describe(self) -> dict:
+        return {
+            "trackId": self.id,
+            "frames": self.frames,
+            "firstFrame": self.first_frame,
+            "lastFrame": self.last_frame,
+            "bestFrame": self.best_frame,
+            "bbox": self.best_bbox.round(1).tolist(),
+            "detScore": round(self.best_score, 4),
+        }
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU of every box in `a` (N x 4) with every box in `b` (M x 4)."""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), dtype=np.float32)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-6)
+
+
+def face_quality(bbox: np.ndarray, det_score: float, crop_size: int = 112) -> float:
+    """Detection score weighted by face size; faces beyond twice the crop size gain nothing more."""
+    side = min(bbox[2] - bbox[0], bbox[3] - bbox[1])
+    return float(det_score * min(side, 2 * crop_size))
+
+
+class FaceTracker:
+    """
+    Greedy IoU tracker. Tracks not seen for more than `max_age` processed
+    frames are no longer matched, but are kept for recognition.
+    """
+
+    def __init__(self, iou_threshold: float = TRACK_IOU, max_age: int = TRACK_MAX_AGE):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.tracks: list[Track] = []
+        self._frames = 0
+
+    def update(self, frame: int, bboxes: np.ndarray, det_scores: np.ndarray,
+               shift: tuple[float, float] = (0.0, 0.0)) -> list[tuple[int, Track]]:
+        """
+        Links one frame's detections to the tracks, `shift` being the camera
+        motion in pixels since the previous processed frame. Returns the
+        (detection, track) pairs whose face is the best the track has seen,
+        so the caller only aligns crops it is going to keep.
+        """
+        self._frames += 1
+        offset = np.array([shift[0], shift[1], shift[0], shift[1]], dtype=np.float32)
+        for track in self.tracks:
+            track.bbox = track.bbox + offset
+
+        live = [t for t in self.tracks if self._frames - t.seen_at <= self.max_age]
+        ious = iou_matrix(np.array([t.bbox for t in live]).reshape(-1, 4), bboxes)
+
+        assigned: dict[int, Track] = {}
+        for flat in np.argsort(-ious, axis=None):
+            t, d = divmod(int(flat), ious.shape[1])
+            if ious[t, d] < self.iou_threshold:
+                break
+            if d in assigned or live[t] in assigned.values():
+                continue
+            assigned[d] = live[t]
+
+        improved = []
+        for d, (bbox, score) in enumerate(zip(bboxes, det_scores)):
+            track = assigned.get(d)
+            if track is None:
+                track = Track(id=len(self.tracks), bbox=bbox, first_frame=frame, last_frame=frame, frames=0)
+                self.tracks.append(track)
+            track.bbox = bbox
+            track.last_frame = frame
+            track.frames += 1
+            track.frame_indices.append(frame)
+            track.seen_at = self._frames
+
+            quality = face_quality(bbox, float(score))
+            if quality > track.quality:
+                track.quality, track.best_frame, track.best_bbox, track.best_score = quality, frame, bbox, float(score)
+                improved.append((d, track))
+        return improved
+
+
+def merge_tracks(embeddings: np.ndarray, qualities: list[float], threshold: float,
+                 frames: Optional[list[list[int]]] = None) -> list[list[int]]:
+    """
+    Groups tracks of the same face split up by the tracker, by complete
+    linkage: two groups only merge while every pair of their tracks is at
+    least `threshold` similar, so a chain of look-alikes does not collapse
+    into one group. Tracks with a detection in the same one of `frames` (the
+    frames of every track) are different faces and never end up together.
+    Every group lists its best-quality track first.
+    """
+    groups = [[i] for i in range(len(embeddings))]
+    if len(embeddings) > 1:
+        similarity = (embeddings @ embeddings.T).astype(np.float64)
+        np.fill_diagonal(similarity, -np.inf)
+        by_frame: dict[int, list[int]] = {}
+        for track, indices in enumerate(frames or []):
+            for frame in indices:
+                by_frame.setdefault(frame, []).append(track)
+        for tracks in by_frame.values():
+            similarity[np.ix_(tracks, tracks)] = -np.inf
+
+        while True:
+            i, j = sorted(np.unravel_index(int(np.argmax(similarity)), similarity.shape))
+            if similarity[i, j] < threshold:
+                break
+            # A merged group is as similar to the others as its least similar member
+            similarity[i] = similarity[:, i] = np.minimum(similarity[i], similarity[j])
+            similarity[i, i] = -np.inf
+            similarity[j] = similarity[:, j] = -np.inf
+            groups[i] += groups[j]
+            groups[j] = []
+    return [sorted(group, key=lambda i: -qualities[i]) for group in groups if group]
+
+
+def motion_thumbnail(frame: np.ndarray) -> np.ndarray:
+    height = max(1, round(frame.shape[0] * MOTION_WIDTH / frame.shape[1]))
+    gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+    return cv2.resize(gray, (MOTION_WIDTH, height), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def video_frames(contents: bytes, suffix: str, sample_fps: float = VIDEO_SAMPLE_FPS) -> Iterator[tuple[int, float, np.ndarray]]:
+    """
+    Yields (frame index, seconds, RGB frame) for at most `sample_fps` frames
+    per second of the video; the frames in between are skipped undecoded.
+    """
+    with tempfile.NamedTemporaryFile(suffix=suffix) as f:
+        f.write(contents)
+        f.flush()
+        capture = cv2.VideoCapture(f.name)
+        if not capture.isOpened():
+            raise ValueError("Unreadable video")
+        try:
+            fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+            step = max(1, round(fps / sample_fps)) if sample_fps > 0 else 1
+            index = 0
+            while True:
+                if index % step == 0:
+                    ok, frame = capture.read()
+                    if not ok:
+                        break
+                    yield index, index / fps, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                elif not capture.grab():
+                    break
+                index += 1
+        finally:
+            capture.release()
+
+
+def burst_frames(photos: list[bytes]) -> Iterator[tuple[int, float, np.ndarray]]:
+    """A burst has no timestamps; photo i counts as second i."""
+    for index, contents in enumerate(photos):
+        yield index, float(index), decode_image(contents)
+
+
+def track_faces(video: Optional[bytes] = None, suffix: str = ".mp4", photos: Optional[list[bytes]] = None,
+                max_frames: int = VIDEO_MAX_FRAMES, min_shift: float = VIDEO_MIN_SHIFT,
+                max_gap: float = VIDEO_MAX_GAP_SECONDS) -> dict:
+    """
+    Samples the video (or burst of photos), detects and tracks the faces and
+    returns every track with the aligned crop of its best face, ready for
+    one batched recognition call. Burst photos are never skipped.
+    """
+    face_analyzer = get_face_analyzer()
+    crop_size = face_analyzer.models['recognition'].input_size[0]
+    if video is not None:
+        frames = video_frames(video, suffix)
+    else:
+        frames, max_gap = burst_frames(photos), 0.0
+    tracker = FaceTracker()
+    timings = {"decode": 0.0, "detection": 0.0, "alignment": 0.0, "tracking": 0.0}
+    sampled, processed = 0, []
+    last_thumb, last_time = None, None
+
+    started = time.perf_counter()
+    for index, seconds, frame in frames:
+        timings["decode"] += time.perf_counter() - started
+        sampled += 1
+
+        started = time.perf_counter()
+        thumb = motion_thumbnail(frame)
+        shift = (0.0, 0.0)
+        if last_thumb is not None:
+            if thumb.shape == last_thumb.shape:
+                (dx, dy), _ = cv2.phaseCorrelate(last_thumb, thumb)
+                shift = (dx * frame.shape[1] / MOTION_WIDTH, dy * frame.shape[1] / MOTION_WIDTH)
+            moved = np.hypot(*shift) / frame.shape[1]
+            if moved < min_shift and seconds - last_time < max_gap:
+                timings["tracking"] += time.perf_counter() - started
+                started = time.perf_counter()
+                continue
+        last_thumb, last_time = thumb, seconds
+        timings["tracking"] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        bboxes, kpss = face_analyzer.det_model.detect(frame, max_num=0, metric='default')
+        bboxes = bboxes.astype(np.float32).reshape(-1, 5)
+        kpss = kpss.astype(np.float32).reshape(-1, 5, 2) if kpss is not None else np.empty((0, 5, 2), dtype=np.float32)
+        timings["detection"] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        improved = tracker.update(index, bboxes[:, :4], bboxes[:, 4], shift)
+        timings["tracking"] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        for d, track in improved:
+            track.crop = face_align.norm_crop(frame, landmark=kpss[d], image_size=crop_size)
+        timings["alignment"] += time.perf_counter() - started
+
+        processed.append(index)
+        if len(processed) >= max_frames:
+            break
+        started = time.perf_counter()
+
+    tracks = tracker.tracks
+    return {
+        "tracks": [track.describe() for track in tracks],
+        "qualities": [track.quality for track in tracks],
+        "trackFrames": [track.frame_indices for track in tracks],
+        "crops": np.stack([t.crop for t in tracks]) if tracks else np.empty((0, crop_size, crop_size, 3), dtype=np.uint8),
+        "frames": {"sampled": sampled, "processed": len(processed)},
+        "timings": timings,
+    }
+
+
+def suffix_of(filename: Optional[str]) -> str:
+    return os.path.splitext(filename or "")[1] or ".mp4"
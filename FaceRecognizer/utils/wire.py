@@ -0,0 +1,87 @@
+import struct
+
+import numpy as np
+
+# Binary embedding blob, little-endian throughout:
+#
+#   magic  "FEMB"     4 bytes
+#   version           u8  (1)
+#   dtype             u8  (1 = float32, 2 = float16)
+#   reserved          2 bytes
+#   rows              u32
+#   dim               u32
+#   ids_length        u32 (bytes of the id table)
+#   id table          utf-8, one id per row joined by "\n", zero-padded to 4 bytes
+#   data              rows x dim values
+#
+# The id of a row is the roll number (galleries) or the image name
+# (/generate-embeddings responses).
+MEDIA_TYPE = "application/x-face-embeddings"
+
+MAGIC = b"FEMB"
+VERSION = 1
+HEADER = struct.Struct("<4sBB2xIII")
+
+DTYPES = {1: np.dtype("<f4"), 2: np.dtype("<f2")}
+DTYPE_CODES = {"float32": 1, "float16": 2}
+
+
+class WireFormatError(ValueError):
+    pass
+
+
+def encode_embeddings(ids: list[str], matrix: np.ndarray, dtype: str = "float32") -> bytes:
+    if dtype not in DTYPE_CODES:
+        raise WireFormatError(f"Unsupported dtype '{dtype}'")
+    code = DTYPE_CODES[dtype]
+
+    matrix = np.asarray(matrix).reshape(len(ids), -1) if ids else np.empty((0, 0))
+    rows, dim = matrix.shape
+
+    id_table = "\n".join(ids).encode("utf-8")
+    padding = b"\0" * (-len(id_table) % 4)
+
+    data = np.ascontiguousarray(matrix, dtype=DTYPES[code]).tobytes()
+    return HEADER.pack(MAGIC, VERSION, code, rows, dim, len(id_table)) + id_table + padding + data
+
+
+def decode_embeddings(blob: bytes) -> tuple[list[str], np.ndarray]:
+    """
+    Returns the row ids and a float32 (rows x dim) matrix.
+    """
+    if len(blob) < HEADER.size:
+        raise WireFormatError("Embedding blob is truncated")
+
+    magic, version, code, rows, dim, ids_length = HEADER.unpack_from(blob)
+    if magic != MAGIC or version != VERSION:
+        raise WireFormatError("Not an embedding blob")
+    if code not in DTYPES:
+        raise WireFormatError(f"Unsupported dtype code {code}")
+
+    offset = HEADER.size
+    id_table = bytes(blob[offset:offset + ids_length]).decode("utf-8")
+    ids = id_table.split("\n") if rows else []
+    offset += ids_length + (-ids_length % 4)
+
+    dtype = DTYPES[code]
+    expected = rows * dim * dtype.itemsize
+    if len(ids) != rows or len(blob) - offset != expected:
+        raise WireFormatError("Embedding blob size does not match its header")
+
+    matrix = np.frombuffer(blob, dtype=dtype, count=rows * dim, offset=offset).reshape(rows, dim)
+    return ids, matrix.astype(np.float32)
+
+
+def negotiate(accept: str | None) -> str | None:
+    """
+    Picks the binary dtype from an Accept header such as
+    `application/x-face-embeddings; dtype=float16`. Returns None for JSON.
+    """
+    for part in (accept or "").split(","):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        if media_type != MEDIA_TYPE:
+            continue
+        options = dict(p.split("=", 1) for p in params if "=" in p)
+        dtype = options.get("dtype", "float32")
+        return dtype if dtype in DTYPE_CODES else "float32"
+    return None
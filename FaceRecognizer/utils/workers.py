@@ -0,0 +1,166 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from utils.config import (
+    INFERENCE_BACKEND, INFERENCE_WORKERS, INFERENCE_QUEUE_DEPTH, EMBED_MAX_BATCH, EMBED_MAX_WAIT_MS
+)
+from utils.pipeline import embed_crops, init_worker
+
+
+class ServerBusyError(Exception):
+    pass
+
+
+class InferencePool:
+    """
+    Runs pipeline steps off the asyncio event loop, either on a thread pool
+    sharing one FaceAnalysis, on a process pool where every worker loads its
+    own, or in the inference process shared by every uvicorn worker
+    (utils/inference_server.py). At most `queue_depth` tasks may be in
+    flight; beyond that `run` raises ServerBusyError instead of queueing
+    without bound, unless the caller is willing to `wait` for a slot.
+    """
+
+    def __init__(self, backend: str = INFERENCE_BACKEND, workers: int = INFERENCE_WORKERS,
+                 queue_depth: int = INFERENCE_QUEUE_DEPTH):
+        if backend not in ("thread", "process", "shared"):
+            raise ValueError(f"Unknown inference backend '{backend}'")
+        self.backend = backend
+        self.workers = workers
+        self.queue_depth = max(queue_depth, workers)
+        self.in_flight = 0
+        self._executor = None
+        self._runner = None
+        self._waiters = deque()  # futures of callers waiting for a slot, oldest first
+
+    @property
+    def shares_memory(self) -> bool:
+        return self.backend == "thread"
+
+    def start(self):
+        if self._executor is not None:
+            return
+        if self.backend == "process":
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker)
+            # Spin every worker up now so the first lecture doesn't pay for model loading
+            for future in [self._executor.submit(init_worker) for _ in range(self.workers)]:
+                future.result()
+        elif self.backend == "shared":
+            from utils.inference_server import wait_until_ready
+
+            # Threads here only wait for the inference process
+            self._runner = wait_until_ready()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        else:
+            init_worker()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+            self._runner = None
+
+    async def _acquire(self, wait: float | None):
+        if self.in_flight < self.queue_depth and not self._waiters:
+            self.in_flight += 1
+            return
+        if wait is not None and wait <= 0:
+            raise ServerBusyError(f"{self.in_flight} inference tasks already queued")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # A finishing task hands its slot straight to the oldest waiter
+            await asyncio.wait_for(asyncio.shield(waiter), wait)
+        except BaseException as e:
+            if waiter.done():
+                self._release()  # handed over just as the wait ended
+            else:
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                raise ServerBusyError(f"No free inference slot after {wait:g}s") from None
+            raise
+
+    def _release(self):
+        if self._waiters:
+            self._waiters.popleft().set_result(None)
+        else:
+            self.in_flight -= 1
+
+    async def run(self, fn, *args, wait: float | None = 0.0):
+        """
+        Runs fn(*args) in the pool. With every slot taken, raises
+        ServerBusyError right away (`wait` 0), after waiting `wait` seconds
+        for a slot, or never (`wait` None).
+        """
+        await self._acquire(wait)
+        try:
+            if self._runner is not None:
+                return await asyncio.get_running_loop().run_in_executor(self._executor, self._runner.run, fn, args)
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._release()
+
+
+class EmbeddingBatcher:
+    """
+    Collects aligned face crops from concurrent callers and embeds them with
+    as few ONNX calls as possible. A batch runs once `max_batch` crops are
+    waiting or `max_wait_ms` after its first crop arrived, whichever is first.
+    """
+
+    def __init__(self, pool: InferencePool, max_batch: int = EMBED_MAX_BATCH, max_wait_ms: float = EMBED_MAX_WAIT_MS):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._pending = []
+        self._pending_crops = 0
+        self._timer = None
+        # The event loop only keeps weak references to tasks; these keep running batches alive
+        self._tasks = set()
+
+    async def embed(self, crops: np.ndarray) -> np.ndarray:
+        if len(crops) == 0:
+            return np.empty((0, 512), dtype=np.float32)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((crops, future))
+        self._pending_crops += len(crops)
+
+        if self._pending_crops >= self.max_batch or self.max_wait <= 0:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._pending_crops = self._pending, [], 0
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        try:
+            # Its callers were admitted when their photos were detected, so the batch waits its turn
+            embeddings = await self.pool.run(
+                embed_crops, np.concatenate([crops for crops, _ in batch]), self.max_batch, wait=None
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        offset = 0
+        for crops, future in batch:
+            if not future.done():
+                future.set_result(embeddings[offset:offset + len(crops)])
+            offset += len(crops)